@@ -0,0 +1,240 @@
+"""
+Generates wikitext for many songs at once.
+
+The input is a CSV file (columns: name_japanese, name_chinese, bilibili, canonical, translation;
+a header row is optional), a JSONL file with the same keys, or a VocaDB artist id (--artist) whose
+original songs are streamed from VocaDB page by page. Songs are processed concurrently and
+every prompt is answered by the policies in the batch section of config.yaml, so the batch
+runs unattended. Failures are written to the report instead of stopping the batch; songs
+whose videos could not be fetched are reported as incomplete.
+"""
+import argparse
+import csv
+import json
+import logging
+import re
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Iterable, Dict, Any, Optional, Set, Tuple
+
+from config.config import load_config, get_config, application_path, get_output_path
+from main import create_wikitext, setup_logger, read_ids
+from utils.cassette import setup_cassette
+from utils.helpers import set_prompt_answers
+from utils.image import write_to_file
+from utils.string import is_empty, file_name
+from utils.vocadb import get_song_by_name, get_song_by_id, iter_vocadb
+
+FIELDS = ['name_japanese', 'name_chinese', 'bilibili', 'canonical', 'translation']
+
+PARAMS_DISCOGRAPHY = {
+    # PV ids tell whether a song already has a wikitext under another name
+    'fields': 'PVs',
+    'lang': 'Default',
+    'songTypes': 'Original',
+    'sort': 'PublishDate',
+    'childTags': 'false',
+    # leave out songs the artist only took a minor part in
+    'artistParticipationStatus': 'OnlyMainAlbums',
+    'onlyWithPvs': 'false'
+}
+
+
+@dataclass
+class BatchItem:
+    name_japanese: str
+    name_chinese: str = ""
+    bilibili: str = ""
+    canonical: bool = True
+    # known VocaDB id; skips the search by name
+    vocadb_id: int = 0
+    # text file with pasted bilingual lyrics, used if no translation is found online
+    translation: str = ""
+
+
+@dataclass
+class BatchResult:
+    item: BatchItem
+    status: str
+    output: str = ""
+    error: str = ""
+    seconds: float = 0
+
+
+def parse_bool(s: Any) -> bool:
+    if isinstance(s, bool):
+        return s
+    return is_empty(s) or str(s).strip().lower() in ("1", "true", "yes", "y", "是")
+
+
+def read_csv(path: Path) -> Iterator[BatchItem]:
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        for row in csv.reader(f):
+            row = [cell.strip() for cell in row]
+            if len(row) == 0 or is_empty(row[0]) or row[0].startswith("#") or row[0] == FIELDS[0]:
+                continue
+            row.extend([""] * (len(FIELDS) - len(row)))
+            yield BatchItem(row[0], row[1], row[2], parse_bool(row[3]), translation=row[4])
+
+
+def read_jsonl(path: Path) -> Iterator[BatchItem]:
+    with open(path, encoding="utf-8-sig") as f:
+        for line in f:
+            if is_empty(line):
+                continue
+            obj: dict = json.loads(line)
+            yield BatchItem(obj['name_japanese'], obj.get('name_chinese', ""),
+                            obj.get('bilibili', ""), parse_bool(obj.get('canonical', True)),
+                            int(obj.get('vocadb_id', 0)), obj.get('translation', ""))
+
+
+def read_items(path: Path) -> Iterator[BatchItem]:
+    if path.suffix.lower() in (".jsonl", ".json"):
+        return read_jsonl(path)
+    return read_csv(path)
+
+
+# the Japanese name in the header of a wikitext saved under the Chinese name
+TITLE_REPLACEMENT = re.compile(r"\{\{标题替换\|(?:\{\{lj\|)?([^{}|\n]+)")
+
+
+def existing_songs(output_dir: Path) -> Tuple[Set[str], Set[str]]:
+    """
+    Names and video ids of the songs that already have a wikitext in the directory, whatever the
+    file is called: drafts from main.py are saved under the Chinese name.
+    """
+    names: Set[str] = set()
+    videos: Set[str] = set()
+    for file in output_dir.glob("*.wikitext"):
+        text = file.read_text(encoding="utf-8", errors="replace")
+        names.add(file.stem)
+        names.update(name.strip() for name in TITLE_REPLACEMENT.findall(text))
+        videos.update(read_ids(text).values())
+    return names, videos
+
+
+def read_discography(artist_id: int, output_dir: Path) -> Iterator[BatchItem]:
+    names, videos = existing_songs(output_dir)
+    for song in iter_vocadb({**PARAMS_DISCOGRAPHY, 'artistId[]': artist_id}):
+        name = song['defaultName'].strip()
+        pv_ids = {pv.get('pvId') for pv in song.get('pvs', [])}
+        if name in names or file_name(name) in names or not pv_ids.isdisjoint(videos):
+            logging.info(f"Skipping {name} because its wikitext already exists")
+            continue
+        yield BatchItem(name, vocadb_id=song['id'])
+
+
+def prompt_answers(item: BatchItem) -> Dict[str, Any]:
+    answers: Dict[str, Any] = {
+        'bilibili_link': item.bilibili,
+        'bv_canonical': 1 if item.canonical else 2,
+        # the manual translation window and the uploader note need a human
+        'manual_trans': 2,
+        'uploader_note': 2,
+    }
+    if not is_empty(item.translation):
+        # split by the layout detector instead of the window
+        answers['manual_trans'] = 1
+        answers['manual_lyrics'] = Path(item.translation).read_text(encoding="utf-8-sig")
+    policy = get_config().batch.vocadb_choice
+    if policy == "first":
+        answers['vocadb_song'] = 1
+    elif policy == "none":
+        # the last option is always "None of the above."
+        answers['vocadb_song'] = lambda choices: len(choices)
+    return answers
+
+
+def process_item(item: BatchItem, output_dir: Path) -> BatchResult:
+    start = time.perf_counter()
+    name_chinese = item.name_chinese if not is_empty(item.name_chinese) else item.name_japanese
+    try:
+        # reads the translation file, which may be missing
+        set_prompt_answers(prompt_answers(item))
+        if item.vocadb_id:
+            song = get_song_by_id(item.vocadb_id, item.name_japanese, name_chinese)
+        else:
+            song = get_song_by_name(item.name_japanese, name_chinese)
+        if not song:
+            return BatchResult(item, "failed", error="Song not found on vocadb",
+                               seconds=time.perf_counter() - start)
+        output = output_dir.joinpath(file_name(song.name_chs) + ".wikitext")
+        write_to_file(create_wikitext(song), output)
+        missing = [f"{v.site.value} {v.identifier}" for v in song.videos if v.fallback]
+        if len(missing) > 0:
+            # the wikitext is written, but its view counts (and so its header) need checking
+            return BatchResult(item, "incomplete", output=str(output), error="No video data from " + ", ".join(missing),
+                               seconds=time.perf_counter() - start)
+        return BatchResult(item, "ok", output=str(output), seconds=time.perf_counter() - start)
+    except Exception as e:
+        logging.error(f"Failed to generate {item.name_japanese}")
+        logging.debug(traceback.format_exc())
+        return BatchResult(item, "failed", error=f"{type(e).__name__}: {e}", seconds=time.perf_counter() - start)
+    finally:
+        set_prompt_answers(None)
+
+
+def run_batch(items: Iterable[BatchItem], workers: int, output_dir: Path) -> Iterator[BatchResult]:
+    """
+    Process items concurrently and yield results as they finish. At most 2 * workers items are
+    taken from the iterable ahead of time, so items can be streamed from a large source.
+    """
+    workers = max(1, workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for item in items:
+            pending.add(executor.submit(process_item, item, output_dir))
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
+
+
+def write_report(results: Iterable[BatchResult], report: Path) -> Dict[str, int]:
+    counts: Dict[str, int] = dict()
+    with open(report, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([*FIELDS, 'vocadb_id', 'status', 'output', 'error', 'seconds'])
+        for r in results:
+            counts[r.status] = counts.get(r.status, 0) + 1
+            writer.writerow([r.item.name_japanese, r.item.name_chinese, r.item.bilibili, r.item.canonical,
+                             r.item.translation, r.item.vocadb_id, r.status, r.output, r.error, f"{r.seconds:.2f}"])
+            f.flush()
+            logging.info(f"[{r.status}] {r.item.name_japanese} {r.error}")
+    return counts
+
+
+def main(args: Optional[list] = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", type=Path, nargs="?", default=None, help="CSV or JSONL file listing the songs")
+    parser.add_argument("--artist", type=int, default=None,
+                        help="generate every original song by this VocaDB artist id instead")
+    parser.add_argument("-w", dest="workers", type=int, default=None)
+    parser.add_argument("-r", dest="report", type=Path, default=None)
+    args = parser.parse_args(args)
+    if (args.input is None) == (args.artist is None):
+        parser.error("give either an input file or --artist")
+    sys.stdout.reconfigure(encoding='utf-8')
+    setup_logger()
+    load_config(application_path.joinpath("config.yaml"))
+    setup_cassette()
+    workers = args.workers if args.workers else get_config().batch.workers
+    report = args.report if args.report else get_output_path().joinpath(get_config().batch.report)
+    if args.artist is not None:
+        items = read_discography(args.artist, get_output_path())
+    else:
+        items = read_items(args.input)
+    results = run_batch(items, workers, get_output_path())
+    counts = write_report(results, report)
+    print(", ".join(f"{status}: {count}" for status, count in counts.items()))
+    print("Report written to " + str(report))
+
+
+if __name__ == "__main__":
+    main()
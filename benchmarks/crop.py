@@ -0,0 +1,129 @@
+"""
+Times remove_black_boarders against the previous implementation on letterboxed 4K and 8K covers
+and checks that both produce the same crop. Peak memory is the growth of the resident set size
+of a fresh process running one crop, so Pillow's image memory is counted as well.
+
+python -m benchmarks.crop
+"""
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from utils.image import remove_black_boarders
+
+SIZES = {'4K': (3840, 2160), '8K': (7680, 4320)}
+
+
+def previous_remove_black_boarders(image_in: Path, image_out: Path, crop_threshold: float):
+    img = Image.open(image_in)
+    gray = ImageOps.grayscale(img)
+    img = np.array(img)
+    gray = np.array(gray)
+    row_sums = gray.sum(axis=1) / len(gray[0])
+    column_sums = gray.sum(axis=0) / len(gray)
+
+    def get_nums(arr) -> Tuple[int, int]:
+        start = next((index for index, x in enumerate(arr) if x >= crop_threshold), 0)
+        end = len(arr) - next((index for index, x in enumerate(reversed(arr)) if x >= crop_threshold), 0) - 1
+        return start, end
+
+    y1, y2 = get_nums(row_sums)
+    x1, x2 = get_nums(column_sums)
+    crop = Image.fromarray(img[y1:y2, x1:x2])
+    crop.save(image_out)
+
+
+def letterboxed(size: Tuple[int, int]) -> Image.Image:
+    width, height = size
+    pixels = np.zeros((height, width, 3), dtype=np.uint8)
+    border_y, border_x = height // 8, width // 10
+    y, x = np.mgrid[border_y:height - border_y, border_x:width - border_x]
+    pixels[border_y:height - border_y, border_x:width - border_x, 0] = 40 + x * 200 // width
+    pixels[border_y:height - border_y, border_x:width - border_x, 1] = 40 + y * 200 // height
+    pixels[border_y:height - border_y, border_x:width - border_x, 2] = 120
+    return Image.fromarray(pixels)
+
+
+IMPLEMENTATIONS = {'previous': previous_remove_black_boarders, 'now': remove_black_boarders}
+
+
+def max_rss() -> Optional[int]:
+    status = Path("/proc/self/status")
+    if status.exists():
+        # Linux carries ru_maxrss over from the parent across fork and exec; VmHWM starts afresh
+        for line in status.read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    try:
+        import resource
+    except ImportError:
+        # not available on Windows
+        return None
+    # bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def crop_once(implementation: str, source: str, target: str, threshold: int):
+    baseline = max_rss()
+    IMPLEMENTATIONS[implementation](Path(source), Path(target), threshold)
+    peak = max_rss()
+    print(peak - baseline if baseline is not None else -1)
+
+
+def peak_memory(implementation: str, source: Path, target: Path, threshold: int) -> Optional[int]:
+    output = subprocess.run([sys.executable, "-m", "benchmarks.crop", "--once", implementation, str(source),
+                             str(target), str(threshold)], capture_output=True, text=True, check=True).stdout
+    growth = int(output.split()[-1])
+    return growth if growth >= 0 else None
+
+
+def megabytes(size: Optional[int]) -> str:
+    return f"{size / 2 ** 20:6.1f} MB" if size is not None else "   n/a   "
+
+
+def measure(func: Callable, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", dest="repeat", type=int, default=3)
+    parser.add_argument("-t", dest="threshold", type=int, default=20)
+    parser.add_argument("--once", nargs=4, metavar=("IMPLEMENTATION", "SOURCE", "TARGET", "THRESHOLD"),
+                        help="crop one image and print the growth of the peak RSS in bytes")
+    args = parser.parse_args()
+    if args.once:
+        implementation, source, target, threshold = args.once
+        crop_once(implementation, source, target, int(threshold))
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        for label, size in SIZES.items():
+            source = directory.joinpath(f"{label}.jpg")
+            letterboxed(size).save(source)
+            old, new = directory.joinpath("old.jpg"), directory.joinpath("new.jpg")
+            old_time = measure(lambda: previous_remove_black_boarders(source, old, args.threshold), args.repeat)
+            new_time = measure(lambda: remove_black_boarders(source, new, args.threshold), args.repeat)
+            old_peak = peak_memory('previous', source, old, args.threshold)
+            new_peak = peak_memory('now', source, new, args.threshold)
+            same = np.array_equal(np.asarray(Image.open(old)), np.asarray(Image.open(new)))
+            decoded = size[0] * size[1] * 3
+            print(f"{label} (decoded {megabytes(decoded)}): previous {old_time * 1000:7.0f} ms, {megabytes(old_peak)}   "
+                  f"now {new_time * 1000:7.0f} ms, {megabytes(new_peak)}   "
+                  f"speedup {old_time / new_time:4.1f}x   {'same crop' if same else 'CROP DIFFERS'}")
+
+
+if __name__ == "__main__":
+    main()
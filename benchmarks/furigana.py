@@ -0,0 +1,120 @@
+"""
+Times furigana_local against the previous implementation on a corpus of long lyric files and
+checks that both give the same output.
+
+python -m benchmarks.furigana
+"""
+import argparse
+import functools
+import random
+import time
+from typing import Callable, Dict, Tuple
+
+from utils.japanese import furigana_local, is_kanji, is_kana
+
+KANJI = "漢字心踊重甜繰返夢花空雨々"
+KANA = "かんじこころおどりゆめはなそらアイウエオー"
+OTHER = "、。！？ 　abc歌詞"
+
+
+def previous_furigana_local(lyrics: str) -> str:
+    open_parentheses = ['(', '（']
+    closing_parentheses = [')', '）']
+    lines = lyrics.split("\n")
+    result = []
+    for line in lines:
+        prev_end = 0
+        line_result = []
+        for index in range(len(line)):
+            if index < prev_end:
+                continue
+            if line[index] not in open_parentheses or index == 0 or not is_kanji(line[index - 1]):
+                continue
+            symbol = closing_parentheses[open_parentheses.index(line[index])]
+            close_index = line.find(symbol, index + 1)
+            furigana = line[index + 1:close_index]
+            if close_index == -1 or index + 1 == close_index or \
+                    not functools.reduce(lambda a, b: a and b,
+                                         [is_kana(c) for c in furigana]):
+                continue
+            kanji_start = index - 1
+            while kanji_start >= 0 and is_kanji(line[kanji_start]):
+                kanji_start -= 1
+            kanji_start += 1
+            if kanji_start > 0:
+                line_result.append(line[prev_end:kanji_start])
+            line_result.append(f"{{{{photrans|{line[kanji_start:index]}|{furigana}"
+                               f"}}}}")
+            prev_end = close_index + 1
+        line_result.append(line[prev_end:])
+        result.append("".join(line_result))
+    return "\n".join(result)
+
+
+def word(rng: random.Random, alphabet: str, low: int, high: int) -> str:
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(low, high)))
+
+
+def lyric_line(rng: random.Random) -> str:
+    parts = []
+    for _ in range(rng.randint(2, 8)):
+        kind = rng.random()
+        if kind < 0.4:
+            opening, closing = rng.choice([("(", ")"), ("（", "）")])
+            parts.append(word(rng, KANJI, 1, 3) + opening + word(rng, KANA, 1, 5) + closing)
+        elif kind < 0.7:
+            parts.append(word(rng, KANA + OTHER, 1, 6))
+        else:
+            parts.append(word(rng, KANJI, 1, 4))
+    return "".join(parts)
+
+
+def nested_line(rng: random.Random) -> str:
+    # readings inside readings, mismatched widths and parentheses that never close
+    pieces = [word(rng, KANJI, 1, 2) + "(" + word(rng, KANJI, 1, 2) + "(" + word(rng, KANA, 1, 3) + "))",
+              word(rng, KANJI, 1, 2) + "（" + word(rng, KANA, 1, 3) + ")",
+              word(rng, KANJI, 1, 2) + "(" + word(rng, KANA, 1, 3),
+              word(rng, KANJI, 1, 2) + "()"]
+    return "".join(rng.choice(pieces) for _ in range(rng.randint(3, 10)))
+
+
+def unbalanced_line(rng: random.Random, length: int) -> str:
+    # every "(" after a kanji made the previous version search to the end of the line
+    return "".join(rng.choice(KANJI) + "(" + rng.choice(KANA) for _ in range(length)) + ")"
+
+
+def corpus(lines: int, seed: int = 0) -> Dict[str, str]:
+    rng = random.Random(seed)
+    return {
+        'lyrics': "\n".join(lyric_line(rng) for _ in range(lines)),
+        'nested': "\n".join(nested_line(rng) for _ in range(lines)),
+        'unbalanced': "\n".join(unbalanced_line(rng, 200) for _ in range(lines // 200)),
+    }
+
+
+def measure(func: Callable[[str], str], text: str, repeat: int) -> Tuple[float, str]:
+    best = float('inf')
+    output = ""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = func(text)
+        best = min(best, time.perf_counter() - start)
+    return best, output
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", dest="repeat", type=int, default=3)
+    parser.add_argument("-l", dest="lines", type=int, default=20000)
+    args = parser.parse_args()
+    for label, text in corpus(args.lines).items():
+        old_time, old_output = measure(previous_furigana_local, text, args.repeat)
+        new_time, new_output = measure(furigana_local, text, args.repeat)
+        size = len(text.encode("utf-8")) / 2 ** 20
+        print(f"{label:>10}: {size:5.1f} MB   previous {old_time * 1000:7.0f} ms ({size / old_time:6.2f} MB/s)   "
+              f"now {new_time * 1000:6.0f} ms ({size / new_time:6.1f} MB/s)   speedup {old_time / new_time:5.1f}x   "
+              f"{'same output' if old_output == new_output else 'OUTPUT DIFFERS'}")
+
+
+if __name__ == "__main__":
+    main()
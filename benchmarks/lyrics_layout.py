@@ -0,0 +1,134 @@
+"""
+Times detect_layout against the previous layout inference of the lyrics window on large pasted
+translations and checks that both split them the same way.
+
+python -m benchmarks.lyrics_layout
+"""
+import argparse
+import random
+import re
+import time
+from collections import Counter
+from itertools import groupby
+from typing import Callable, Dict, Optional, Tuple
+
+from utils.japanese import is_kana, is_kanji
+from utils.lyrics_layout import detect_layout, process_translation
+from utils.string import is_empty
+
+Streams = Tuple[str, str, str]
+
+KANA = "かんじこころおどりゆめはなそら"
+KANJI = "漢字心踊重甜繰返夢花空雨"
+HANZI = "我你他的梦花空雨心跳动了个"
+ROMAJI = "abcdefghijkmnoprstuwyz"
+
+
+def previous_layout(text: str) -> Optional[Streams]:
+    """
+    blob_translation and auto_line_numbers as they were, without the window.
+    """
+    jap_lines = []
+    chs_lines = []
+    for blob in re.split("\n\n+", text):
+        lines = blob.split("\n")
+        if len(lines) % 2 != 0:
+            break
+        half = len(lines) // 2
+        jap_lines.extend(lines[:half])
+        chs_lines.extend(lines[half:])
+        jap_lines.append("")
+        chs_lines.append("")
+    else:
+        jap_text = "\n".join(jap_lines).strip()
+        chs_text = "\n".join(chs_lines).strip()
+        if not any(is_kana(c) for c in chs_text):
+            return jap_text, chs_text, ""
+    groups = [len(list(repeat)) for char, repeat in groupby(text) if char == '\n']
+    possibilities = list(Counter(groups).keys())
+    split = text
+    while len(possibilities) > 0:
+        split = split.split("\n" * possibilities[-1])
+        for section in split:
+            if len(section.split("\n")) != len(split[0].split("\n")):
+                break
+        else:
+            break
+        split = split[0].strip()
+        possibilities.pop()
+    if len(possibilities) == 0:
+        return None
+    group_length = len(split[0].split("\n")) + 1
+    numbers: Dict[str, int] = {}
+    for line_number, line in enumerate(text.split("\n")[0:group_length]):
+        if any([is_kana(c) for c in line]):
+            numbers['jap'] = line_number + 1
+        if any([is_kanji(c) for c in line]) and all([not is_kana(c) for c in line]):
+            numbers['chs'] = line_number + 1
+        if all([c.isascii() for c in line]) and not is_empty(line):
+            numbers['roma'] = line_number + 1
+    return tuple(process_translation(text, group_length, numbers[k]) if k in numbers else ""
+                 for k in ('jap', 'chs', 'roma'))
+
+
+def current_layout(text: str) -> Optional[Streams]:
+    layout = detect_layout(text)
+    return (layout.japanese, layout.chinese, layout.romaji) if layout.confidence > 0 else None
+
+
+def line(rng: random.Random, alphabet: str, low: int, high: int) -> str:
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(low, high)))
+
+
+def japanese_line(rng: random.Random) -> str:
+    return line(rng, KANJI, 1, 3) + line(rng, KANA, 2, 8) + line(rng, KANJI, 0, 2)
+
+
+def groups_text(rng: random.Random, groups: int) -> str:
+    stanzas = []
+    while groups > 0:
+        # stanzas of different lengths, as in real songs
+        size = min(groups, rng.randint(4, 8))
+        groups -= size
+        stanzas.append("\n\n".join(f"{japanese_line(rng)}\n{line(rng, HANZI, 4, 12)}\n{line(rng, ROMAJI, 8, 30)}"
+                                   for _ in range(size)))
+    return "\n\n\n".join(stanzas)
+
+
+def blocks_text(rng: random.Random, groups: int) -> str:
+    blocks = []
+    while groups > 0:
+        size = min(groups, rng.randint(2, 6))
+        groups -= size
+        blocks.append("\n".join([japanese_line(rng) for _ in range(size)] +
+                                [line(rng, HANZI, 4, 12) for _ in range(size)]))
+    return "\n\n".join(blocks)
+
+
+def measure(func: Callable[[str], Optional[Streams]], text: str, repeat: int) -> Tuple[float, Optional[Streams]]:
+    best = float('inf')
+    output = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = func(text)
+        best = min(best, time.perf_counter() - start)
+    return best, output
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", dest="repeat", type=int, default=3)
+    args = parser.parse_args()
+    rng = random.Random(0)
+    for groups in (1000, 10000, 50000):
+        for label, text in (("groups", groups_text(rng, groups)), ("blocks", blocks_text(rng, groups))):
+            old_time, old_output = measure(previous_layout, text, args.repeat)
+            new_time, new_output = measure(current_layout, text, args.repeat)
+            size = len(text.encode("utf-8")) / 2 ** 20
+            print(f"{label} x{groups:>6}: {size:5.1f} MB   previous {old_time * 1000:7.0f} ms   "
+                  f"now {new_time * 1000:6.0f} ms   speedup {old_time / new_time:5.1f}x   "
+                  f"{'same streams' if old_output == new_output else 'STREAMS DIFFER'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Replays a cassette recorded by main.py (http.cassette_mode: record) through the whole
+pipeline without network access and reports how long each run takes.
+
+python -m benchmarks.replay_pipeline output/session.cassette -n 10
+"""
+import argparse
+import logging
+import time
+from pathlib import Path
+
+from config.config import load_config
+from i18n.i18n import _
+from main import create_wikitext
+from utils.cassette import use_cassette, REPLAY
+from utils.helpers import prompt_response
+from utils.string import is_empty
+from utils.vocadb import get_song_by_name
+
+
+def run_once() -> str:
+    name_japanese = prompt_response(_("name_original"))
+    name_chinese = prompt_response(_("name_trans"))
+    if is_empty(name_chinese):
+        name_chinese = name_japanese
+    song = get_song_by_name(name_japanese, name_chinese)
+    if not song:
+        raise RuntimeError("Song not found in cassette")
+    return create_wikitext(song)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("cassette", type=Path)
+    parser.add_argument("-n", dest="repeat", type=int, default=5)
+    parser.add_argument("-c", dest="config", type=Path, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    if args.config:
+        load_config(args.config)
+    timings = []
+    outputs = set()
+    with use_cassette(args.cassette, REPLAY) as cassette:
+        for _ in range(args.repeat):
+            cassette.rewind()
+            start = time.perf_counter()
+            outputs.add(run_once())
+            timings.append(time.perf_counter() - start)
+    print(f"runs: {len(timings)}  best: {min(timings) * 1000:.1f} ms  "
+          f"mean: {sum(timings) / len(timings) * 1000:.1f} ms")
+    print("output is deterministic" if len(outputs) == 1 else f"output differs between runs ({len(outputs)} variants)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Compares the streaming watch page extractor with the full BeautifulSoup parser. Pages are served
+from a local HTTP server so that both paths go through the real session; bytes transferred (before
+content decoding) and parse time are reported per site.
+
+python -m benchmarks.video_pages
+python -m benchmarks.video_pages --nico saved_nico.html --youtube saved_youtube.html
+
+Without saved pages, synthetic pages shaped like the real ones are used: the JSON-LD block of a
+Nico page is in the head, the microformat meta tags of a YouTube page follow the player script.
+"""
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from models.video import NC_FIELDS, YT_FIELDS, fetch_page_fields, parse_nc_page, parse_yt_page
+from utils.helpers import http_get
+
+NICO_HEAD = """<!DOCTYPE html><html><head><meta charset="utf-8">
+<meta name="thumbnail" content="https://nicovideo.cdn.nimg.jp/thumbnails/1/1.12345.L">
+<script type="application/ld+json">{"@context":"http://schema.org","@type":"VideoObject","name":"test",
+"uploadDate":"2020-01-02T19:00:00+09:00","interactionStatistic":[{"@type":"InteractionCounter",
+"interactionType":"http://schema.org/WatchAction","userInteractionCount":1234567}]}</script>
+"""
+
+YT_METAS = """<div id="watch7-content"><meta itemprop="name" content="test">
+<meta itemprop="interactionCount" content="7654321"><meta itemprop="datePublished" content="2020-01-02">
+</div>"""
+
+
+def filler(size: int) -> str:
+    line = '<script>var data = {"key": "value", "list": [1, 2, 3], "text": "lorem ipsum dolor sit amet"};</script>\n'
+    return line * (size // len(line))
+
+
+def synthetic_nico() -> bytes:
+    return (NICO_HEAD + filler(20 * 1024) + "</head><body>" + filler(300 * 1024) + "</body></html>").encode("utf-8")
+
+
+def synthetic_youtube() -> bytes:
+    return ("<!DOCTYPE html><html><head>" + filler(150 * 1024) + "</head><body>" + filler(100 * 1024) +
+            YT_METAS + filler(600 * 1024) + "</body></html>").encode("utf-8")
+
+
+def serve(pages: Dict[str, bytes]) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = pages[self.path]
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # the streaming extractor hangs up early
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(repeat: int, func: Callable[[], int]):
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = func()
+        timings.append(time.perf_counter() - start)
+    return size, min(timings)
+
+
+def full_parse(url: str, parse: Callable) -> int:
+    response = http_get(url, use_proxy=False, cache=False, stream=True)
+    parse("id", url, response.text)
+    # bytes off the connection, as counted by the streaming extractor
+    return response.raw.tell()
+
+
+def streaming(url: str, matchers: dict) -> int:
+    extraction = fetch_page_fields(url, matchers)
+    assert extraction.complete(matchers), "streaming extractor did not find every field"
+    return extraction.bytes_read
+
+
+def load(path: Optional[Path], fallback: Callable[[], bytes]) -> bytes:
+    return path.read_bytes() if path else fallback()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nico", type=Path, default=None, help="saved nicovideo.jp watch page")
+    parser.add_argument("--youtube", type=Path, default=None, help="saved youtube.com watch page")
+    parser.add_argument("-n", dest="repeat", type=int, default=10)
+    args = parser.parse_args()
+    pages = {'/nico': load(args.nico, synthetic_nico), '/youtube': load(args.youtube, synthetic_youtube)}
+    server = serve(pages)
+    base = f"http://127.0.0.1:{server.server_port}"
+    sites = [("niconico", base + "/nico", parse_nc_page, NC_FIELDS),
+             ("YouTube", base + "/youtube", parse_yt_page, YT_FIELDS)]
+    try:
+        for site, url, parse, matchers in sites:
+            full_size, full_time = measure(args.repeat, lambda: full_parse(url, parse))
+            stream_size, stream_time = measure(args.repeat, lambda: streaming(url, matchers))
+            print(f"{site:9} full parser: {full_size / 1024:7.1f} KB {full_time * 1000:7.1f} ms   "
+                  f"streaming: {stream_size / 1024:7.1f} KB {stream_time * 1000:7.1f} ms")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Fills a throwaway VocaDB index with synthetic songs and times exact and full text lookups.
+
+python -m benchmarks.vocadb_index -n 300000
+"""
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from utils.vocadb_index import VocaDBIndex
+
+KANA = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+
+
+def random_name(r: random.Random) -> str:
+    return "".join(r.choice(KANA) for _ in range(r.randint(3, 10)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", dest="songs", type=int, default=300000)
+    parser.add_argument("-q", dest="queries", type=int, default=1000)
+    args = parser.parse_args()
+    r = random.Random(0)
+    names = [random_name(r) for _ in range(args.songs)]
+    with tempfile.TemporaryDirectory() as directory:
+        index = VocaDBIndex(Path(directory).joinpath("index.sqlite3"))
+        start = time.perf_counter()
+        chunk = 5000
+        for i in range(0, args.songs, chunk):
+            index.add_songs([{'id': j, 'defaultName': names[j], 'additionalNames': names[j][::-1],
+                              'artistString': f"P{j % 5000} feat. 初音ミク", 'songType': 'Original'}
+                             for j in range(i, min(i + chunk, args.songs))])
+        print(f"insert: {args.songs} songs in {time.perf_counter() - start:.1f} s")
+        for label, lookup in [("exact", lambda q: index.find_songs(q, "Original")),
+                              ("full text", lambda q: index.search(q[1:4]))]:
+            queries = [r.choice(names) for _ in range(args.queries)]
+            start = time.perf_counter()
+            for q in queries:
+                lookup(q)
+            print(f"{label}: {(time.perf_counter() - start) / args.queries * 1000:.3f} ms per lookup")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
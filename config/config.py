@@ -5,7 +5,7 @@ import re
 import sys
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Union, Optional
+from typing import Union, Optional, Dict
 
 import yaml
 from yaml import Loader
@@ -42,7 +42,81 @@ class ImageConfig(yaml.YAMLObject):
     download_all: bool = False
     crop: bool = True
     crop_threshold: int = 20
+    # pick the threshold per image when nobody is around to adjust it (batch mode)
+    auto_crop_threshold: bool = True
     auto_upload: bool = False
+    # keep perceptual hashes and sizes of cover thumbnails in a local database
+    cache: bool = False
+    cache_path: str = "images.sqlite3"
+    # some sites keep the thumbnail url when the thumbnail is replaced
+    cache_ttl_days: float = 7
+
+
+@dataclass
+class HttpConfig(yaml.YAMLObject):
+    yaml_tag = u'!HttpConfig'
+    timeout: float = 30
+    retries: int = 3
+    backoff_factor: float = 0.5
+    pool_connections: int = 10
+    pool_maxsize: int = 10
+    pool_block: bool = False
+    cassette: str = "session.cassette"
+    cassette_mode: str = ""
+
+
+@dataclass
+class CacheConfig(yaml.YAMLObject):
+    yaml_tag = u'!CacheConfig'
+    enabled: bool = False
+    directory: str = "cache"
+    max_size_mb: int = 500
+    default_ttl_hours: float = 24
+    ttl_hours: Dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class BatchConfig(yaml.YAMLObject):
+    yaml_tag = u'!BatchConfig'
+    workers: int = 4
+    vocadb_choice: str = "first"
+    report: str = "batch_report.csv"
+
+
+@dataclass
+class IndexConfig(yaml.YAMLObject):
+    yaml_tag = u'!IndexConfig'
+    enabled: bool = False
+    path: str = "vocadb.sqlite3"
+    # hours after a sync of all songs during which searches are answered from the index alone
+    fresh_hours: float = 24
+
+
+@dataclass
+class VideoConfig(yaml.YAMLObject):
+    yaml_tag = u'!VideoConfig'
+    # seconds to wait for each video, once its site has a free slot, before falling back to zero views
+    timeout: float = 20
+    # concurrent requests per site, keyed by VideoSite value
+    concurrency: Dict[str, int] = field(default_factory=dict)
+    # keep upload dates and thumbnails of fetched videos in a local database
+    cache: bool = False
+    cache_path: str = "videos.sqlite3"
+    # how long a cached view count is trusted
+    views_ttl_hours: float = 24
+    # view counts this many times below the next milestone are refetched this many times less often
+    far_factor: float = 3
+
+
+@dataclass
+class LyricsConfig(yaml.YAMLObject):
+    yaml_tag = u'!LyricsConfig'
+    # keep fetched lyrics, and songs that have none, in a local database
+    store: bool = False
+    path: str = "lyrics.sqlite3"
+    ttl_days: float = 30
+    # songs without lyrics are looked up again sooner, since translations get added
+    miss_ttl_hours: float = 24
 
 
 @dataclass
@@ -56,6 +130,12 @@ class Config(yaml.YAMLObject):
     wikitext: WikitextConfig = field(default_factory=WikitextConfig)
     color: ColorConfig = field(default_factory=ColorConfig)
     image: ImageConfig = field(default_factory=ImageConfig)
+    http: HttpConfig = field(default_factory=HttpConfig)
+    cache: CacheConfig = field(default_factory=CacheConfig)
+    batch: BatchConfig = field(default_factory=BatchConfig)
+    index: IndexConfig = field(default_factory=IndexConfig)
+    video: VideoConfig = field(default_factory=VideoConfig)
+    lyrics: LyricsConfig = field(default_factory=LyricsConfig)
 
 
 config_xxx = Config()
@@ -1 +0,0 @@
-name_japanese = ""
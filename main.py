@@ -1,23 +1,25 @@
 import asyncio
 import logging
 import os
+import re
 import sys
 import traceback
 import webbrowser
-from typing import List
+from typing import List, Dict
 
-from config import data
 from config.config import load_config, get_config, application_path, get_output_path
 from models.creators import Person, person_list_to_str, Staff, role_priority
 from models.song import Song, Lyrics
-from models.video import VideoSite, Video, view_count_from_site, get_video, only_canonical_videos
+from models.video import VideoSite, Video, view_count_from_site, get_video, only_canonical_videos, \
+    HALL_OF_FAME_VIEWS, LEGEND_VIEWS
 from utils import login
+from utils.cassette import setup_cassette
 from utils.helpers import prompt_choices, prompt_response, prompt_multiline
 from utils.image import write_to_file
 from utils.mgp import get_producer_info
 from utils.name_converter import name_to_cat, name_to_chinese, vocaloid_names, UTAU_CHARACTERS, CEVIO_CHARACTERS
 from utils.save_input import setup_save_input
-from utils.string import auto_lj, is_empty, datetime_to_ymd, assert_str_exists, join_string
+from utils.string import auto_lj, is_empty, datetime_to_ymd, assert_str_exists, join_string, file_name
 from utils.upload import upload_image
 from utils.vocadb import get_song_by_name
 
@@ -43,15 +45,22 @@ def videos_to_str(videos: List[Video]) -> List[str]:
     return result
 
 
+LEGEND_HEADER = "{{VOCALOID传说曲题头}}"
+HALL_OF_FAME_HEADER = "{{VOCALOID殿堂曲题头}}"
+
+
+def milestone_header(nico_views: int) -> str:
+    if nico_views >= LEGEND_VIEWS:
+        return LEGEND_HEADER + "\n"
+    if nico_views >= HALL_OF_FAME_VIEWS:
+        return HALL_OF_FAME_HEADER + "\n"
+    return ""
+
+
 def create_header(song: Song) -> str:
     videos = sorted(song.videos, key=lambda v: v.uploaded)
     nico = get_video(videos, VideoSite.NICO_NICO)
-    top = ""
-    if nico and nico.views >= 100000:
-        if nico.views >= 1000000:
-            top = "{{VOCALOID传说曲题头}}\n"
-        else:
-            top = "{{VOCALOID殿堂曲题头}}\n"
+    top = milestone_header(nico.views) if nico else ""
     if song.name_chs != song.name_jap:
         top += "{{标题替换|" + auto_lj(song.name_jap) + "}}\n"
     sites = {
@@ -79,6 +88,17 @@ def create_header(song: Song) -> str:
 """
 
 
+# an empty parameter must not take the next line as its value
+SONGBOX_ID = re.compile(r"^\|[ \t]*(nnd_id|yt_id|bb_id)[ \t]*=[ \t]*(\S+)", re.MULTILINE)
+
+
+def read_ids(text: str) -> Dict[str, str]:
+    """
+    The video ids in the Songbox of a wikitext written by create_header.
+    """
+    return {key: value for key, value in SONGBOX_ID.findall(text)}
+
+
 def videos_to_str2(videos: List[Video]):
     videos = only_canonical_videos(videos)
     dates = dict()
@@ -232,7 +252,7 @@ def setup_logger():
 def create_uploader_note(song: Song) -> str:
     if not get_config().wikitext.uploader_note:
         return ""
-    response = prompt_choices(_("uploader_note"), choices=["Yes", "No"])
+    response = prompt_choices(_("uploader_note"), choices=["Yes", "No"], key="uploader_note")
     if response == 2:
         return ""
     japanese = prompt_multiline(_("uploader_note_jap"),
@@ -249,29 +269,33 @@ def create_uploader_note(song: Song) -> str:
 """
 
 
+def create_wikitext(song: Song) -> str:
+    header = create_header(song)
+    uploader_note = create_uploader_note(song)
+    intro = create_intro(song)
+    song_body = create_song(song)
+    lyrics = create_lyrics(song.lyrics)
+    end = create_end(song)
+    return "\n".join([header, uploader_note, intro, song_body, lyrics, end])
+
+
 def main():
     sys.stdout.reconfigure(encoding='utf-8')
     setup_logger()
     load_config(application_path.joinpath("config.yaml"))
+    setup_cassette()
     setup_save_input(get_config().save_to_file)
     if get_config().image.auto_upload:
         login.main()
-    data.name_japanese = prompt_response(_("name_original"))
+    name_japanese = prompt_response(_("name_original"))
     name_chinese = prompt_response(_("name_trans"))
     if is_empty(name_chinese):
-        name_chinese = data.name_japanese
-    song = get_song_by_name(data.name_japanese, name_chinese)
+        name_chinese = name_japanese
+    song = get_song_by_name(name_japanese, name_chinese)
     if not song:
         raise NotImplementedError(_("only_vocadb"))
-    header = create_header(song)
-    uploader_note = create_uploader_note(song)
-    intro = create_intro(song)
-    song_body = create_song(song)
-    lyrics = create_lyrics(song.lyrics)
-    end = create_end(song)
-    wikitext_dir = get_output_path().joinpath(f"{song.name_chs}.wikitext")
-    write_to_file("\n".join([header, uploader_note, intro, song_body, lyrics, end]),
-                  wikitext_dir)
+    wikitext_dir = get_output_path().joinpath(file_name(song.name_chs) + ".wikitext")
+    write_to_file(create_wikitext(song), wikitext_dir)
     if song.image.path and get_config().image.auto_upload:
         response = prompt_choices("Upload image to commons?", ["Yes", "No"])
         if response == 1:
@@ -1,5 +1,7 @@
 import dataclasses
 
+from utils import color_math
+
 
 @dataclasses.dataclass
 class Color:
@@ -17,24 +19,13 @@ class Color:
         raise IndexError("A color only has length 3.")
 
     def perceived_lightness(self) -> int:
-        vR = self.red / 255
-        vG = self.green / 255
-        vB = self.blue / 255
-
-        def rgb_to_linear(color_channel):
-            if color_channel <= 0.04045:
-                return color_channel / 12.92
-            else:
-                return pow(((color_channel + 0.055) / 1.055), 2.4)
-
-        Y = (0.2126 * rgb_to_linear(vR) +
-             0.7152 * rgb_to_linear(vG) +
-             0.0722 * rgb_to_linear(vB))
-        if Y <= (216 / 24389):
-            ans = Y * (24389 / 27)
-        else:
-            ans = pow(Y, (1 / 3)) * 116 - 16
-        return round(ans)
+        return color_math.perceived_lightness(self.red, self.green, self.blue)
+
+    def relative_luminance(self) -> float:
+        return color_math.relative_luminance(self.red, self.green, self.blue)
+
+    def contrast_ratio(self, other: "Color") -> float:
+        return color_math.contrast_ratio((self.red, self.green, self.blue), (other.red, other.green, other.blue))
 
     def to_hex(self) -> str:
         return '#%02x%02x%02x' % (self.red, self.green, self.blue)
@@ -49,14 +40,16 @@ def white():
 
 
 def get_text_color(c: Color) -> Color:
-    white = Color(255, 255, 255)
-    num = c.perceived_lightness()
-    if num > white.perceived_lightness() / 2:
+    if color_math.prefers_black_text(c.red, c.green, c.blue):
         return Color(0, 0, 0)
-    return white
+    return Color(255, 255, 255)
 
 
 @dataclasses.dataclass
 class ColorScheme:
     text: Color
     background: Color = None
+
+    def contrast_ratio(self) -> float:
+        background = self.background if self.background is not None else white()
+        return self.text.contrast_ratio(background)
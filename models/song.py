@@ -1,15 +1,13 @@
-import re
-from collections import Counter
+import logging
 from dataclasses import dataclass, field
-from itertools import groupby
 from pathlib import Path
 from typing import List, Dict
 
 from models.color import ColorScheme
 from models.creators import Creators, Person
 from models.video import Video
-from utils.helpers import prompt_response, prompt_multiline, prompt_choices, prompt_number
-from utils.japanese import is_kana, is_kanji
+from utils.helpers import prompt_response, prompt_multiline, prompt_choices, prompt_number, is_interactive
+from utils.lyrics_layout import detect_layout, Layout, process_translation, MIN_CONFIDENCE, JAPANESE, CHINESE, ROMAJI
 from utils.string import is_empty
 
 import tkinter as tk
@@ -47,28 +45,30 @@ class Song:
     colors: ColorScheme = None
 
 
-def process_translation(translation: str, group_length: int, target_line: int) -> str:
-    index = 0
-    result = []
-    lines: List[str] = translation.split("\n")
-    while index < len(lines):
-        if is_empty(lines[index]):
-            if len(lines) > 0 and not is_empty(result[-1]):
-                result.append("")
-            index += 1
-        else:
-            if index + target_line - 1 >= len(lines):
-                break
-            result.append(lines[index + target_line - 1])
-            index += group_length
-    return "\n".join(result)
-
-
 def get_text(t: tk.Text) -> str:
     return t.get("1.0", tk.END).strip()
 
 
+def lyrics_from_text(text: str, translator: str = "", source_name: str = "", source_url: str = "") -> Lyrics:
+    """
+    Split pasted bilingual lyrics without asking anybody. Returns empty Lyrics if the layout
+    can't be trusted.
+    """
+    return lyrics_from_layout(detect_layout(text), translator, source_name, source_url)
+
+
+def lyrics_from_layout(layout: Layout, translator: str = "", source_name: str = "", source_url: str = "") -> Lyrics:
+    if layout.confidence < MIN_CONFIDENCE:
+        logging.warning(f"Can't tell the layout of the translation ({layout.confidence:.0%} of the lines fit)")
+        return Lyrics()
+    return Lyrics(translator=translator, source_name=source_name, source_url=source_url,
+                  lyrics_chs=layout.chinese, lyrics_jap=layout.japanese,
+                  lyrics_roma=layout.romaji if not is_empty(layout.romaji) else None)
+
+
 def get_manual_lyrics() -> Lyrics:
+    if not is_interactive():
+        return lyrics_from_text(prompt_response("Translation:", auto_strip=False, key="manual_lyrics"))
     root = tk.Tk("LyricsSelector")
     TRANSLATION_ROW_SPAN = 6
     translation = tk.Text(root, height=40, width=80)
@@ -91,57 +91,19 @@ def get_manual_lyrics() -> Lyrics:
     roma = tk.Text(root, height=10)
     buttons = tk.PanedWindow(root)
 
-    def blob_translation(text: str) -> bool:
-        jap_lines = []
-        chs_lines = []
-        blobs = re.split("\n\n+", text)
-        for blob in blobs:
-            lines = blob.split("\n")
-            if len(lines) % 2 != 0:
-                return False
-            half = len(lines) // 2
-            jap_lines.extend(lines[:half])
-            chs_lines.extend(lines[half:])
-            jap_lines.append("")
-            chs_lines.append("")
-        jap_text = "\n".join(jap_lines).strip()
-        chs_text = "\n".join(chs_lines).strip()
-        if any(is_kana(c) for c in chs_text):
-            return False
-        jap.replace("1.0", tk.END, jap_text)
-        chs.replace("1.0", tk.END, chs_text)
-        return True
-
     def auto_line_numbers():
-        translation_text: str = get_text(translation)
-        if blob_translation(translation_text):
-            return
-        groups = [len(list(repeat)) for char, repeat in groupby(translation_text) if char == '\n']
-        possibilities = list(Counter(groups).keys())
-        text = translation_text
-        while len(possibilities) > 0:
-            text = text.split("\n" * possibilities[-1])
-            for section in text:
-                if len(section.split("\n")) != len(text[0].split("\n")):
-                    break
-            else:
-                break
-            text = text[0].strip()
-            possibilities.pop()
-        if len(possibilities) == 0:
+        layout = detect_layout(get_text(translation))
+        if layout.confidence == 0:
             print("Failed...")
             return
-        group_length = len(text[0].split("\n")) + 1
-        entries['group_length'].set(str(group_length))
-        section1 = translation_text.split("\n")[0:group_length]
-        for line_number, line in enumerate(section1):
-            if any([is_kana(c) for c in line]):
-                entries['jap_line'].set(str(line_number + 1))
-            if any([is_kanji(c) for c in line]) and all([not is_kana(c) for c in line]):
-                entries['chs_line'].set(str(line_number + 1))
-            if all([c.isascii() for c in line]) and not is_empty(line):
-                entries['roma_line'].set(str(line_number + 1))
-        convert_translation()
+        if layout.confidence < MIN_CONFIDENCE:
+            print(f"Not sure about the layout ({layout.confidence:.0%} of the lines fit). Please check.")
+        entries['group_length'].set(str(layout.group_length) if layout.group_length else "")
+        for kind, entry in ((JAPANESE, 'jap_line'), (CHINESE, 'chs_line'), (ROMAJI, 'roma_line')):
+            entries[entry].set(str(layout.lines[kind]) if kind in layout.lines else "")
+        jap.replace("1.0", tk.END, layout.japanese)
+        chs.replace("1.0", tk.END, layout.chinese)
+        roma.replace("1.0", tk.END, layout.romaji)
 
     auto = tk.Button(buttons, text="auto", command=auto_line_numbers)
 
@@ -1,16 +1,28 @@
 import json
 import logging
 import re
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor, TimeoutError
 from datetime import datetime
 from enum import Enum
-from typing import Union, List
+from typing import Union, List, Optional, Tuple, Dict
 
 import requests
 from bs4 import BeautifulSoup
 
+from config.config import get_config
 from i18n.i18n import _
-from utils.helpers import prompt_response, prompt_choices, http_get
+from utils.helpers import prompt_response, prompt_choices, http_get, timed
+from utils.session import attempt_timeout
+from utils.stream import extract_fields, Extraction
 from utils.string import split_number
+from utils.video_cache import get_video_cache, CachedVideo
+
+
+# Nico view counts that make a song 殿堂曲 and 传说曲
+HALL_OF_FAME_VIEWS = 100000
+LEGEND_VIEWS = 1000000
 
 
 class VideoSite(Enum):
@@ -21,7 +33,7 @@ class VideoSite(Enum):
 
 class Video:
     def __init__(self, site: VideoSite, identifier: str, url: str, views: int, uploaded: datetime,
-                 thumb_url: str = None, canonical: bool = True):
+                 thumb_url: str = None, canonical: bool = True, fallback: bool = False):
         self.site: VideoSite = site
         self.identifier: str = identifier
         self.url = url
@@ -29,6 +41,8 @@ class Video:
         self.uploaded: datetime = uploaded
         self.thumb_url: str = thumb_url
         self.canonical = canonical
+        # nothing could be fetched, so views and upload date are placeholders
+        self.fallback = fallback
 
     def __str__(self) -> str:
         return f"VideoSite: {self.site}\n" \
@@ -62,10 +76,37 @@ def parse_nc_url(vid: str) -> str:
     return vid
 
 
-def get_nc_info(vid: str) -> Video:
+# what get_nc_info and get_yt_info need from a watch page; all of it sits near the top. Every
+# pattern ends on something after the value, so a value cut off at the end of a chunk never matches.
+NC_FIELDS = {
+    'date': re.compile(rb'"uploadDate"\s*:\s*"([0-9]{4}-[0-9]{2}-[0-9]{2})'),
+    'views': re.compile(rb'"userInteractionCount"\s*:\s*([0-9]+)\s*[,}]'),
+    'thumb': re.compile(rb'<meta\s+name="thumbnail"\s+content="([^"]*)"')
+}
+
+YT_FIELDS = {
+    'views': re.compile(rb'<meta\s+itemprop="interactionCount"\s+content="([0-9]+)"'),
+    'date': re.compile(rb'<meta\s+itemprop="datePublished"\s+content="([^"]+)"')
+}
+
+
+def fetch_page_fields(url: str, matchers: dict, timeout: Optional[float] = None) -> Extraction:
+    # streamed responses are not stored in the response cache
+    return extract_fields(http_get(url, use_proxy=True, cache=False, stream=True, timeout=timeout), matchers)
+
+
+def get_nc_info(vid: str, timeout: Optional[float] = None) -> Video:
     vid = parse_nc_url(vid)
     url = f"https://www.nicovideo.jp/watch/{vid}"
-    result = http_get(url, use_proxy=True).text
+    extraction = fetch_page_fields(url, NC_FIELDS, timeout)
+    if not extraction.complete(NC_FIELDS):
+        logging.debug("Falling back to the full parser for " + url)
+        return parse_nc_page(vid, url, extraction.text())
+    fields = extraction.fields
+    return Video(VideoSite.NICO_NICO, vid, url, int(fields['views']), str_to_date(fields['date']), fields['thumb'])
+
+
+def parse_nc_page(vid: str, url: str, result: str) -> Video:
     soup = BeautifulSoup(result, "html.parser")
     date = datetime.fromtimestamp(0)
     views = 0
@@ -95,10 +136,10 @@ def get_bv(vid: str) -> str:
     return vid
 
 
-def get_bb_info(vid: str) -> Video:
+def get_bb_info(vid: str, timeout: Optional[float] = None) -> Video:
     vid = get_bv(vid)
     url = f"https://api.bilibili.com/x/web-interface/view?bvid={vid}"
-    response = json.loads(http_get(url, use_proxy=False).text)
+    response = json.loads(http_get(url, use_proxy=False, timeout=timeout).text)
     epoch_time = int(response['data']['pubdate'])
     date = datetime.fromtimestamp(epoch_time)
     # remove extra information to be in sync with YT and Nico
@@ -115,10 +156,18 @@ def parse_yt_url(vid: str) -> str:
         return vid[vid.rfind("/") + 1:]
 
 
-def get_yt_info(vid: str) -> Union[Video, None]:
+def get_yt_info(vid: str, timeout: Optional[float] = None) -> Union[Video, None]:
     vid = parse_yt_url(vid)
     url = 'https://www.youtube.com/watch?v=' + vid
-    text = http_get(url, use_proxy=True).text
+    extraction = fetch_page_fields(url, YT_FIELDS, timeout)
+    if not extraction.complete(YT_FIELDS):
+        logging.debug("Falling back to the full parser for " + url)
+        return parse_yt_page(vid, url, extraction.text())
+    return Video(VideoSite.YOUTUBE, vid, url, int(extraction.fields['views']), str_to_date(extraction.fields['date']),
+                 thumb_url="https://img.youtube.com/vi/{}/maxresdefault.jpg".format(vid))
+
+
+def parse_yt_page(vid: str, url: str, text: str) -> Video:
     soup = BeautifulSoup(text, "html.parser")
     interaction = soup.select_one('meta[itemprop="interactionCount"][content]')
     views = int(interaction['content'])
@@ -154,22 +203,181 @@ def view_count_from_site(video: Video) -> str:
     return "ERROR"
 
 
-def video_from_site(site: VideoSite, identifier: str, canonical: bool = True) -> Union[Video, None]:
+def fallback_video(site: VideoSite, identifier: str) -> Video:
+    identifier = parse_yt_url(identifier) if site == VideoSite.YOUTUBE else parse_nc_url(identifier)
+    return Video(site, identifier, "", 0, datetime.fromtimestamp(0), fallback=True)
+
+
+def video_key(site: VideoSite, identifier: str) -> str:
+    if site == VideoSite.YOUTUBE:
+        return parse_yt_url(identifier)
+    if site == VideoSite.BILIBILI:
+        return get_bv(identifier)
+    return parse_nc_url(identifier)
+
+
+def next_milestone(views: int) -> Optional[int]:
+    for milestone in (HALL_OF_FAME_VIEWS, LEGEND_VIEWS):
+        if views < milestone:
+            return milestone
+    return None
+
+
+def views_outdated(cached: CachedVideo) -> bool:
+    milestone = next_milestone(cached.views)
+    # view counts only go up, so nothing can change once the last milestone is passed
+    if milestone is None:
+        return False
+    video_config = get_config().video
+    ttl = video_config.views_ttl_hours * 3600
+    if cached.views * video_config.far_factor < milestone:
+        # far from the next milestone, so checked less often, but a song can still take off
+        ttl *= video_config.far_factor
+    return time.time() - cached.views_checked > ttl
+
+
+def cacheable(video: Video) -> bool:
+    # pages that could not be parsed give zero views and the epoch; those must be fetched again
+    return video.views > 0 and video.uploaded.year >= 2000
+
+
+def from_cache(site: VideoSite, identifier: str, cached: CachedVideo) -> Video:
+    return Video(site, identifier, cached.url, cached.views, datetime.fromisoformat(cached.uploaded),
+                 cached.thumb_url)
+
+
+def to_cache(video: Video) -> CachedVideo:
+    return CachedVideo(video.url, video.uploaded.isoformat(), video.thumb_url, video.views, time.time())
+
+
+def video_from_site(site: VideoSite, identifier: str, canonical: bool = True,
+                    timeout: Optional[float] = None) -> Union[Video, None]:
+    """
+    :param timeout: seconds for each request to the site; http.timeout in the config if not given.
+    """
+    cache = get_video_cache()
+    key = video_key(site, identifier)
+    cached = cache.get(site.value, key) if cache is not None else None
+    if cached is not None and not views_outdated(cached):
+        logging.debug(f"Using cached {site.value} video {key}")
+        v = from_cache(site, key, cached)
+        v.canonical = canonical
+        return v
     logging.info('Fetching video from ' + site.value)
     logging.debug(f"Video identifier: {identifier}")
     try:
-        v = info_func[site](identifier)
+        v = info_func[site](identifier, timeout=timeout)
     except Exception as e:
         logging.warning(_("fail_fetch") + site.value)
         logging.debug("Detailed exception info: ", exc_info=e)
         v = None
-    if not v:
-        identifier = parse_yt_url(identifier) if site == VideoSite.YOUTUBE else parse_nc_url(identifier)
-        return Video(site, identifier, "", 0, datetime.fromtimestamp(0))
+    if v and not cacheable(v):
+        logging.debug(f"{site.value} video {key} has no views or upload date; not caching it")
+        v.fallback = True
+    if not v or v.fallback:
+        if cached is not None:
+            # an old view count is better than none
+            v = from_cache(site, key, cached)
+            v.canonical = canonical
+            return v
+        if not v:
+            return fallback_video(site, identifier)
+        v.canonical = canonical
+        return v
+    if cache is not None:
+        cache.store(site.value, key, to_cache(v))
     v.canonical = canonical
     return v
 
 
+DEFAULT_SITE_CONCURRENCY = 2
+
+# shared by every song so that batch runs do not flood a single site
+site_semaphores: Dict[VideoSite, threading.BoundedSemaphore] = dict()
+site_semaphores_lock = threading.Lock()
+
+
+def site_semaphore(site: VideoSite) -> threading.BoundedSemaphore:
+    with site_semaphores_lock:
+        if site not in site_semaphores:
+            limit = get_config().video.concurrency.get(site.value, DEFAULT_SITE_CONCURRENCY)
+            site_semaphores[site] = threading.BoundedSemaphore(max(1, limit))
+        return site_semaphores[site]
+
+
+class FetchBudget:
+    """
+    The time limit of one video. It starts once the video has a slot on its site, so that
+    waiting behind other songs in a batch does not count against it.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.deadline = 0.0
+        self.started = threading.Event()
+
+    def start(self):
+        self.deadline = time.monotonic() + self.seconds
+        self.started.set()
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+
+def limited_video_from_site(site: VideoSite, identifier: str, canonical: bool = True,
+                            budget: Optional[FetchBudget] = None) -> Video:
+    with site_semaphore(site):
+        if budget is None:
+            return timed(site.value + " video", video_from_site, site, identifier, canonical)
+        budget.start()
+        return timed(site.value + " video", video_from_site, site, identifier, canonical,
+                     attempt_timeout(budget.seconds))
+
+
+def resolve_videos(targets: List[Tuple[VideoSite, str, bool]], executor: Optional[Executor] = None,
+                   timeout: Optional[float] = None) -> List[Video]:
+    """
+    Fetch the videos concurrently. Results are in the order of targets; a video whose site
+    fails or does not answer within the timeout gets zero views instead and is marked as a
+    fallback.
+    :param targets: (site, identifier, canonical) for each video.
+    :param executor: pool to run the fetches in; a temporary one is used if not given.
+    :param timeout: seconds for each video, counted from when its site has a free slot; defaults
+    to video.timeout in the config. Requests to the site are given timeouts that fit in it.
+    """
+    if len(targets) == 0:
+        return []
+    if timeout is None:
+        timeout = get_config().video.timeout
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=len(targets))
+    try:
+        budgets = [FetchBudget(timeout) for _ in targets]
+        futures = [executor.submit(limited_video_from_site, *target, budget=budget)
+                   for target, budget in zip(targets, budgets)]
+        for budget, future in zip(budgets, futures):
+            # a fetch that ends without starting (e.g. cancelled) must not be waited for
+            future.add_done_callback(lambda f, b=budget: b.started.set())
+        result = []
+        for (site, identifier, canonical), budget, future in zip(targets, budgets, futures):
+            # queueing for the site's semaphore does not count against the timeout
+            budget.started.wait()
+            try:
+                result.append(future.result(timeout=budget.remaining()))
+            except TimeoutError:
+                logging.warning(_("fail_fetch") + site.value)
+                logging.debug(f"Fetching {identifier} did not finish within {timeout} seconds")
+                video = fallback_video(site, identifier)
+                video.canonical = canonical
+                result.append(video)
+        return result
+    finally:
+        if own_executor:
+            # do not wait for fetches that timed out
+            executor.shutdown(wait=False)
+
+
 def str_to_date(date: str) -> datetime:
     if 'T' in date:
         date = date[:date.find('T')]
@@ -183,14 +391,19 @@ def str_to_date(date: str) -> datetime:
     return datetime(year=year, month=month, day=day)
 
 
-def get_video_bilibili() -> Union[Video, None]:
-    bv = prompt_response(_("bilibili_link"))
+def prompt_video_bilibili() -> Optional[Tuple[str, bool]]:
+    bv = prompt_response(_("bilibili_link"), key="bilibili_link")
     if bv.isspace() or len(bv) == 0:
         return None
-    if bv:
-        bv_canonical = prompt_choices(_("bv_canonical"), ["Yes", "No"])
-        bv_canonical = bv_canonical == 1
-        return video_from_site(VideoSite.BILIBILI, bv, bv_canonical)
+    bv_canonical = prompt_choices(_("bv_canonical"), ["Yes", "No"], key="bv_canonical")
+    return bv, bv_canonical == 1
+
+
+def get_video_bilibili() -> Union[Video, None]:
+    bilibili = prompt_video_bilibili()
+    if bilibili is None:
+        return None
+    return resolve_videos([(VideoSite.BILIBILI, *bilibili)])[0]
 
 
 def get_video(videos: List[Video], site: VideoSite):
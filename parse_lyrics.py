@@ -1,9 +1,25 @@
+import argparse
+import sys
+from pathlib import Path
+
 from main import create_lyrics
-from models.song import get_manual_lyrics
+from models.song import get_manual_lyrics, lyrics_from_layout
+from utils.lyrics_layout import detect_layout
 
 
 def main():
-    lyrics = get_manual_lyrics()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", dest="file", type=Path, default=None,
+                        help="split the lyrics in this file without opening a window")
+    parser.add_argument("-t", dest="translator", type=str, default="")
+    args = parser.parse_args()
+    sys.stdout.reconfigure(encoding='utf-8')
+    if args.file is None:
+        lyrics = get_manual_lyrics()
+    else:
+        layout = detect_layout(args.file.read_text(encoding="utf-8-sig"))
+        print(f"Layout confidence: {layout.confidence:.0%}", file=sys.stderr)
+        lyrics = lyrics_from_layout(layout, translator=args.translator)
     print(create_lyrics(lyrics))
 
 
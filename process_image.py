@@ -8,7 +8,8 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", dest="input", type=Path)
     parser.add_argument("-o", dest="output", type=Path)
-    parser.add_argument("-t", dest="threshold", type=float)
+    parser.add_argument("-t", dest="threshold", type=float, default=None,
+                        help="crop threshold; picked from the image if not given")
     args = parser.parse_args()
     file_in: Path = args.input
     file_out: Path = args.output
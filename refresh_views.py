@@ -0,0 +1,172 @@
+"""
+Refreshes the 殿堂曲/传说曲 headers of the wikitext files in the output directory.
+
+The niconico id of every Songbox is looked up in batches through the niconico snapshot search
+API, and only the header lines of songs whose status changed are rewritten. The header depends
+on the niconico count alone, so yt_id and bb_id are recorded but not fetched. A manifest next to
+the files remembers when each song was last checked; a run only checks songs that are due.
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Dict, List, Optional, Iterable
+
+from config.config import load_config, application_path, get_output_path
+from main import setup_logger, milestone_header, read_ids, LEGEND_HEADER, HALL_OF_FAME_HEADER
+from models.video import VideoSite, LEGEND_VIEWS, resolve_videos
+from utils.helpers import http_get
+from utils.video_cache import get_video_cache
+
+SNAPSHOT_URL = "https://snapshot.search.nicovideo.jp/api/v2/snapshot/video/contents/search"
+# ids per snapshot request
+BATCH_SIZE = 50
+WORKERS = 4
+MANIFEST = "views_manifest.json"
+DEFAULT_INTERVAL_HOURS = 24 * 7
+
+SONGBOX_START = "{{VOCALOID_Songbox"
+
+
+@dataclass
+class ManifestEntry:
+    checked: float = 0
+    views: int = -1
+    ids: Dict[str, str] = field(default_factory=dict)
+
+
+def update_header(text: str, views: int) -> Optional[str]:
+    """
+    Return the text with the header matching the view count, or None if it is already right.
+    """
+    start = text.find(SONGBOX_START)
+    if start == -1:
+        return None
+    lines = text[:start].splitlines(keepends=True)
+    kept = [line for line in lines if line.strip() not in (LEGEND_HEADER, HALL_OF_FAME_HEADER)]
+    result = milestone_header(views) + "".join(kept) + text[start:]
+    return None if result == text else result
+
+
+def load_manifest(path: Path) -> Dict[str, ManifestEntry]:
+    if not path.exists():
+        return dict()
+    with open(path, encoding="utf-8") as f:
+        return {name: ManifestEntry(**entry) for name, entry in json.load(f).items()}
+
+
+def save_manifest(path: Path, manifest: Dict[str, ManifestEntry]):
+    temp = path.with_suffix(".tmp")
+    with open(temp, "w", encoding="utf-8") as f:
+        json.dump({name: asdict(entry) for name, entry in manifest.items()}, f, ensure_ascii=False, indent=1)
+    temp.replace(path)
+
+
+def is_due(entry: Optional[ManifestEntry], ids: Dict[str, str], interval: float, now: float) -> bool:
+    if entry is None or entry.ids != ids:
+        return True
+    # view counts only go up
+    if entry.views >= LEGEND_VIEWS:
+        return False
+    return now - entry.checked >= interval
+
+
+def fetch_snapshot(ids: List[str]) -> Dict[str, int]:
+    params = {
+        'q': '',
+        'targets': 'title',
+        'fields': 'contentId,viewCounter',
+        '_sort': '-viewCounter',
+        '_limit': len(ids),
+        '_context': 'MGP-VJ-tool'
+    }
+    for index, vid in enumerate(ids):
+        params[f'filters[contentId][{index}]'] = vid
+    response = json.loads(http_get(SNAPSHOT_URL, use_proxy=True, cache=False, params=params).text)
+    return {item['contentId']: int(item['viewCounter']) for item in response['data']}
+
+
+def fetch_views(ids: Iterable[str]) -> Dict[str, int]:
+    """
+    Niconico view counts, fetched in batches through the snapshot API. Videos the snapshot
+    does not know (e.g. uploaded today) or batches that fail are fetched one by one instead.
+    """
+    ids = list(dict.fromkeys(ids))
+    batches = [ids[i:i + BATCH_SIZE] for i in range(0, len(ids), BATCH_SIZE)]
+    views: Dict[str, int] = dict()
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        for batch, future in zip(batches, [executor.submit(fetch_snapshot, batch) for batch in batches]):
+            try:
+                views.update(future.result())
+            except Exception as e:
+                logging.warning(f"Snapshot search failed for {len(batch)} videos; fetching them one by one")
+                logging.debug("Detailed error: ", exc_info=e)
+    missing = [vid for vid in ids if vid not in views]
+    for vid, video in zip(missing, resolve_videos([(VideoSite.NICO_NICO, vid, True) for vid in missing])):
+        if video.views > 0:
+            views[vid] = video.views
+    cache = get_video_cache()
+    if cache is not None:
+        now = time.time()
+        for vid, count in views.items():
+            # like video_from_site, never remember a zero
+            if count > 0:
+                cache.update_views(VideoSite.NICO_NICO.value, vid, count, now)
+    return views
+
+
+def refresh(directory: Path, interval_hours: float = DEFAULT_INTERVAL_HOURS, force: bool = False) -> Dict[str, int]:
+    manifest_path = directory.joinpath(MANIFEST)
+    manifest = load_manifest(manifest_path)
+    now = time.time()
+    due: Dict[Path, Dict[str, str]] = dict()
+    files = sorted(directory.glob("*.wikitext"))
+    for file in files:
+        ids = read_ids(file.read_text(encoding="utf-8"))
+        if force or is_due(manifest.get(file.name), ids, interval_hours * 3600, now):
+            due[file] = ids
+    counts = {'scanned': len(files), 'checked': 0, 'updated': 0}
+    views = fetch_views(ids['nnd_id'] for ids in due.values() if 'nnd_id' in ids)
+    for file, ids in due.items():
+        entry = manifest.setdefault(file.name, ManifestEntry())
+        if 'nnd_id' in ids and ids['nnd_id'] not in views:
+            # try again next time
+            continue
+        entry.ids = ids
+        entry.checked = now
+        entry.views = views.get(ids.get('nnd_id'), 0)
+        counts['checked'] += 1
+        with open(file, encoding="utf-8", newline="") as f:
+            text = f.read()
+        updated = update_header(text, entry.views)
+        if updated is not None:
+            with open(file, "w", encoding="utf-8", newline="") as f:
+                f.write(updated)
+            counts['updated'] += 1
+            logging.info(f"Updated the header of {file.name} ({entry.views} views)")
+    save_manifest(manifest_path, manifest)
+    return counts
+
+
+def main(args: Optional[list] = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", dest="directory", type=Path, default=None,
+                        help="folder with the wikitext files; defaults to the output folder")
+    parser.add_argument("-i", dest="interval", type=float, default=DEFAULT_INTERVAL_HOURS,
+                        help="hours before a song is checked again")
+    parser.add_argument("--all", dest="force", action="store_true", help="check every song")
+    args = parser.parse_args(args)
+    sys.stdout.reconfigure(encoding='utf-8')
+    setup_logger()
+    load_config(application_path.joinpath("config.yaml"))
+    directory = args.directory if args.directory else get_output_path()
+    counts = refresh(directory, args.interval, args.force)
+    print(", ".join(f"{key}: {value}" for key, value in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
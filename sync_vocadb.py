@@ -0,0 +1,87 @@
+"""
+Fills the local VocaDB index (the index section of config.yaml) so that searches do not need
+the network.
+
+VocaDB has no "changed since" filter, so songs are walked newest first by addition date and
+the walk stops at the newest song seen by the previous sync of the same scope. Use --full to
+walk everything again, e.g. to pick up renamed songs.
+"""
+import argparse
+import sys
+from typing import List, Optional
+
+from config.config import load_config, application_path
+from main import setup_logger
+from utils.vocadb import iter_vocadb
+from utils.vocadb_index import open_vocadb_index, VocaDBIndex, FULL_SCOPE
+
+PARAMS_SYNC = {
+    'fields': 'AdditionalNames,Artists',
+    'lang': 'Default',
+    'sort': 'AdditionDate',
+    'childTags': 'false',
+    'artistParticipationStatus': 'Everything',
+    'onlyWithPvs': 'false'
+}
+
+# rows are written in chunks so that an interrupted sync keeps what it has fetched
+CHUNK_SIZE = 500
+
+
+def sync_scope(artist_ids: List[int]) -> str:
+    if len(artist_ids) == 0:
+        return FULL_SCOPE
+    return "artists:" + ",".join(str(a) for a in sorted(artist_ids))
+
+
+def sync(index: VocaDBIndex, artist_ids: List[int], full: bool = False) -> int:
+    scope = sync_scope(artist_ids)
+    watermark = None if full else index.get_watermark(scope)
+    params = dict(PARAMS_SYNC)
+    if len(artist_ids) > 0:
+        params['artistId[]'] = artist_ids
+    newest: Optional[str] = None
+    chunk = []
+    count = 0
+    # pages must come from VocaDB, not from the response cache, or new songs would be missed
+    for song in iter_vocadb(params, cache=False):
+        created = song.get('createDate')
+        if watermark is not None and created is not None and created <= watermark:
+            break
+        if newest is None:
+            newest = created
+        chunk.append(song)
+        count += 1
+        if len(chunk) >= CHUNK_SIZE:
+            index.add_songs(chunk)
+            chunk = []
+            print(f"{count} songs synced")
+    index.add_songs(chunk)
+    # only move the watermark once the walk reached it, so an interrupted sync is resumed next time;
+    # a sync that found nothing new still records when it ran
+    if newest is not None or watermark is not None:
+        index.set_watermark(scope, newest or watermark)
+    return count
+
+
+def main(args: Optional[list] = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-a", dest="artists", type=int, action="append", default=[],
+                        help="only sync songs by this VocaDB artist id; can be repeated")
+    parser.add_argument("--full", action="store_true", help="ignore the previous sync")
+    parser.add_argument("-s", dest="search", default=None, help="search the local index instead of syncing")
+    args = parser.parse_args(args)
+    sys.stdout.reconfigure(encoding='utf-8')
+    setup_logger()
+    load_config(application_path.joinpath("config.yaml"))
+    index = open_vocadb_index()
+    if args.search is not None:
+        for song in index.search(args.search):
+            print(f"{song['id']}: {song['defaultName']} by {song['artistString']}")
+        return
+    count = sync(index, args.artists, args.full)
+    print(f"{count} songs synced, {index.count()} songs in the index")
+
+
+if __name__ == "__main__":
+    main()
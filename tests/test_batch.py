@@ -0,0 +1,122 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import TestCase
+
+from batch import read_items, run_batch, BatchItem, read_discography, PARAMS_DISCOGRAPHY
+from tests.utils.test_cassette import write_cassette, song_pages, NAME, prepared_url, at_wiki_pages
+from utils.cassette import use_cassette, REPLAY
+from utils.helpers import prompt_choices, set_prompt_answers, NonInteractiveError
+from utils.vocadb import VOCADB_SONG_QUERY_URL
+
+
+class TestBatch(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_read_csv(self):
+        file = self.path.joinpath("songs.csv")
+        file.write_text("name_japanese,name_chinese,bilibili,canonical\n"
+                        "テスト,测试,BV1Ex411w7d2,no\n"
+                        "# comment\n"
+                        "\n"
+                        "ロキ\n", encoding="utf-8")
+        self.assertEqual([BatchItem("テスト", "测试", "BV1Ex411w7d2", False), BatchItem("ロキ", "", "", True)],
+                         list(read_items(file)))
+
+    def test_read_jsonl(self):
+        file = self.path.joinpath("songs.jsonl")
+        file.write_text(json.dumps({'name_japanese': "テスト", 'canonical': False}, ensure_ascii=False) + "\n",
+                        encoding="utf-8")
+        self.assertEqual([BatchItem("テスト", "", "", False)], list(read_items(file)))
+
+    def test_prompt_answers(self):
+        set_prompt_answers({'pick': lambda choices: len(choices)})
+        try:
+            self.assertEqual(3, prompt_choices("", ["a", "b", "c"], key="pick"))
+            with self.assertRaises(NonInteractiveError):
+                prompt_choices("", ["a"], key="unknown")
+        finally:
+            set_prompt_answers(None)
+
+    def test_run_batch(self):
+        cassette = self.path.joinpath("batch.cassette")
+        write_cassette(cassette, song_pages())
+        with use_cassette(cassette, REPLAY):
+            results = list(run_batch([BatchItem(NAME, "测试"), BatchItem("存在しない曲")], 2, self.path))
+        results = {r.item.name_japanese: r for r in results}
+        self.assertEqual("ok", results[NAME].status)
+        self.assertIn("日本語の歌詞", self.path.joinpath("测试.wikitext").read_text(encoding="utf-8"))
+        self.assertEqual("failed", results["存在しない曲"].status)
+
+    def test_video_fallback_reported(self):
+        pages = {url: body for url, body in song_pages().items() if "nicovideo" not in url}
+        cassette = self.path.joinpath("no_video.cassette")
+        write_cassette(cassette, pages)
+        with use_cassette(cassette, REPLAY):
+            results = list(run_batch([BatchItem(NAME, "测试")], 1, self.path))
+        self.assertEqual("incomplete", results[0].status)
+        self.assertIn("niconico sm1", results[0].error)
+        self.assertTrue(self.path.joinpath("测试.wikitext").exists())
+
+    def test_translation_file(self):
+        translation = self.path.joinpath("translation.txt")
+        translation.write_text("夢を見た\n做了个梦\n\n心が踊る\n心在跳动\n", encoding="utf-8")
+        pages = {url: body for url, body in song_pages().items() if url not in at_wiki_pages()}
+        cassette = self.path.joinpath("translation.cassette")
+        write_cassette(cassette, pages)
+        with use_cassette(cassette, REPLAY):
+            results = list(run_batch([BatchItem(NAME, "测试", translation=str(translation))], 1, self.path))
+        self.assertEqual("ok", results[0].status)
+        wikitext = self.path.joinpath("测试.wikitext").read_text(encoding="utf-8")
+        self.assertIn("做了个梦\n心在跳动", wikitext)
+        self.assertIn("夢を見た\n心が踊る", wikitext)
+
+    def test_missing_translation_file(self):
+        results = list(run_batch([BatchItem(NAME, translation=str(self.path.joinpath("missing.txt")))], 1, self.path))
+        self.assertEqual("failed", results[0].status)
+
+    def test_discography(self):
+        cassette = self.path.joinpath("discography.cassette")
+
+        def page(start: int) -> str:
+            return prepared_url(VOCADB_SONG_QUERY_URL, {**PARAMS_DISCOGRAPHY, 'artistId[]': 10, 'start': start,
+                                                        'maxResults': 50, 'getTotalCount': 'false'})
+
+        songs = [{'id': i, 'defaultName': f"曲{i}", 'pvs': []} for i in range(50)]
+        songs[5]['pvs'] = [{'service': 'NicoNicoDouga', 'pvType': 'Original', 'pvId': "sm5"}]
+        songs[9]['defaultName'] = "1/9"
+        write_cassette(cassette, {
+            page(0): json.dumps({'items': songs}),
+            page(50):
+                json.dumps({'items': [{'id': 50, 'defaultName': "曲50"}]}),
+        })
+        self.path.joinpath("曲3.wikitext").write_text("", encoding="utf-8")
+        # drafts saved under their Chinese names
+        self.path.joinpath("歌五.wikitext").write_text("{{VOCALOID_Songbox\n|nnd_id = sm5\n}}", encoding="utf-8")
+        self.path.joinpath("歌七.wikitext").write_text("{{标题替换|{{lj|曲7}}}}\n{{VOCALOID_Songbox\n}}",
+                                                       encoding="utf-8")
+        self.path.joinpath("1／9.wikitext").write_text("", encoding="utf-8")
+        with use_cassette(cassette, REPLAY):
+            items = list(read_discography(10, self.path))
+        self.assertEqual(47, len(items))
+        names = [item.name_japanese for item in items]
+        for skipped in ("曲3", "曲5", "曲7", "1/9"):
+            self.assertNotIn(skipped, names)
+        self.assertEqual(BatchItem("曲50", vocadb_id=50), items[-1])
+
+    def test_run_batch_by_id(self):
+        cassette = self.path.joinpath("batch.cassette")
+        write_cassette(cassette, song_pages())
+        with use_cassette(cassette, REPLAY):
+            results = list(run_batch([BatchItem(NAME, vocadb_id=1)], 1, self.path))
+        self.assertEqual("ok", results[0].status)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import TestCase
+
+from refresh_views import update_header, refresh, read_ids, SNAPSHOT_URL
+from tests.utils.test_cassette import write_cassette, prepared_url
+from utils.cassette import use_cassette, REPLAY
+
+SONGBOX = """{{VOCALOID_Songbox
+|image    = 测试封面.jpg
+|nnd_id = sm1
+|yt_id = abc
+|其他资料 = 
+}}
+正文
+"""
+
+
+def snapshot_url(*ids: str) -> str:
+    params = {'q': '', 'targets': 'title', 'fields': 'contentId,viewCounter', '_sort': '-viewCounter',
+              '_limit': len(ids), '_context': 'MGP-VJ-tool'}
+    for index, vid in enumerate(ids):
+        params[f'filters[contentId][{index}]'] = vid
+    return prepared_url(SNAPSHOT_URL, params)
+
+
+class TestRefreshViews(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_read_ids(self):
+        self.assertEqual({'nnd_id': "sm1", 'yt_id': "abc"}, read_ids(SONGBOX))
+        self.assertEqual({'yt_id': "abc"}, read_ids("|nnd_id =\n|yt_id = abc"))
+        self.assertEqual({'yt_id': "abc"}, read_ids("|nnd_id =   \n|yt_id\t=\tabc"))
+
+    def test_update_header(self):
+        title = "{{标题替换|テスト}}\n"
+        self.assertIsNone(update_header(title + SONGBOX, 99999))
+        self.assertEqual("{{VOCALOID殿堂曲题头}}\n" + title + SONGBOX, update_header(title + SONGBOX, 100000))
+        self.assertEqual("{{VOCALOID传说曲题头}}\n" + title + SONGBOX,
+                         update_header("{{VOCALOID殿堂曲题头}}\n" + title + SONGBOX, 1000000))
+        self.assertIsNone(update_header("{{VOCALOID传说曲题头}}\n" + SONGBOX, 1200000))
+
+    def test_refresh(self):
+        file = self.path.joinpath("测试.wikitext")
+        file.write_text(SONGBOX, encoding="utf-8")
+        self.path.joinpath("其他.wikitext").write_text(SONGBOX.replace("sm1", "sm2"), encoding="utf-8")
+        cassette = self.path.joinpath("refresh.cassette")
+        write_cassette(cassette, {snapshot_url("sm2", "sm1"): json.dumps(
+            {'meta': {'status': 200}, 'data': [{'contentId': "sm1", 'viewCounter': 150000},
+                                               {'contentId': "sm2", 'viewCounter': 20}]})})
+        with use_cassette(cassette, REPLAY):
+            self.assertEqual({'scanned': 2, 'checked': 2, 'updated': 1}, refresh(self.path))
+            # nothing is due any more, so no request is made
+            self.assertEqual({'scanned': 2, 'checked': 0, 'updated': 0}, refresh(self.path))
+        self.assertEqual("{{VOCALOID殿堂曲题头}}\n" + SONGBOX, file.read_text(encoding="utf-8"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,14 @@
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
 from unittest import TestCase
+from unittest.mock import patch
 
-from models.video import get_bv
+from config.config import get_config
+from models.video import get_bv, resolve_videos, info_func, VideoSite, Video, video_from_site, site_semaphores
+from utils.video_cache import VideoCache, CachedVideo
 
 
 class TestVide(TestCase):
@@ -13,3 +21,137 @@ class TestVide(TestCase):
 
         self.assertEqual("BV1Ex411w7d2",
                          get_bv("BV1Ex411w7d2"))
+
+
+def slow_video(site: VideoSite, seconds: float):
+    def fetch(identifier: str, timeout: float = None) -> Video:
+        time.sleep(seconds)
+        return Video(site, identifier, identifier, 100, datetime(2020, 1, 1))
+
+    return fetch
+
+
+def broken_video(identifier: str, timeout: float = None) -> Video:
+    raise ValueError(identifier)
+
+
+class TestResolveVideos(TestCase):
+    def test_concurrent(self):
+        with patch.dict(info_func, {VideoSite.NICO_NICO: slow_video(VideoSite.NICO_NICO, 0.3),
+                                    VideoSite.YOUTUBE: slow_video(VideoSite.YOUTUBE, 0.3),
+                                    VideoSite.BILIBILI: slow_video(VideoSite.BILIBILI, 0.3)}):
+            start = time.perf_counter()
+            videos = resolve_videos([(VideoSite.NICO_NICO, "sm1", True), (VideoSite.YOUTUBE, "yt", True),
+                                     (VideoSite.BILIBILI, "BV1", False)])
+            self.assertLess(time.perf_counter() - start, 0.6)
+        self.assertEqual([VideoSite.NICO_NICO, VideoSite.YOUTUBE, VideoSite.BILIBILI], [v.site for v in videos])
+        self.assertEqual([100, 100, 100], [v.views for v in videos])
+        self.assertFalse(videos[2].canonical)
+
+    def test_partial_failure(self):
+        with patch.dict(info_func, {VideoSite.NICO_NICO: broken_video,
+                                    VideoSite.YOUTUBE: slow_video(VideoSite.YOUTUBE, 1),
+                                    VideoSite.BILIBILI: slow_video(VideoSite.BILIBILI, 0)}):
+            videos = resolve_videos([(VideoSite.NICO_NICO, "https://www.nicovideo.jp/watch/sm1", True),
+                                     (VideoSite.YOUTUBE, "https://www.youtube.com/watch?v=yt", True),
+                                     (VideoSite.BILIBILI, "BV1", True)], timeout=0.3)
+        self.assertEqual(["sm1", "yt", "BV1"], [v.identifier for v in videos])
+        self.assertEqual([0, 0, 100], [v.views for v in videos])
+        self.assertEqual([True, True, False], [v.fallback for v in videos])
+
+    def test_queueing_does_not_count(self):
+        # one slot: the second video waits for the first, then gets its own time
+        with patch.dict(site_semaphores, {VideoSite.NICO_NICO: threading.BoundedSemaphore(1)}), \
+                patch.dict(info_func, {VideoSite.NICO_NICO: slow_video(VideoSite.NICO_NICO, 0.2)}):
+            videos = resolve_videos([(VideoSite.NICO_NICO, "sm1", True), (VideoSite.NICO_NICO, "sm2", True)],
+                                    timeout=0.3)
+        self.assertEqual([100, 100], [v.views for v in videos])
+
+    def test_request_timeout_fits(self):
+        timeouts = []
+
+        def fetch(identifier: str, timeout: float = None) -> Video:
+            timeouts.append(timeout)
+            return Video(VideoSite.NICO_NICO, identifier, identifier, 100, datetime(2020, 1, 1))
+
+        with patch.dict(info_func, {VideoSite.NICO_NICO: fetch}):
+            resolve_videos([(VideoSite.NICO_NICO, "sm1", True)], timeout=20)
+        self.assertLess(timeouts[0] * (get_config().http.retries + 1), 20)
+
+
+class TestVideoCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = VideoCache(Path(self.directory.name).joinpath("videos.sqlite3"))
+        self.patcher = patch("models.video.get_video_cache", lambda: self.cache)
+        self.patcher.start()
+        self.fetched = []
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.cache.close()
+        self.directory.cleanup()
+
+    def fetch(self, views: int):
+        def fetch(identifier: str, timeout: float = None) -> Video:
+            self.fetched.append(identifier)
+            return Video(VideoSite.NICO_NICO, identifier, "https://www.nicovideo.jp/watch/" + identifier, views,
+                         datetime(2020, 1, 2), "thumb")
+
+        return patch.dict(info_func, {VideoSite.NICO_NICO: fetch})
+
+    def cache_views(self, views: int, hours_ago: float):
+        self.cache.store(VideoSite.NICO_NICO.value, "sm1", CachedVideo("url", datetime(2020, 1, 2).isoformat(),
+                                                                       "thumb", views, time.time() - hours_ago * 3600))
+
+    def test_fresh(self):
+        with self.fetch(95000):
+            video_from_site(VideoSite.NICO_NICO, "https://www.nicovideo.jp/watch/sm1")
+            video = video_from_site(VideoSite.NICO_NICO, "sm1", canonical=False)
+        self.assertEqual(["https://www.nicovideo.jp/watch/sm1"], self.fetched)
+        self.assertEqual(95000, video.views)
+        self.assertEqual(datetime(2020, 1, 2), video.uploaded)
+        self.assertFalse(video.canonical)
+
+    def test_near_milestone_is_refetched(self):
+        self.cache_views(95000, hours_ago=48)
+        with self.fetch(101000):
+            self.assertEqual(101000, video_from_site(VideoSite.NICO_NICO, "sm1").views)
+        self.assertEqual(101000, self.cache.get(VideoSite.NICO_NICO.value, "sm1").views)
+
+    def test_far_from_milestone(self):
+        # within views_ttl_hours * far_factor
+        self.cache_views(1000, hours_ago=48)
+        self.cache.store(VideoSite.NICO_NICO.value, "sm2", CachedVideo("url", datetime(2020, 1, 2).isoformat(),
+                                                                       "thumb", 2000000, 0))
+        with self.fetch(0):
+            self.assertEqual(1000, video_from_site(VideoSite.NICO_NICO, "sm1").views)
+            self.assertEqual(2000000, video_from_site(VideoSite.NICO_NICO, "sm2").views)
+        self.assertEqual([], self.fetched)
+
+    def test_far_from_milestone_expires(self):
+        self.cache_views(1000, hours_ago=100)
+        with self.fetch(250000):
+            self.assertEqual(250000, video_from_site(VideoSite.NICO_NICO, "sm1").views)
+        self.assertEqual(["sm1"], self.fetched)
+
+    def test_zero_views_not_cached(self):
+        def unparsed(identifier: str, timeout: float = None) -> Video:
+            self.fetched.append(identifier)
+            return Video(VideoSite.NICO_NICO, identifier, "", 0, datetime.fromtimestamp(0))
+
+        with patch.dict(info_func, {VideoSite.NICO_NICO: unparsed}):
+            video = video_from_site(VideoSite.NICO_NICO, "sm1")
+        self.assertEqual(0, video.views)
+        self.assertTrue(video.fallback)
+        self.assertIsNone(self.cache.get(VideoSite.NICO_NICO.value, "sm1"))
+        with self.fetch(250000):
+            video = video_from_site(VideoSite.NICO_NICO, "sm1")
+        self.assertEqual(250000, video.views)
+        self.assertEqual(datetime(2020, 1, 2), video.uploaded)
+        self.assertEqual(["sm1", "sm1"], self.fetched)
+
+    def test_failure_uses_stale(self):
+        self.cache_views(95000, hours_ago=48)
+        with patch.dict(info_func, {VideoSite.NICO_NICO: broken_video}):
+            self.assertEqual(95000, video_from_site(VideoSite.NICO_NICO, "sm1").views)
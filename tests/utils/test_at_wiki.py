@@ -0,0 +1,63 @@
+import time
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+from tests.utils.test_cassette import AT_WIKI_SEARCH, AT_WIKI_PAGE, NAME, PRODUCER
+from utils.at_wiki import search_at_wiki, get_chinese_lyrics
+
+SEARCH = "https://w.atwiki.jp/vocaloidchly/search?andor=and&keyword={}&search_field=source"
+NO_HIT = """<html><body><div id="menu"><ul><li><a href="//x">テスト</a></li></ul></div>
+<div id="wikibody"><ul></ul></div></body></html>"""
+OTHER_HIT = AT_WIKI_SEARCH.replace("pages/1.html", "pages/2.html")
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+def fake_http_get(pages: dict, delays: dict = None):
+    def get(url: str, **kwargs) -> FakeResponse:
+        time.sleep((delays or {}).get(url, 0))
+        if url not in pages:
+            raise ConnectionError(url)
+        return FakeResponse(pages[url])
+
+    return get
+
+
+class TestAtWiki(TestCase):
+    def test_first_url_wins(self):
+        urls = [SEARCH.format(NAME + "+" + PRODUCER), SEARCH.format(NAME)]
+        # the name-only search answers first but the name+producer hit is preferred
+        pages = {urls[0]: AT_WIKI_SEARCH, urls[1]: OTHER_HIT}
+        with patch("utils.at_wiki.http_get", fake_http_get(pages, {urls[0]: 0.2})):
+            self.assertEqual("https://w.atwiki.jp/vocaloidchly/pages/1.html", search_at_wiki(NAME, urls, PRODUCER))
+
+    def test_searches_run_together(self):
+        urls = [SEARCH.format(NAME + "+" + PRODUCER), SEARCH.format(NAME)]
+        pages = {urls[0]: NO_HIT, urls[1]: OTHER_HIT}
+        start = time.perf_counter()
+        with patch("utils.at_wiki.http_get", fake_http_get(pages, {urls[0]: 0.3, urls[1]: 0.3})):
+            self.assertEqual("https://w.atwiki.jp/vocaloidchly/pages/2.html", search_at_wiki(NAME, urls, PRODUCER))
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    def test_failed_search_falls_through(self):
+        urls = [SEARCH.format(NAME + "+" + PRODUCER), SEARCH.format(NAME)]
+        with patch("utils.at_wiki.http_get", fake_http_get({urls[1]: AT_WIKI_SEARCH})):
+            self.assertEqual("https://w.atwiki.jp/vocaloidchly/pages/1.html", search_at_wiki(NAME, urls, PRODUCER))
+
+    def test_lyrics(self):
+        pages = {SEARCH.format(NAME + "+" + PRODUCER): NO_HIT, SEARCH.format(NAME): AT_WIKI_SEARCH,
+                 "https://w.atwiki.jp/vocaloidchly/pages/1.html":
+                     "<html><body><div id='menu'>メニュー</div>" + AT_WIKI_PAGE[len("<html><body>"):]}
+        with patch("utils.at_wiki.http_get", fake_http_get(pages)):
+            lyrics = get_chinese_lyrics(NAME, PRODUCER)
+        self.assertEqual("测试译者", lyrics.translator)
+        self.assertNotIn("メニュー", lyrics.lyrics_chs)
+        self.assertIn("中文歌词", lyrics.lyrics_chs)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import TestCase
+
+import requests
+
+from utils.cache import ResponseCache
+
+
+class EtagHandler(BaseHTTPRequestHandler):
+    requests_seen = []
+    validators_seen = []
+
+    def do_GET(self):
+        EtagHandler.requests_seen.append(self.path)
+        EtagHandler.validators_seen.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') in ('"v1"', '"v2"'):
+            self.send_response(304)
+            if self.path == "/rotate":
+                self.send_header('ETag', '"v2"')
+            self.end_headers()
+            return
+        body = ("body of " + self.path + " in " + self.headers.get('Accept-Language', "any")).encode("utf-8")
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestResponseCache(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), EtagHandler)
+        cls.base = f"http://127.0.0.1:{cls.server.server_port}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        EtagHandler.requests_seen.clear()
+        EtagHandler.validators_seen.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.session = requests.Session()
+
+    def tearDown(self):
+        self.session.close()
+        self.directory.cleanup()
+
+    def make_cache(self, **kwargs) -> ResponseCache:
+        args = {'max_size': 1024 * 1024, 'default_ttl': 3600}
+        args.update(kwargs)
+        return ResponseCache(Path(self.directory.name), **args)
+
+    def test_fresh_hit(self):
+        cache = self.make_cache()
+        first = cache.get(self.session, self.base + "/a", params={'q': '初音'})
+        second = cache.get(self.session, self.base + "/a", params={'q': '初音'})
+        self.assertEqual(first.text, second.text)
+        self.assertEqual(1, len(EtagHandler.requests_seen))
+
+    def test_revalidation(self):
+        cache = self.make_cache(default_ttl=0.01)
+        cache.get(self.session, self.base + "/b")
+        time.sleep(0.05)
+        response = cache.get(self.session, self.base + "/b")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("body of /b in any", response.text)
+        self.assertEqual(2, len(EtagHandler.requests_seen))
+
+    def test_revalidation_keeps_new_validators(self):
+        cache = self.make_cache(default_ttl=0.01)
+        for _ in range(3):
+            response = cache.get(self.session, self.base + "/rotate")
+            time.sleep(0.05)
+        self.assertEqual("body of /rotate in any", response.text)
+        self.assertEqual([None, '"v1"', '"v2"'], EtagHandler.validators_seen)
+
+    def test_request_headers_in_key(self):
+        cache = self.make_cache()
+        japanese = cache.get(self.session, self.base + "/c", headers={'Accept-Language': 'ja'})
+        english = cache.get(self.session, self.base + "/c", headers={'Accept-Language': 'en'})
+        again = cache.get(self.session, self.base + "/c", headers={'accept-language': 'ja'})
+        self.assertEqual("body of /c in ja", japanese.text)
+        self.assertEqual("body of /c in en", english.text)
+        self.assertEqual(japanese.text, again.text)
+        self.assertEqual(2, len(EtagHandler.requests_seen))
+        self.assertIsNone(cache.lookup(self.base + "/c"))
+        self.assertIsNotNone(cache.lookup(self.base + "/c", headers={'Accept-Language': 'en'}))
+
+    def test_prefix_ttl(self):
+        cache = self.make_cache(ttl={self.base + "/nocache": 0})
+        cache.get(self.session, self.base + "/nocache")
+        cache.get(self.session, self.base + "/nocache")
+        self.assertEqual(2, len(EtagHandler.requests_seen))
+
+    def test_lru_eviction(self):
+        cache = self.make_cache(max_size=30)
+        cache.get(self.session, self.base + "/first")
+        time.sleep(0.01)
+        cache.get(self.session, self.base + "/second")
+        time.sleep(0.01)
+        cache.get(self.session, self.base + "/third")
+        self.assertIsNone(cache.lookup(self.base + "/first"))
+        self.assertIsNotNone(cache.lookup(self.base + "/third"))
+        self.assertLessEqual(cache.total_size(), 30)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import TestCase
+
+import requests
+
+from models.creators import Person
+from models.video import get_nc_info, VideoSite
+from utils.at_wiki import get_chinese_lyrics
+from utils.cassette import Cassette, use_cassette, RECORD, REPLAY
+from utils.helpers import http_get, prompt_response
+from utils.mgp import get_producer_info
+from utils.vocadb import get_song_by_name, VOCADB_SONG_QUERY_URL, VOCADB_SONG_URL, PARAMS_NARROW, PARAMS_SONG
+
+NAME = "テスト"
+PRODUCER = "テストP"
+
+NICO_PAGE = """<html><head><meta name="thumbnail" content="https://nicovideo.cdn.nimg.jp/thumbnails/1/1.L">
+<script type="application/ld+json">{"@type":"VideoObject","uploadDate":"2020-01-02T19:00:00+09:00",
+"interactionStatistic":[{"@type":"InteractionCounter","userInteractionCount":123456}]}</script>
+</head><body></body></html>"""
+
+AT_WIKI_SEARCH = """<html><body><div id="wikibody"><ul>
+<li><a href="//w.atwiki.jp/vocaloidchly/pages/1.html">テスト</a></li></ul></div></body></html>"""
+
+AT_WIKI_PAGE = """<html><body><div id="wikibody">作词：テストP
+作曲：テストP
+翻译：测试译者
+
+テスト
+
+日本語の歌詞
+中文歌词
+<div class="atwiki-lastmodify">最終更新</div></div></body></html>"""
+
+DETAILS = {
+    'artistString': "テストP feat. 初音ミク",
+    'artists': [
+        {'artist': {'name': PRODUCER, 'artistType': 'Producer', 'additionalNames': ''},
+         'roles': 'Default', 'categories': 'Producer'},
+        {'artist': {'name': '初音ミク V4X', 'artistType': 'Vocaloid', 'additionalNames': 'Hatsune Miku'},
+         'roles': 'Default', 'categories': 'Vocalist'}
+    ],
+    'lyrics': [{'id': 8, 'translationType': 'Translation', 'value': "中文歌词"},
+               {'id': 7, 'translationType': 'Original', 'value': "日本語の歌詞"}],
+    'publishDate': '2020-01-02T00:00:00Z',
+    'pvs': [{'service': 'NicoNicoDouga', 'pvType': 'Original', 'url': 'https://www.nicovideo.jp/watch/sm1'}],
+    'albums': [{'defaultName': 'テストアルバム'}]
+}
+
+
+def prepared_url(url: str, params: dict = None) -> str:
+    return requests.Request('GET', url, params=params).prepare().url
+
+
+def write_cassette(path: Path, pages: dict, inputs: list = None):
+    interactions = [{'method': 'GET', 'url': url, 'status': 200, 'reason': 'OK',
+                     'headers': {'Content-Type': 'text/html; charset=utf-8'}, 'text': body}
+                    for url, body in pages.items()]
+    cassette = Cassette(path, RECORD)
+    for interaction in interactions:
+        cassette.add(interaction)
+    cassette.inputs = inputs or []
+    cassette.save()
+
+
+def at_wiki_pages() -> dict:
+    search = "https://w.atwiki.jp/vocaloidchly/search?andor=and&keyword={}&search_field=source"
+    return {
+        prepared_url(search.format(NAME + "+" + PRODUCER)): AT_WIKI_SEARCH,
+        "https://w.atwiki.jp/vocaloidchly/pages/1.html": AT_WIKI_PAGE
+    }
+
+
+def song_pages() -> dict:
+    return {
+        prepared_url(VOCADB_SONG_QUERY_URL, {**PARAMS_NARROW, 'query': NAME}):
+            json.dumps({'items': [{'id': 1, 'defaultName': NAME, 'artistString': DETAILS['artistString']}]}),
+        prepared_url(VOCADB_SONG_URL.format(1), PARAMS_SONG): json.dumps(DETAILS),
+        "https://www.nicovideo.jp/watch/sm1": NICO_PAGE,
+        **at_wiki_pages()
+    }
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = ("echo " + self.path).encode("utf-8")
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestCassette(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name).joinpath("test.cassette")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_record_and_replay(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), EchoHandler)
+        url = f"http://127.0.0.1:{server.server_port}/path"
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            with use_cassette(self.path, RECORD):
+                recorded = http_get(url, use_proxy=False, params={'q': '1'}).text
+        finally:
+            server.shutdown()
+            server.server_close()
+        with use_cassette(self.path, REPLAY):
+            self.assertEqual(recorded, http_get(url, use_proxy=False, params={'q': '1'}).text)
+            with self.assertRaises(requests.ConnectionError):
+                http_get(url, use_proxy=False, params={'q': '2'})
+
+    def test_replay_inputs(self):
+        write_cassette(self.path, {}, inputs=["first", "second"])
+        with use_cassette(self.path, REPLAY):
+            self.assertEqual("first", prompt_response(""))
+            self.assertEqual("second", prompt_response(""))
+
+    def test_nc_info(self):
+        write_cassette(self.path, {"https://www.nicovideo.jp/watch/sm1": NICO_PAGE})
+        with use_cassette(self.path, REPLAY):
+            video = get_nc_info("https://www.nicovideo.jp/watch/sm1")
+        self.assertEqual(VideoSite.NICO_NICO, video.site)
+        self.assertEqual(123456, video.views)
+        self.assertEqual(2020, video.uploaded.year)
+
+    def test_at_wiki(self):
+        write_cassette(self.path, at_wiki_pages())
+        with use_cassette(self.path, REPLAY):
+            lyrics = get_chinese_lyrics(NAME, PRODUCER)
+        self.assertEqual("测试译者", lyrics.translator)
+        self.assertIn("中文歌词", lyrics.lyrics_chs)
+        self.assertNotIn("最終更新", lyrics.lyrics_chs)
+
+    def test_producer_info(self):
+        template = "https://mzh.moegirl.org.cn/api.php?action=parse&format=json&page=Template:{}&prop=categories"
+        write_cassette(self.path, {
+            template.format("Wowaka"): json.dumps({'parse': {'categories': [{'*': '音乐家模板'}]}}),
+            template.format("wowakaP"): json.dumps({'error': {}})
+        })
+        with use_cassette(self.path, REPLAY):
+            templates, cats = asyncio.run(get_producer_info([Person("wowakaP", ["Wowaka"])]))
+        self.assertEqual(["Wowaka"], templates)
+        self.assertEqual([], cats)
+
+    def test_song_by_name(self):
+        # no bilibili video
+        write_cassette(self.path, song_pages(), inputs=[""])
+        with use_cassette(self.path, REPLAY):
+            song = get_song_by_name(NAME, "测试")
+        self.assertEqual(["テストP"], song.creators.producers_str())
+        self.assertEqual(["初音ミク"], song.creators.vocalists_str())
+        self.assertEqual("日本語の歌詞", song.lyrics.lyrics_jap)
+        self.assertEqual(["テストアルバム"], song.albums)
+        self.assertEqual(123456, song.videos[0].views)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+from unittest import TestCase
+
+import numpy as np
+
+from models.color import Color, ColorScheme, get_text_color
+from utils.color_math import perceived_lightness_batch, contrast_ratio_batch, prefers_black_text_batch, \
+    perceived_lightness
+
+
+def reference_lightness(red: int, green: int, blue: int) -> int:
+    def rgb_to_linear(color_channel):
+        if color_channel <= 0.04045:
+            return color_channel / 12.92
+        return pow(((color_channel + 0.055) / 1.055), 2.4)
+
+    y = (0.2126 * rgb_to_linear(red / 255) +
+         0.7152 * rgb_to_linear(green / 255) +
+         0.0722 * rgb_to_linear(blue / 255))
+    if y <= (216 / 24389):
+        return round(y * (24389 / 27))
+    return round(pow(y, (1 / 3)) * 116 - 16)
+
+
+class TestColorMath(TestCase):
+    def test_same_as_reference(self):
+        rgb = np.random.default_rng(0).integers(0, 256, (20000, 3), dtype=np.uint8)
+        expected = np.array([reference_lightness(*map(int, c)) for c in rgb])
+        np.testing.assert_array_equal(expected, perceived_lightness_batch(rgb))
+        self.assertEqual(list(expected[:1000]), [perceived_lightness(*map(int, c)) for c in rgb[:1000]])
+
+    def test_contrast(self):
+        self.assertAlmostEqual(21, Color(0, 0, 0).contrast_ratio(Color(255, 255, 255)))
+        self.assertAlmostEqual(1, ColorScheme(Color(10, 20, 30), Color(10, 20, 30)).contrast_ratio())
+        np.testing.assert_allclose([21, 1], contrast_ratio_batch([[0, 0, 0], [9, 9, 9]], [[255, 255, 255], [9, 9, 9]]))
+
+    def test_text_color_batch(self):
+        rgb = np.random.default_rng(1).integers(0, 256, (2000, 3), dtype=np.uint8)
+        expected = [get_text_color(Color(*map(int, c))) == Color(0, 0, 0) for c in rgb]
+        self.assertEqual(expected, list(prefers_black_text_batch(rgb)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,23 @@
+import io
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import astuple
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Tuple
 from unittest import TestCase
+from unittest.mock import patch
 
-from utils.image import remove_black_boarders, pick_color
+import numpy as np
+from PIL import Image, ImageOps
+
+from models.video import Video, VideoSite
+from utils.image import remove_black_boarders, pick_color, black_border_box, CropTable, download_best, \
+    download_largest, download_first, open_image, group_duplicates, dhash, hamming, DUPLICATE_DISTANCE, GRAY_BAND_ROWS
+from utils.image_cache import ImageCache
 from models.color import Color, get_text_color
 
 
@@ -9,6 +26,47 @@ class ImageTest(TestCase):
         pass
         # remove_black_boarders("output/temp.jpeg", "output/Booo!封面.jpeg")
 
+    def test_black_border_box(self):
+        pixels = np.zeros((100, 200, 3), dtype=np.uint8)
+        pixels[10:90, 20:180] = 200
+        # a dim row whose mean stays below the threshold
+        pixels[5, :100] = 30
+        img = Image.fromarray(pixels)
+        # the end is exclusive and lands on the last bright row, as it always has
+        self.assertEqual((20, 10, 179, 89), black_border_box(img, 20))
+        self.assertEqual((20, 5, 179, 89), black_border_box(img, 15))
+        self.assertEqual((0, 0, 199, 99), black_border_box(img, 255))
+
+    def test_crop_table(self):
+        rng = np.random.default_rng(0)
+        for _ in range(20):
+            pixels = (rng.random((30, 40)) ** 4 * 255).astype(np.uint8)
+            table = CropTable(Image.fromarray(pixels))
+            for threshold in range(0, 256, 5):
+                rows = np.flatnonzero(pixels.mean(axis=1) >= threshold)
+                columns = np.flatnonzero(pixels.mean(axis=0) >= threshold)
+                y1, y2 = (rows[0], rows[-1]) if len(rows) > 0 else (0, 29)
+                x1, x2 = (columns[0], columns[-1]) if len(columns) > 0 else (0, 39)
+                self.assertEqual((x1, y1, x2, y2), table.box(threshold))
+
+    def test_sums_in_bands(self):
+        rng = np.random.default_rng(0)
+        pixels = rng.integers(0, 256, (GRAY_BAND_ROWS * 2 + 17, 50, 3), dtype=np.uint8)
+        img = Image.fromarray(pixels)
+        gray = np.asarray(ImageOps.grayscale(img)).astype(np.uint32)
+        table = CropTable(img)
+        self.assertTrue(np.array_equal(gray.sum(axis=1), table.rows))
+        self.assertTrue(np.array_equal(gray.sum(axis=0), table.columns))
+
+    def test_auto_threshold(self):
+        rng = np.random.default_rng(0)
+        # noisy dark letterbox around a picture
+        pixels = rng.integers(0, 12, (90, 160, 3), dtype=np.uint8)
+        pixels[10:80, 16:144] = rng.integers(60, 255, (70, 128, 3), dtype=np.uint8)
+        table = CropTable(Image.fromarray(pixels))
+        self.assertEqual(table.box(20), table.box(table.auto_threshold()))
+        self.assertEqual((16, 10, 143, 79), table.box(table.auto_threshold()))
+
     def test_pick_color(self):
         pass
         # print(pick_color("output/Booo!封面.jpeg"))
@@ -23,3 +81,176 @@ class ImageTest(TestCase):
         self.assertEqual(black, get_text_color(Color(0, 255, 255)))
         print(Color(4, 156, 161).perceived_lightness())
         print(Color(255, 255, 255).perceived_lightness())
+
+
+def encoded_image(img: Image.Image, image_format: str) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def picture(size: Tuple[int, int], seed: int = 0) -> Image.Image:
+    # the same smooth picture at any size
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 255, (9, 16, 3), dtype=np.uint8)).resize(size, Image.BILINEAR)
+
+
+def encoded(size: Tuple[int, int], image_format: str) -> bytes:
+    return encoded_image(picture(size), image_format)
+
+
+class ThumbnailHandler(BaseHTTPRequestHandler):
+    images = {}
+    # paths whose connection is dropped halfway through the body
+    dropped = set()
+
+    def do_GET(self):
+        if self.path not in self.images:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = self.images[self.path]
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        end = len(body) // 2 if self.path in self.dropped else len(body)
+        try:
+            for i in range(0, end, 4096):
+                self.wfile.write(body[i:min(end, i + 4096)])
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadTest(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ThumbnailHandler)
+        self.base = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ImageCache(Path(self.directory.name).joinpath("images.sqlite3"), ttl=3600)
+
+    def tearDown(self):
+        ThumbnailHandler.dropped = set()
+        self.server.shutdown()
+        self.server.server_close()
+        self.cache.close()
+        self.directory.cleanup()
+
+    def test_download_best(self):
+        ThumbnailHandler.images = {'/small.jpg': encoded((320, 180), "JPEG"),
+                                   '/large.png': encoded((1280, 720), "PNG")}
+        # the same picture as far as the small thumbnails can tell
+        ThumbnailHandler.images['/small.jpg@160w.jpg'] = encoded((160, 90), "JPEG")
+        ThumbnailHandler.images['/large.png.small'] = encoded((130, 73), "JPEG")
+        videos = [Video(VideoSite.YOUTUBE, "yt", "", 0, datetime(2020, 1, 1), self.base + "/missing.jpg"),
+                  Video(VideoSite.BILIBILI, "bb", "", 0, datetime(2020, 1, 1), self.base + "/small.jpg"),
+                  Video(VideoSite.NICO_NICO, "nc", "", 0, datetime(2020, 1, 1), self.base + "/large.png.small.L")]
+        ThumbnailHandler.images['/large.png.small.L'] = ThumbnailHandler.images.pop('/large.png')
+        with patch("utils.image.get_image_cache", lambda: self.cache):
+            buffer, video = download_best(videos)
+            self.assertEqual("nc", video.identifier)
+            self.assertEqual(ThumbnailHandler.images['/large.png.small.L'], buffer.read())
+            buffer.close()
+            self.assertEqual((1280, 720), (self.cache.get(self.base + "/large.png.small.L").width,
+                                           self.cache.get(self.base + "/large.png.small.L").height))
+            # a second run takes hashes and sizes from the cache and only downloads the cover
+            ThumbnailHandler.images.pop('/small.jpg@160w.jpg')
+            ThumbnailHandler.images.pop('/large.png.small')
+            buffer, video = download_best(videos)
+            self.assertEqual("nc", video.identifier)
+            buffer.close()
+
+    def test_distinct_covers(self):
+        other = picture((320, 180), seed=1)
+        ThumbnailHandler.images = {'/a.jpg': encoded((320, 180), "JPEG"),
+                                   '/a.jpg@160w.jpg': encoded((160, 90), "JPEG"),
+                                   '/b.png': encoded_image(other.resize((1280, 720)), "PNG"),
+                                   '/b.png.small': encoded_image(other.resize((130, 73)), "JPEG")}
+        videos = [Video(VideoSite.BILIBILI, "bb", "", 0, datetime(2020, 1, 1), self.base + "/a.jpg"),
+                  Video(VideoSite.NICO_NICO, "nc", "", 0, datetime(2020, 1, 1), self.base + "/b.png.small.L")]
+        ThumbnailHandler.images['/b.png.small.L'] = ThumbnailHandler.images.pop('/b.png')
+        self.assertEqual([["bb"], ["nc"]], [[v.identifier for v in g] for g in group_duplicates(videos)])
+        # a different picture is not used just because it is larger
+        buffer, video = download_best(videos)
+        self.assertEqual("bb", video.identifier)
+        buffer.close()
+
+    def test_largest_dropped(self):
+        ThumbnailHandler.images = {'/small.jpg': encoded((320, 180), "JPEG"),
+                                   '/medium.jpg': encoded((640, 360), "JPEG"),
+                                   '/large.png': encoded((1280, 720), "PNG")}
+        ThumbnailHandler.dropped = {'/large.png'}
+        videos = [Video(VideoSite.YOUTUBE, "yt", "", 0, datetime(2020, 1, 1), self.base + "/small.jpg"),
+                  Video(VideoSite.BILIBILI, "bb", "", 0, datetime(2020, 1, 1), self.base + "/large.png"),
+                  Video(VideoSite.NICO_NICO, "nc", "", 0, datetime(2020, 1, 1), self.base + "/medium.jpg")]
+        with patch("utils.image.get_image_cache", lambda: None):
+            buffer, video = download_largest(videos)
+        # the next largest cover is finished instead
+        self.assertEqual("nc", video.identifier)
+        self.assertEqual(ThumbnailHandler.images['/medium.jpg'], buffer.read())
+        buffer.close()
+
+    def test_replaced_thumbnail(self):
+        ThumbnailHandler.images = {'/maxres.jpg': encoded((320, 180), "JPEG"),
+                                   '/other.jpg': encoded((640, 360), "JPEG")}
+        videos = [Video(VideoSite.YOUTUBE, "yt", "", 0, datetime(2020, 1, 1), self.base + "/maxres.jpg"),
+                  Video(VideoSite.NICO_NICO, "nc", "", 0, datetime(2020, 1, 1), self.base + "/other.jpg")]
+        cache = ImageCache(Path(self.directory.name).joinpath("expiring.sqlite3"), ttl=0.2)
+        with patch("utils.image.get_image_cache", lambda: cache):
+            buffer, video = download_largest(videos)
+            self.assertEqual("nc", video.identifier)
+            buffer.close()
+            # a new thumbnail under the same url is seen once the cached sizes expire
+            ThumbnailHandler.images['/maxres.jpg'] = encoded((1280, 720), "JPEG")
+            time.sleep(0.3)
+            buffer, video = download_largest(videos)
+            self.assertEqual("yt", video.identifier)
+            buffer.close()
+        cache.close()
+
+    def test_cache_expiry(self):
+        path = Path(self.directory.name).joinpath("old.sqlite3")
+        # a cache from before entries had times
+        with sqlite3.connect(str(path)) as connection:
+            connection.execute("CREATE TABLE thumbnails (thumb_url TEXT PRIMARY KEY, dhash TEXT, width INTEGER, "
+                               "height INTEGER) WITHOUT ROWID")
+            connection.execute("INSERT INTO thumbnails VALUES ('a', '00000000000000ff', 320, 180)")
+        connection.close()
+        cache = ImageCache(path, ttl=0.2)
+        self.assertEqual((None, None, None), astuple(cache.get("a")))
+        cache.store_hash("a", 255)
+        cache.store_size("b", 640, 360)
+        self.assertEqual((255, None, None), astuple(cache.get("a")))
+        self.assertEqual((None, 640, 360), astuple(cache.get("b")))
+        time.sleep(0.3)
+        self.assertEqual((None, None, None), astuple(cache.get("b")))
+        cache.close()
+
+    def test_dhash(self):
+        pixels = np.zeros((90, 160, 3), dtype=np.uint8)
+        pixels[:, :, 0] = np.linspace(0, 255, 160, dtype=np.uint8)
+        pixels[:, :, 1] = np.linspace(0, 255, 90, dtype=np.uint8)[:, None]
+        img = Image.fromarray(pixels)
+        letterboxed = np.zeros((120, 160, 3), dtype=np.uint8)
+        letterboxed[15:105] = pixels
+        self.assertLessEqual(hamming(dhash(img), dhash(img.resize((1280, 720)))), 2)
+        self.assertLessEqual(hamming(dhash(img), dhash(Image.fromarray(letterboxed))), 2)
+        self.assertGreater(hamming(dhash(img), dhash(img.transpose(Image.FLIP_LEFT_RIGHT))), DUPLICATE_DISTANCE)
+
+    def test_process_image(self):
+        pixels = np.zeros((90, 160, 3), dtype=np.uint8)
+        pixels[10:80, 16:144] = 180
+        ThumbnailHandler.images = {'/cover.jpg': encoded_image(Image.fromarray(pixels), "JPEG")}
+        videos = [Video(VideoSite.NICO_NICO, "nc", "", 0, datetime(2020, 1, 1), self.base + "/cover.jpg")]
+        buffer, _ = download_first(videos)
+        # small covers never touch the disk before they are written out
+        self.assertFalse(buffer._rolled)
+        target = Path(self.directory.name).joinpath("封面.jpg")
+        with open_image(buffer) as img:
+            remove_black_boarders(img, target, 20)
+        buffer.close()
+        with Image.open(target) as cover:
+            self.assertEqual((127, 69), cover.size)
@@ -1,8 +1,12 @@
+import random
+import re
 import unittest
 from typing import Callable
 from unittest import TestCase
 
-from utils.japanese import is_hiragana, is_katakana, is_kana, is_kanji, furigana_local
+from benchmarks.furigana import previous_furigana_local, corpus
+from utils.japanese import is_hiragana, is_katakana, is_kana, is_kanji, furigana_local, contains_kana, all_kanji, \
+    script_histogram, HIRAGANA, KATAKANA, KANJI, ASCII, OTHER
 
 hiragana = "あいうえおをだってん"
 katakana = "アイウエオダッテン"
@@ -29,6 +33,40 @@ class Test(TestCase):
     def test_is_kanji(self):
         self.test(is_kanji, kanji, hiragana + katakana)
 
+    def test_same_as_regex(self):
+        # the patterns the table replaced
+        patterns = {is_hiragana: re.compile("[\u3041-\u3096]"), is_katakana: re.compile("[\u30A0-\u30FF]"),
+                    is_kanji: re.compile("[\u3400-\u4DB5\u4E00-\u9FCB\uF900-\uFA6A]|々")}
+        for code in list(range(0x3000, 0xFB00)) + [0x41, 0x20000]:
+            c = chr(code)
+            for func, pattern in patterns.items():
+                self.assertEqual(bool(pattern.fullmatch(c)), func(c), hex(code))
+        self.assertFalse(is_kana("あい"))
+        self.assertFalse(is_kanji(""))
+
+    def test_whole_string(self):
+        self.assertTrue(contains_kana("我爱你ね"))
+        self.assertFalse(contains_kana("我爱你 abc"))
+        self.assertTrue(all_kanji("繰々返"))
+        self.assertFalse(all_kanji("繰り返"))
+        self.assertFalse(all_kanji(""))
+
+    def test_script_histogram(self):
+        histogram = script_histogram("心が踊る\n\n我的心 ab\n𠀋")
+        self.assertEqual((4, 5), histogram.shape)
+        self.assertEqual([0, 2, 0, 2, 0], list(histogram[0]))
+        self.assertEqual([0, 0, 0, 0, 0], list(histogram[1]))
+        self.assertEqual(3, histogram[2][KANJI])
+        self.assertEqual(3, histogram[2][ASCII])
+        self.assertEqual(1, histogram[3][OTHER])
+        self.assertEqual((1, 5), script_histogram("").shape)
+        rng = random.Random(0)
+        alphabet = "漢字々かなアー()（）\n a𠀋"
+        text = "".join(rng.choice(alphabet) for _ in range(500))
+        for line, counts in zip(text.split("\n"), script_histogram(text)):
+            self.assertEqual(len(line), counts.sum())
+            self.assertEqual(sum(is_kana(c) for c in line), counts[HIRAGANA] + counts[KATAKANA])
+
     def test_furigana_local(self):
         original = "接木（つぎき）のような時制の不連続。広場に殺（し）した感嘆符の葬列。"
         expected = "{{photrans|接木|つぎき}}のような時制の不連続。広場に{{photrans|殺|し}}した感嘆符の葬列。"
@@ -39,6 +77,15 @@ class Test(TestCase):
         original = "水底に沈(测试)く彫刻の（の）太陽。"
         self.assertEqual(original, furigana_local(original))
 
+    def test_furigana_local_same_as_before(self):
+        rng = random.Random(0)
+        alphabet = "漢字々かなアー()（）\n a"
+        for _ in range(5000):
+            text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+            self.assertEqual(previous_furigana_local(text), furigana_local(text), text)
+        for text in corpus(200).values():
+            self.assertEqual(previous_furigana_local(text), furigana_local(text))
+
 
 if __name__ == "__main__":
     unittest.main()
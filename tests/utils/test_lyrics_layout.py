@@ -0,0 +1,67 @@
+import unittest
+from unittest import TestCase
+
+from utils.lyrics_layout import detect_layout, process_translation, JAPANESE, CHINESE, ROMAJI, MIN_CONFIDENCE
+
+GROUPS = """夢を見た
+做了个梦
+yume wo mita
+
+心が踊る
+心在跳动
+kokoro ga odoru
+
+
+空は青い
+天空很蓝
+sora wa aoi"""
+
+BLOCKS = """夢を見た
+心が踊る
+做了个梦
+心在跳动
+
+空は青い
+天空很蓝"""
+
+
+class TestLyricsLayout(TestCase):
+    def test_groups(self):
+        layout = detect_layout(GROUPS)
+        self.assertEqual("夢を見た\n心が踊る\n\n空は青い", layout.japanese)
+        self.assertEqual("做了个梦\n心在跳动\n\n天空很蓝", layout.chinese)
+        self.assertEqual("yume wo mita\nkokoro ga odoru\n\nsora wa aoi", layout.romaji)
+        self.assertEqual(1, layout.confidence)
+        self.assertEqual({JAPANESE: 1, CHINESE: 2, ROMAJI: 3}, layout.lines)
+        self.assertIs(float, type(layout.confidence))
+        # the numbers still work for the convert button
+        for kind, text in ((JAPANESE, layout.japanese), (CHINESE, layout.chinese), (ROMAJI, layout.romaji)):
+            self.assertEqual(text, process_translation(GROUPS, layout.group_length, layout.lines[kind]))
+
+    def test_compact_groups(self):
+        layout = detect_layout("做了个梦\n夢を見た\n心在跳动\n心が踊る\n\n天空很蓝\n空は青い")
+        self.assertEqual("夢を見た\n心が踊る\n\n空は青い", layout.japanese)
+        self.assertEqual("做了个梦\n心在跳动\n\n天空很蓝", layout.chinese)
+        self.assertEqual("", layout.romaji)
+
+    def test_blocks(self):
+        layout = detect_layout(BLOCKS)
+        self.assertEqual("夢を見た\n心が踊る\n\n空は青い", layout.japanese)
+        self.assertEqual("做了个梦\n心在跳动\n\n天空很蓝", layout.chinese)
+        self.assertEqual(0, layout.group_length)
+        self.assertIs(float, type(layout.confidence))
+
+    def test_kanji_only_japanese_line(self):
+        # 運命 looks Chinese on its own but sits where the Japanese lines are
+        layout = detect_layout("夢を見た\n做了个梦\n運命\n命运\n心が踊る\n心在跳动")
+        self.assertEqual("夢を見た\n運命\n心が踊る", layout.japanese)
+        self.assertLess(layout.confidence, 1)
+        self.assertGreaterEqual(layout.confidence, MIN_CONFIDENCE)
+
+    def test_nothing_fits(self):
+        self.assertEqual(0, detect_layout("").confidence)
+        self.assertEqual(0, detect_layout("夢を見た\n心が踊る\n空は青い").confidence)
+
+
+if __name__ == "__main__":
+    unittest.main()
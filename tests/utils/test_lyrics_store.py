@@ -0,0 +1,75 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from models.song import Lyrics
+from tests.utils.test_at_wiki import fake_http_get, NO_HIT, SEARCH
+from tests.utils.test_cassette import AT_WIKI_SEARCH, AT_WIKI_PAGE, NAME, PRODUCER
+from utils.at_wiki import get_chinese_lyrics
+from utils.lyrics_store import LyricsStore, cached_lyrics, ATWIKI_CHINESE
+
+
+class TestLyricsStore(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = LyricsStore(Path(self.directory.name).joinpath("lyrics.sqlite3"), ttl=3600, miss_ttl=0.2)
+        self.patcher = patch("utils.lyrics_store.get_lyrics_store", lambda: self.store)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        lyrics = Lyrics(staff=[("翻译", "测试译者")], translator="测试译者", source_name="VOCALOID中文歌词wiki",
+                        source_url="https://w.atwiki.jp/vocaloidchly/pages/1.html", lyrics_chs="中文歌词",
+                        lyrics_jap="日本語の歌詞")
+        self.store.put(NAME, PRODUCER, ATWIKI_CHINESE, lyrics)
+        self.assertEqual(lyrics, self.store.get(NAME, PRODUCER, ATWIKI_CHINESE).lyrics)
+        self.assertIsNone(self.store.get(NAME, "", ATWIKI_CHINESE))
+
+    def test_miss_expires_sooner(self):
+        self.store.put(NAME, PRODUCER, ATWIKI_CHINESE, None)
+        self.store.put(NAME, "", ATWIKI_CHINESE, Lyrics(lyrics_chs="中文歌词"))
+        stored = self.store.get(NAME, PRODUCER, ATWIKI_CHINESE)
+        self.assertIsNotNone(stored)
+        self.assertIsNone(stored.lyrics)
+        time.sleep(0.3)
+        self.assertIsNone(self.store.get(NAME, PRODUCER, ATWIKI_CHINESE))
+        self.assertIsNotNone(self.store.get(NAME, "", ATWIKI_CHINESE))
+
+    def test_errors_not_stored(self):
+        def fail():
+            raise ConnectionError()
+
+        with self.assertRaises(ConnectionError):
+            cached_lyrics(NAME, PRODUCER, ATWIKI_CHINESE, fail)
+        self.assertIsNone(self.store.get(NAME, PRODUCER, ATWIKI_CHINESE))
+
+    def test_at_wiki(self):
+        pages = {SEARCH.format(NAME + "+" + PRODUCER): AT_WIKI_SEARCH, SEARCH.format(NAME): NO_HIT,
+                 "https://w.atwiki.jp/vocaloidchly/pages/1.html": AT_WIKI_PAGE}
+        with patch("utils.at_wiki.http_get", fake_http_get(pages)):
+            first = get_chinese_lyrics(NAME, PRODUCER)
+        # nothing is fetched the second time
+        with patch("utils.at_wiki.http_get", fake_http_get({})):
+            self.assertEqual(first, get_chinese_lyrics(NAME, PRODUCER))
+
+    def test_at_wiki_miss(self):
+        pages = {SEARCH.format("other+" + PRODUCER): NO_HIT, SEARCH.format("other"): NO_HIT}
+        with patch("utils.at_wiki.http_get", fake_http_get(pages)):
+            self.assertIsNone(get_chinese_lyrics("other", PRODUCER))
+        with patch("utils.at_wiki.http_get", fake_http_get({})):
+            self.assertIsNone(get_chinese_lyrics("other", PRODUCER))
+        # a failed search is not remembered as a miss
+        with patch("utils.at_wiki.http_get", fake_http_get({})):
+            self.assertIsNone(get_chinese_lyrics(NAME, PRODUCER))
+        self.assertIsNone(self.store.get(NAME, PRODUCER, ATWIKI_CHINESE))
+
+
+if __name__ == "__main__":
+    unittest.main()
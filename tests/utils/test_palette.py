@@ -0,0 +1,46 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import TestCase
+
+import numpy as np
+from PIL import Image
+
+from models.color import Color
+from utils.palette import suggest_colors, kmeans
+
+
+def cover() -> Image.Image:
+    pixels = np.zeros((360, 640, 3), dtype=np.uint8)
+    pixels[:] = (30, 60, 140)
+    pixels[100:260, 150:500] = (240, 220, 200)
+    pixels[160:200, 200:450] = (10, 10, 10)
+    return Image.fromarray(pixels)
+
+
+class TestPalette(TestCase):
+    def test_kmeans(self):
+        pixels = np.array([[0, 0, 0]] * 30 + [[255, 255, 255]] * 10, dtype=np.float32)
+        centers, counts = kmeans(pixels, k=2)
+        self.assertEqual({(0, 0, 0): 30, (255, 255, 255): 10},
+                         {tuple(int(c) for c in center): int(count) for center, count in zip(centers, counts)})
+
+    def test_suggest_colors(self):
+        scheme = suggest_colors(cover())
+        self.assertEqual(Color(30, 60, 140), scheme.background)
+        self.assertEqual(Color(240, 220, 200), scheme.text)
+
+    def test_single_color(self):
+        scheme = suggest_colors(Image.new("RGB", (50, 50), (250, 250, 250)))
+        self.assertEqual(Color(250, 250, 250), scheme.background)
+        self.assertEqual(Color(0, 0, 0), scheme.text)
+
+    def test_from_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory).joinpath("cover.png")
+            cover().save(path)
+            self.assertEqual(Color(30, 60, 140), suggest_colors(path).background)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+from unittest import TestCase
+
+from config.config import get_config
+from utils.session import get_session, close_sessions
+
+
+class TestSession(TestCase):
+    def tearDown(self):
+        get_config().proxies = None
+        close_sessions()
+
+    def test_session_reused(self):
+        self.assertIs(get_session(use_proxy=True), get_session(use_proxy=True))
+        self.assertIsNot(get_session(use_proxy=True), get_session(use_proxy=False))
+
+    def test_adapter_config(self):
+        adapter = get_session(use_proxy=False).get_adapter("https://vocadb.net/api/songs")
+        self.assertEqual(get_config().http.retries, adapter.max_retries.total)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+        self.assertEqual(get_config().http.pool_maxsize, adapter._pool_maxsize)
+
+    def test_proxies(self):
+        get_config().proxies = "http://127.0.0.1:8080"
+        self.assertEqual("http://127.0.0.1:8080", get_session(use_proxy=True).proxies['https'])
+        self.assertNotIn('https', get_session(use_proxy=False).proxies)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import gzip
+import io
+import unittest
+from unittest import TestCase
+
+import requests
+from urllib3 import HTTPResponse
+
+from models.video import NC_FIELDS, parse_nc_page
+from tests.utils.test_cassette import NICO_PAGE
+from utils.stream import extract_fields, CHUNK_SIZE
+
+
+def streamed(body: bytes) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(body)
+    return response
+
+
+class TestStream(TestCase):
+    def test_stops_early(self):
+        body = NICO_PAGE.replace("</head>", "</head>" + "x" * CHUNK_SIZE * 20).encode("utf-8")
+        extraction = extract_fields(streamed(body), NC_FIELDS)
+        self.assertEqual({'date': "2020-01-02", 'views': "123456",
+                          'thumb': "https://nicovideo.cdn.nimg.jp/thumbnails/1/1.L"}, extraction.fields)
+        self.assertEqual(CHUNK_SIZE, extraction.bytes_read)
+        self.assertIsNone(extraction.body)
+
+    def test_counts_compressed_bytes(self):
+        body = gzip.compress(NICO_PAGE.encode("utf-8"))
+        response = requests.Response()
+        response.status_code = 200
+        response.raw = HTTPResponse(io.BytesIO(body), headers={'Content-Encoding': 'gzip'}, preload_content=False)
+        extraction = extract_fields(response, NC_FIELDS)
+        self.assertTrue(extraction.complete(NC_FIELDS))
+        self.assertEqual(len(body), extraction.bytes_read)
+        self.assertLess(extraction.bytes_read, len(NICO_PAGE.encode("utf-8")))
+
+    def test_split_between_chunks(self):
+        padding = "x" * (CHUNK_SIZE - NICO_PAGE.find("userInteractionCount") - 5)
+        extraction = extract_fields(streamed((padding + NICO_PAGE).encode("utf-8")), NC_FIELDS)
+        self.assertEqual("123456", extraction.fields['views'])
+
+    def test_number_split_between_chunks(self):
+        # the chunk ends three digits into 123456
+        digits = NICO_PAGE.find("123456")
+        padding = "x" * (CHUNK_SIZE - digits - 3)
+        extraction = extract_fields(streamed((padding + NICO_PAGE).encode("utf-8")), NC_FIELDS)
+        self.assertEqual("123456", extraction.fields['views'])
+
+    def test_same_as_full_parser(self):
+        page = NICO_PAGE.replace('content="https://nicovideo.cdn.nimg.jp/thumbnails/1/1.L"',
+                                 'content="https://nicovideo.cdn.nimg.jp/thumbnails/1/1.L?a=1&amp;b=2"')
+        extraction = extract_fields(streamed(page.encode("utf-8")), NC_FIELDS)
+        self.assertEqual(parse_nc_page("sm1", "", page).thumb_url, extraction.fields['thumb'])
+
+    def test_incomplete(self):
+        body = NICO_PAGE.replace("userInteractionCount", "other").encode("utf-8")
+        extraction = extract_fields(streamed(body), NC_FIELDS)
+        self.assertNotIn('views', extraction.fields)
+        self.assertEqual(body, extraction.body)
+
+
+if __name__ == "__main__":
+    unittest.main()
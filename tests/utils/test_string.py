@@ -1,7 +1,7 @@
 import unittest
 from unittest import TestCase
 
-from utils.string import process_lyrics_jap
+from utils.string import process_lyrics_jap, file_name
 
 
 class TestString(TestCase):
@@ -24,6 +24,10 @@ class TestString(TestCase):
                          process_lyrics_jap(self.s1))
         self.assertEqual(self.more_newline_expected, process_lyrics_jap(self.more_newline))
 
+    def test_file_name(self):
+        self.assertEqual("1／6", file_name("1/6"))
+        self.assertEqual("何？＊", file_name("何?*"))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,52 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import TestCase
+
+from tests.utils.test_cassette import write_cassette, prepared_url
+from utils.cassette import use_cassette, REPLAY
+from utils.helpers import set_prompt_answers
+from utils.vocadb import search_song_id, VOCADB_SONG_QUERY_URL, PARAMS_NARROW, PARAMS_BROAD
+
+NAME = "ロキ"
+
+
+def search_result(*ids: int) -> str:
+    return json.dumps({'items': [{'id': i, 'defaultName': NAME, 'artistString': f"P{i}", 'songType': 'Original'}
+                                 for i in ids]})
+
+
+class TestSearch(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name).joinpath("search.cassette")
+        write_cassette(self.path, {
+            prepared_url(VOCADB_SONG_QUERY_URL, {**PARAMS_NARROW, 'query': NAME}): search_result(1, 2),
+            prepared_url(VOCADB_SONG_QUERY_URL, {**PARAMS_BROAD, 'query': NAME}): search_result(1, 2, 3),
+        })
+        self.shown = []
+
+    def tearDown(self):
+        set_prompt_answers(None)
+        self.directory.cleanup()
+
+    def reject_first_round(self, choices: list) -> int:
+        self.shown.append(choices)
+        return len(choices)
+
+    def test_broad_after_rejection(self):
+        set_prompt_answers({'vocadb_song': self.reject_first_round})
+        with use_cassette(self.path, REPLAY):
+            self.assertEqual(3, search_song_id(NAME))
+        # songs rejected from the narrow search are not offered again, so the only new song is used directly
+        self.assertEqual(1, len(self.shown))
+
+    def test_narrow_choice(self):
+        set_prompt_answers({'vocadb_song': 2})
+        with use_cassette(self.path, REPLAY):
+            self.assertEqual(2, search_song_id(NAME))
+
+
+if __name__ == "__main__":
+    unittest.main()
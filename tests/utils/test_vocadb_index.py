@@ -0,0 +1,122 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from sync_vocadb import sync, PARAMS_SYNC
+from tests.utils.test_cassette import write_cassette, prepared_url
+from utils.cassette import use_cassette, REPLAY
+from utils.vocadb import VOCADB_SONG_QUERY_URL, PARAMS_NARROW, search_vocadb
+from utils.vocadb_index import VocaDBIndex, FULL_SCOPE
+
+PRODUCER = {'id': 10, 'name': "みきとP", 'additionalNames': "mikitoP", 'artistType': 'Producer'}
+
+
+def song(song_id: int, name: str, created: str, song_type: str = 'Original') -> dict:
+    return {'id': song_id, 'defaultName': name, 'additionalNames': name + " (English)",
+            'artistString': "みきとP feat. 初音ミク", 'songType': song_type, 'createDate': created,
+            'publishDate': created, 'artists': [{'artist': PRODUCER}]}
+
+
+class TestVocaDBIndex(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name)
+        self.index = VocaDBIndex(self.path.joinpath("index.sqlite3"))
+
+    def tearDown(self):
+        self.index.close()
+        self.directory.cleanup()
+
+    def test_find_and_search(self):
+        self.index.add_songs([song(1, "ロキ", "2018-01-01"), song(2, "ロキ", "2019-01-01", "Cover")])
+        self.assertEqual([2, 1], [s['id'] for s in self.index.find_songs("ロキ")])
+        self.assertEqual([1], [s['id'] for s in self.index.find_songs("ロキ", "Original")])
+        self.assertEqual({1, 2}, {s['id'] for s in self.index.search("English")})
+        self.assertEqual({1, 2}, {s['id'] for s in self.index.search("ロキ")})
+        self.assertEqual([10], [a['id'] for a in self.index.search_artists("mikito")])
+        self.assertEqual([1, 2], [s['id'] for s in self.index.songs_by_artist(10)])
+
+    def test_find_songs_newest_first(self):
+        self.index.add_songs([song(1, "ロキ", "2018-01-01"), song(3, "ロキ", "2020-01-01"),
+                              song(2, "ロキ", "2020-01-01"), song(4, "ロキ", "2019-06-01")])
+        self.assertEqual([3, 2, 4, 1], [s['id'] for s in self.index.find_songs("ロキ")])
+
+    def test_partial_payload_keeps_names(self):
+        self.index.add_songs([song(1, "ロキ", "2018-01-01")])
+        # search results carry no additionalNames
+        self.index.add_songs([{'id': 1, 'defaultName': "ロキ", 'artistString': "みきとP"}])
+        self.assertEqual("ロキ (English)", self.index.find_songs("ロキ")[0]['additionalNames'])
+        self.assertEqual([1], [s['id'] for s in self.index.search("English")])
+        self.assertEqual([], self.index.search("初音ミク"))
+
+    def test_incremental_sync(self):
+        cassette = self.path.joinpath("sync.cassette")
+        url = prepared_url(VOCADB_SONG_QUERY_URL, {**PARAMS_SYNC, 'artistId[]': [10], 'start': 0,
+                                                   'maxResults': 50, 'getTotalCount': 'false'})
+        old = [song(2, "ハッピーシンセサイザ", "2019-01-01"), song(1, "ロキ", "2018-01-01")]
+        write_cassette(cassette, {url: json.dumps({'items': old})})
+        with use_cassette(cassette, REPLAY):
+            self.assertEqual(2, sync(self.index, [10]))
+        write_cassette(cassette, {url: json.dumps({'items': [song(3, "新曲", "2020-01-01"), *old]})})
+        with use_cassette(cassette, REPLAY):
+            self.assertEqual(1, sync(self.index, [10]))
+        self.assertEqual(3, self.index.count())
+        self.assertEqual("2020-01-01", self.index.get_watermark("artists:10"))
+
+    def test_sync_without_new_songs_is_recorded(self):
+        cassette = self.path.joinpath("sync.cassette")
+        url = prepared_url(VOCADB_SONG_QUERY_URL, {**PARAMS_SYNC, 'start': 0, 'maxResults': 50,
+                                                   'getTotalCount': 'false'})
+        write_cassette(cassette, {url: json.dumps({'items': [song(1, "ロキ", "2018-01-01")]})})
+        with use_cassette(cassette, REPLAY):
+            sync(self.index, [])
+        first = self.index.synced_at(FULL_SCOPE)
+        with use_cassette(cassette, REPLAY):
+            self.assertEqual(0, sync(self.index, []))
+        self.assertGreaterEqual(self.index.synced_at(FULL_SCOPE), first)
+        self.assertEqual("2018-01-01", self.index.get_watermark(FULL_SCOPE))
+
+
+class TestIndexedSearch(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name)
+        self.index = VocaDBIndex(self.path.joinpath("index.sqlite3"))
+        # a song seen earlier; another song of the same name was published since
+        self.index.add_songs([song(1, "ロキ", "2018-01-01")])
+        self.cassette = self.path.joinpath("search.cassette")
+        url = prepared_url(VOCADB_SONG_QUERY_URL, {**PARAMS_NARROW, 'query': "ロキ"})
+        # VocaDB's PublishDate sort lists the newest song first
+        write_cassette(self.cassette, {url: json.dumps({'items': [song(5, "ロキ", "2022-01-01"),
+                                                                  song(1, "ロキ", "2018-01-01")]})})
+        self.offline = self.path.joinpath("offline.cassette")
+        write_cassette(self.offline, {})
+        self.patcher = patch("utils.vocadb.get_vocadb_index", lambda: self.index)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.index.close()
+        self.directory.cleanup()
+
+    def test_stale_index_searches_online(self):
+        with use_cassette(self.cassette, REPLAY):
+            self.assertEqual([5, 1], [s['id'] for s in search_vocadb("ロキ", PARAMS_NARROW)])
+        self.assertEqual([5, 1], [s['id'] for s in self.index.find_songs("ロキ")])
+
+    def test_fresh_index_answers_alone(self):
+        self.index.set_watermark(FULL_SCOPE, "2018-01-01")
+        with use_cassette(self.offline, REPLAY):
+            self.assertEqual([1], [s['id'] for s in search_vocadb("ロキ", PARAMS_NARROW)])
+
+    def test_index_when_offline(self):
+        with use_cassette(self.offline, REPLAY):
+            self.assertEqual([1], [s['id'] for s in search_vocadb("ロキ", PARAMS_NARROW)])
+            self.assertEqual([], search_vocadb("ハッピーシンセサイザ", PARAMS_NARROW))
+
+
+if __name__ == "__main__":
+    unittest.main()
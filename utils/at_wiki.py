@@ -1,15 +1,15 @@
 import logging
 import re
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from typing import Tuple, List, Optional
 
-from config import data
 from config.config import get_config
 from i18n.i18n import _
 from models.song import Lyrics
 from utils.helpers import prompt_response, http_get
+from utils.lyrics_store import cached_lyrics, ATWIKI_CHINESE, ATWIKI_JAPANESE
 from utils.string import is_empty
 
 
@@ -23,31 +23,31 @@ def parse_at_wiki_header(header: str) -> List[Tuple[str, str]]:
     return result
 
 
-def is_lyrics(line: str) -> bool:
+def is_lyrics(line: str, name: str) -> bool:
     line = line.strip()
     return not (line == "歌詞" or
-                line == data.name_japanese or
-                (data.name_japanese in line and ("オリジナル" in line or
-                                                 re.match("[【『]+", line) or
-                                                 "歌詞" in line)) or
+                line == name or
+                (name in line and ("オリジナル" in line or
+                                   re.match("[【『]+", line) or
+                                   "歌詞" in line)) or
                 (("転載" in line or "转载" in line or "取り" in line)
                  and re.match("[(（]+", line))
                 )
 
 
-def strip_initial_lines(lines: List[str]) -> List[str]:
+def strip_initial_lines(lines: List[str], name: str) -> List[str]:
     index = 0
     while index < len(lines):
-        if not is_empty(lines[index]) and is_lyrics(lines[index]):
+        if not is_empty(lines[index]) and is_lyrics(lines[index], name):
             return lines[index:]
         index += 1
     return []
 
 
-def parse_at_wiki_body(body: str) -> str:
+def parse_at_wiki_body(body: str, name: str) -> str:
     lines = body.split("\n")
     result = []
-    lines = strip_initial_lines(lines)
+    lines = strip_initial_lines(lines, name)
     state = 0
     index = 0
     while index < len(lines):
@@ -69,34 +69,76 @@ def shorten_url(url: str) -> str:
     return url
 
 
-def get_at_wiki_body(name: str, urls: List[str], lang: str, producer: str) -> Optional[Lyrics]:
+# everything get_at_wiki_body reads is inside this div; the menus and comments around it are not parsed
+WIKIBODY = SoupStrainer("div", id="wikibody")
+
+
+def wikibody(url: str) -> Optional[BeautifulSoup]:
+    soup = BeautifulSoup(http_get(url, use_proxy=True).text, "html.parser", parse_only=WIKIBODY)
+    return soup.find("div", {"id": "wikibody"})
+
+
+def search_hit(url: str, name: str, producer: str) -> Optional[str]:
+    body = wikibody(url)
+    result_list = body.find("ul") if body is not None else None
+    if result_list is None:
+        return None
+    match = result_list.find_all("li", limit=1)
+    if len(match) > 0 and match[0].find("a") and (match[0].find("a").text == name or
+                                                  match[0].find("a").text == name + "/" + producer):
+        return "https:" + match[0].find("a").get("href")
+    return None
+
+
+def search_at_wiki(name: str, urls: List[str], producer: str) -> Optional[str]:
+    """
+    Run all searches at once and return the hit of the first url that has one. Raises if there is
+    no hit and a search failed, since the song may well be on atwiki.
+    """
+    urls = list(dict.fromkeys(urls))
+    executor = ThreadPoolExecutor(max_workers=len(urls))
+    error = None
     try:
-        found = None
-        for url in urls:
-            soup = BeautifulSoup(http_get(url, use_proxy=True).text, "html.parser")
-            result_list = soup.find("div", {"id": "wikibody"}).find("ul")
-            if result_list is None:
+        futures = [executor.submit(search_hit, url, name, producer) for url in urls]
+        for url, future in zip(urls, futures):
+            try:
+                found = future.result()
+            except Exception as e:
+                logging.debug("At wiki search " + url + " failed", exc_info=e)
+                error = e
                 continue
-            match = result_list.find_all("li", limit=1)
-            if len(match) > 0 and match[0].find("a") and (match[0].find("a").text == name or
-                                                          match[0].find("a").text == name + "/" + producer):
-                found = "https:" + match[0].find("a").get("href")
-                break
-        if found is None:
-            return None
-        logging.debug("At wiki url " + found)
-        soup = BeautifulSoup(http_get(found, use_proxy=True).text, "html.parser")
-        # remove last modify message from body
-        for elem in soup.find_all("div", attrs={'class': 'atwiki-lastmodify'}):
-            elem.decompose()
-        res = parse_body(name, soup.find("div", {"id": "wikibody"}).text)
-        translator = [s for s in res[0] if s[0] == "翻译" or s[0] == "翻譯"]
-        if len(translator) == 0:
-            translator = "ERROR!"
-        else:
-            translator = translator[0][1]
-        return Lyrics(staff=res[0], source_name="VOCALOID中文歌词wiki", source_url=shorten_url(found), lyrics_chs=res[1],
-                      translator=translator)
+            if found is not None:
+                return found
+        if error is not None:
+            raise error
+        return None
+    finally:
+        # a later search is not waited for once an earlier one has a hit
+        executor.shutdown(wait=False)
+
+
+def fetch_at_wiki_body(name: str, urls: List[str], producer: str) -> Optional[Lyrics]:
+    found = search_at_wiki(name, urls, producer)
+    if found is None:
+        return None
+    logging.debug("At wiki url " + found)
+    body = wikibody(found)
+    # remove last modify message from body
+    for elem in body.find_all("div", attrs={'class': 'atwiki-lastmodify'}):
+        elem.decompose()
+    res = parse_body(name, body.text)
+    translator = [s for s in res[0] if s[0] == "翻译" or s[0] == "翻譯"]
+    if len(translator) == 0:
+        translator = "ERROR!"
+    else:
+        translator = translator[0][1]
+    return Lyrics(staff=res[0], source_name="VOCALOID中文歌词wiki", source_url=shorten_url(found), lyrics_chs=res[1],
+                  translator=translator)
+
+
+def get_at_wiki_body(name: str, urls: List[str], lang: str, producer: str, source: str) -> Optional[Lyrics]:
+    try:
+        return cached_lyrics(name, producer, source, lambda: fetch_at_wiki_body(name, urls, producer))
     except Exception as e:
         logging.error(e)
         logging.error("An error occurred while fetching " + lang + " lyrics from atwiki. Falling back...")
@@ -126,17 +168,19 @@ def parse_body(name: str, text: str) -> (List[Tuple[str, str]], str):
         index = 0
     index = body.find("\n", index) + 1
     body = body[index:]
-    return parse_at_wiki_header(header), parse_at_wiki_body(body)
+    return parse_at_wiki_header(header), parse_at_wiki_body(body, name)
 
 
 def get_japanese_lyrics(name: str, producer: str = "") -> str:
     logging.info(_("jap_atwiki"))
     url_jap = "https://w.atwiki.jp/hmiku/search?andor=and&keyword={}&search_field=source"
-    res = get_at_wiki_body(name, [url_jap.format(name + "+" + producer), url_jap.format(name)], "Japanese", producer)
+    res = get_at_wiki_body(name, [url_jap.format(name + "+" + producer), url_jap.format(name)], "Japanese", producer,
+                           ATWIKI_JAPANESE)
     return res.lyrics_chs if res else ""
 
 
 def get_chinese_lyrics(name: str, producer: str = "") -> Optional[Lyrics]:
     logging.info(_("chs_atwiki"))
     url_chs = "https://w.atwiki.jp/vocaloidchly/search?andor=and&keyword={}&search_field=source"
-    return get_at_wiki_body(name, [url_chs.format(name + '+' + producer), url_chs.format(name)], "Chinese", producer)
+    return get_at_wiki_body(name, [url_chs.format(name + '+' + producer), url_chs.format(name)], "Chinese", producer,
+                            ATWIKI_CHINESE)
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from config.config import get_config, get_output_path
+
+VALIDATOR_HEADERS = ['ETag', 'Last-Modified', 'Content-Type']
+
+
+def full_url(url: str, params: Optional[dict]) -> str:
+    if not params:
+        return url
+    return requests.Request('GET', url, params=params).prepare().url
+
+
+def cache_key(url: str, headers: Optional[dict]) -> str:
+    # headers sent with a request can change the response, e.g. Accept-Language, so they are part of the key
+    if not headers:
+        return url
+    return url + "\n" + json.dumps(sorted((k.lower(), str(v)) for k, v in headers.items()), ensure_ascii=False)
+
+
+def build_response(entry: dict, body: bytes) -> requests.Response:
+    response = requests.Response()
+    response.status_code = entry['status']
+    response.reason = entry.get('reason', 'OK')
+    response.headers = CaseInsensitiveDict(entry['headers'])
+    response.url = entry['url']
+    response.encoding = entry['encoding']
+    response._content = body
+    response._content_consumed = True
+    return response
+
+
+class ResponseCache:
+    """
+    Disk cache for successful GET responses.
+    Bodies are stored once under the hash of their content in objects/; every url, together with
+    the headers sent with it, gets a small metadata file in entries/ pointing to its body. Entries are fresh for the ttl of the longest
+    matching url prefix and are revalidated with ETag/Last-Modified afterwards. Least recently
+    used entries are evicted once the bodies exceed max_size bytes.
+    """
+
+    def __init__(self, directory: Path, max_size: int, default_ttl: float, ttl: Dict[str, float] = None):
+        self.entry_dir = directory.joinpath("entries")
+        self.object_dir = directory.joinpath("objects")
+        self.entry_dir.mkdir(parents=True, exist_ok=True)
+        self.object_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        # longest prefix first so that the most specific rule wins
+        self.ttl = sorted((ttl or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self.lock = threading.RLock()
+        self.size: Optional[int] = None
+
+    def ttl_for(self, url: str) -> float:
+        for prefix, ttl in self.ttl:
+            if url.startswith(prefix):
+                return ttl
+        return self.default_ttl
+
+    def entry_path(self, key: str) -> Path:
+        return self.entry_dir.joinpath(hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def load(self, key: str) -> Optional[Tuple[dict, bytes]]:
+        path = self.entry_path(key)
+        with self.lock:
+            try:
+                entry = json.loads(path.read_text(encoding="utf-8"))
+                body = self.object_dir.joinpath(entry['object']).read_bytes()
+            except (OSError, ValueError, KeyError):
+                return None
+            # the modification time of the entry records the last access for LRU eviction
+            os.utime(path)
+        return entry, body
+
+    def write_entry(self, key: str, entry: dict):
+        path = self.entry_path(key)
+        temp = path.with_suffix(".tmp" + str(threading.get_ident()))
+        temp.write_text(json.dumps(entry, ensure_ascii=False), encoding="utf-8")
+        os.replace(temp, path)
+
+    def store(self, key: str, url: str, response: requests.Response) -> requests.Response:
+        body = response.content
+        digest = hashlib.sha256(body).hexdigest()
+        entry = {
+            'url': url,
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': {h: response.headers[h] for h in VALIDATOR_HEADERS if h in response.headers},
+            'encoding': response.encoding,
+            'object': digest,
+            'size': len(body),
+            'stored': time.time()
+        }
+        with self.lock:
+            obj = self.object_dir.joinpath(digest)
+            if not obj.exists():
+                obj.write_bytes(body)
+                if self.size is not None:
+                    self.size += len(body)
+            self.write_entry(key, entry)
+            self.evict()
+        response.close()
+        return build_response(entry, body)
+
+    def refresh(self, key: str, entry: dict, response: requests.Response):
+        # a 304 may carry new validators for the same body
+        entry['headers'].update({h: response.headers[h] for h in VALIDATOR_HEADERS if h in response.headers})
+        entry['stored'] = time.time()
+        with self.lock:
+            self.write_entry(key, entry)
+
+    def lookup(self, url: str, params: dict = None, headers: dict = None) -> Optional[requests.Response]:
+        url = full_url(url, params)
+        cached = self.load(cache_key(url, headers))
+        if cached is None or time.time() - cached[0]['stored'] > self.ttl_for(url):
+            return None
+        return build_response(*cached)
+
+    def get(self, session: requests.Session, url: str, **kwargs) -> requests.Response:
+        url = full_url(url, kwargs.pop('params', None))
+        ttl = self.ttl_for(url)
+        if ttl <= 0:
+            return session.get(url, **kwargs)
+        headers = dict(kwargs.pop('headers', None) or {})
+        key = cache_key(url, headers)
+        cached = self.load(key)
+        if cached is not None and time.time() - cached[0]['stored'] <= ttl:
+            logging.debug("Cache hit for " + url)
+            return build_response(*cached)
+        if cached is not None:
+            validators = cached[0]['headers']
+            if 'ETag' in validators:
+                headers['If-None-Match'] = validators['ETag']
+            if 'Last-Modified' in validators:
+                headers['If-Modified-Since'] = validators['Last-Modified']
+        try:
+            response = session.get(url, headers=headers, **kwargs)
+        except requests.RequestException as e:
+            if cached is None:
+                raise
+            logging.warning("Request to " + url + " failed. Using stale cached response.")
+            logging.debug("Detailed error: ", exc_info=e)
+            return build_response(*cached)
+        if response.status_code == 304 and cached is not None:
+            logging.debug("Cached response for " + url + " revalidated")
+            response.close()
+            self.refresh(key, cached[0], response)
+            return build_response(*cached)
+        if response.status_code == 200:
+            return self.store(key, url, response)
+        return response
+
+    def total_size(self) -> int:
+        if self.size is None:
+            self.size = sum(f.stat().st_size for f in self.object_dir.iterdir())
+        return self.size
+
+    def evict(self):
+        if self.total_size() <= self.max_size:
+            return
+        entries = []
+        references: Dict[str, int] = dict()
+        for path in self.entry_dir.glob("*.json"):
+            try:
+                entry = json.loads(path.read_text(encoding="utf-8"))
+                entries.append((path.stat().st_mtime, path, entry))
+            except (OSError, ValueError):
+                path.unlink(missing_ok=True)
+                continue
+            references[entry['object']] = references.get(entry['object'], 0) + 1
+        entries.sort(key=lambda e: e[0])
+        for _, path, entry in entries:
+            if self.size <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            references[entry['object']] -= 1
+            if references[entry['object']] == 0:
+                self.object_dir.joinpath(entry['object']).unlink(missing_ok=True)
+                self.size -= entry['size']
+        logging.debug(f"Evicted cached responses; cache size is now {self.size} bytes")
+
+
+response_cache: Optional[ResponseCache] = None
+response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    global response_cache
+    cache_config = get_config().cache
+    if not cache_config.enabled:
+        return None
+    with response_cache_lock:
+        if response_cache is None:
+            directory = get_output_path().joinpath(Path(cache_config.directory or "cache").expanduser())
+            response_cache = ResponseCache(directory, max_size=cache_config.max_size_mb * 1024 * 1024,
+                                           default_ttl=cache_config.default_ttl_hours * 3600,
+                                           ttl={prefix: hours * 3600 for prefix, hours in cache_config.ttl_hours.items()})
+        return response_cache
@@ -0,0 +1,199 @@
+import atexit
+import base64
+import gzip
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from config.config import get_config, get_output_path
+from utils.session import set_adapter_wrapper
+from utils.string import is_empty
+
+RECORD = "record"
+REPLAY = "replay"
+
+# bodies are stored decoded, so transport headers such as Content-Encoding must not be replayed
+RECORDED_HEADERS = ['Content-Type', 'Location', 'ETag', 'Last-Modified']
+
+
+def encode_body(body: bytes) -> dict:
+    try:
+        return {'text': body.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {'base64': base64.b64encode(body).decode("ascii")}
+
+
+def decode_body(interaction: dict) -> bytes:
+    if 'text' in interaction:
+        return interaction['text'].encode("utf-8")
+    return base64.b64decode(interaction['base64'])
+
+
+class Cassette:
+    """
+    A gzipped JSON file holding every HTTP exchange and every line typed into the program during
+    one run. In record mode exchanges go to the network and are appended; in replay mode they are
+    answered from the file in the order they were recorded and the network is never touched.
+    """
+
+    def __init__(self, path: Union[str, Path], mode: str):
+        self.path = Path(path)
+        self.mode = mode
+        self.interactions: List[dict] = []
+        self.inputs: List[str] = []
+        self.by_key: Dict[str, List[dict]] = dict()
+        self.positions: Dict[str, int] = dict()
+        self.input_position = 0
+        self.lock = threading.Lock()
+        if mode == REPLAY:
+            self.load()
+
+    @staticmethod
+    def key(method: str, url: str) -> str:
+        return method.upper() + " " + url
+
+    def load(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        for interaction in data['interactions']:
+            self.add(interaction)
+        self.inputs = data.get('inputs', [])
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.lock, gzip.open(self.path, "wt", encoding="utf-8") as f:
+            json.dump({'version': 1, 'interactions': self.interactions, 'inputs': self.inputs},
+                      f, ensure_ascii=False, separators=(',', ':'))
+        logging.info(f"Recorded {len(self.interactions)} HTTP exchanges to {self.path}")
+
+    def add(self, interaction: dict):
+        self.interactions.append(interaction)
+        self.by_key.setdefault(self.key(interaction['method'], interaction['url']), []).append(interaction)
+
+    def record(self, request: requests.PreparedRequest, response: requests.Response):
+        interaction = {
+            'method': request.method,
+            'url': request.url,
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': {h: response.headers[h] for h in RECORDED_HEADERS if h in response.headers},
+            **encode_body(response.content)
+        }
+        with self.lock:
+            self.add(interaction)
+
+    def play(self, request: requests.PreparedRequest) -> Optional[dict]:
+        key = self.key(request.method, request.url)
+        with self.lock:
+            candidates = self.by_key.get(key)
+            if not candidates:
+                return None
+            # identical requests are answered in recording order; the last answer is reused afterwards
+            position = self.positions.get(key, 0)
+            self.positions[key] = position + 1
+            return candidates[min(position, len(candidates) - 1)]
+
+    def record_input(self, s: str):
+        with self.lock:
+            self.inputs.append(s)
+
+    def next_input(self) -> Optional[str]:
+        with self.lock:
+            if self.input_position >= len(self.inputs):
+                return None
+            self.input_position += 1
+            return self.inputs[self.input_position - 1]
+
+    def rewind(self):
+        with self.lock:
+            self.positions.clear()
+            self.input_position = 0
+
+
+class CassetteAdapter(HTTPAdapter):
+    def __init__(self, cassette: Cassette, adapter: HTTPAdapter):
+        super().__init__()
+        self.cassette = cassette
+        self.adapter = adapter
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        if self.cassette.mode == REPLAY:
+            interaction = self.cassette.play(request)
+            if interaction is None:
+                raise requests.ConnectionError(f"No recorded response for {request.method} {request.url}",
+                                               request=request)
+            return self.replay_response(request, interaction)
+        response = self.adapter.send(request, **kwargs)
+        self.cassette.record(request, response)
+        return response
+
+    def replay_response(self, request: requests.PreparedRequest, interaction: dict) -> requests.Response:
+        response = requests.Response()
+        response.status_code = interaction['status']
+        response.reason = interaction['reason']
+        response.headers = CaseInsensitiveDict(interaction['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = decode_body(interaction)
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+cassette: Optional[Cassette] = None
+
+
+def get_cassette() -> Optional[Cassette]:
+    return cassette
+
+
+def start_cassette(path: Union[str, Path], mode: str) -> Cassette:
+    global cassette
+    if mode not in (RECORD, REPLAY):
+        raise ValueError("Cassette mode must be either " + RECORD + " or " + REPLAY)
+    cassette = Cassette(path, mode)
+    c = cassette
+    set_adapter_wrapper(lambda adapter: CassetteAdapter(c, adapter))
+    logging.info(f"Cassette {path} started in {mode} mode")
+    return cassette
+
+
+def stop_cassette():
+    global cassette
+    if cassette is None:
+        return
+    if cassette.mode == RECORD:
+        cassette.save()
+    cassette = None
+    set_adapter_wrapper(None)
+
+
+@contextmanager
+def use_cassette(path: Union[str, Path], mode: str):
+    c = start_cassette(path, mode)
+    try:
+        yield c
+    finally:
+        stop_cassette()
+
+
+def setup_cassette():
+    http_config = get_config().http
+    if is_empty(http_config.cassette_mode):
+        return
+    path = get_output_path().joinpath(Path(http_config.cassette).expanduser())
+    start_cassette(path, http_config.cassette_mode)
+    # make sure the exchanges are written even if the program crashes halfway
+    atexit.register(stop_cassette)
@@ -0,0 +1,75 @@
+"""
+sRGB color math shared by models.color and the image code. Scalar functions take 0-255 channel
+values; the batch functions take arrays whose last axis holds red, green and blue.
+"""
+from typing import Tuple
+
+import numpy as np
+
+
+def srgb_to_linear(channel: float) -> float:
+    if channel <= 0.04045:
+        return channel / 12.92
+    return pow(((channel + 0.055) / 1.055), 2.4)
+
+
+# linear light of every 8-bit channel value
+LINEAR_LIST = [srgb_to_linear(value / 255) for value in range(256)]
+LINEAR = np.array(LINEAR_LIST, dtype=np.float64)
+
+# CIE L* switches from linear to cube root at this luminance
+L_STAR_CUTOFF = 216 / 24389
+L_STAR_SLOPE = 24389 / 27
+
+
+def relative_luminance(red: int, green: int, blue: int) -> float:
+    return 0.2126 * LINEAR_LIST[red] + 0.7152 * LINEAR_LIST[green] + 0.0722 * LINEAR_LIST[blue]
+
+
+def lightness_from_luminance(y: float) -> int:
+    if y <= L_STAR_CUTOFF:
+        return round(y * L_STAR_SLOPE)
+    return round(pow(y, (1 / 3)) * 116 - 16)
+
+
+def perceived_lightness(red: int, green: int, blue: int) -> int:
+    """
+    CIE L* (0-100) of an sRGB color.
+    """
+    return lightness_from_luminance(relative_luminance(red, green, blue))
+
+
+def contrast_ratio(a: Tuple[int, int, int], b: Tuple[int, int, int]) -> float:
+    """
+    WCAG 2 contrast ratio, from 1 to 21.
+    """
+    la, lb = relative_luminance(*a), relative_luminance(*b)
+    return (max(la, lb) + 0.05) / (min(la, lb) + 0.05)
+
+
+WHITE_LIGHTNESS = perceived_lightness(255, 255, 255)
+
+
+def prefers_black_text(red: int, green: int, blue: int) -> bool:
+    return perceived_lightness(red, green, blue) > WHITE_LIGHTNESS / 2
+
+
+def relative_luminance_batch(rgb: np.ndarray) -> np.ndarray:
+    rgb = np.asarray(rgb, dtype=np.uint8)
+    return 0.2126 * LINEAR[rgb[..., 0]] + 0.7152 * LINEAR[rgb[..., 1]] + 0.0722 * LINEAR[rgb[..., 2]]
+
+
+def perceived_lightness_batch(rgb: np.ndarray) -> np.ndarray:
+    y = relative_luminance_batch(rgb)
+    lightness = np.where(y <= L_STAR_CUTOFF, y * L_STAR_SLOPE, np.power(y, 1 / 3) * 116 - 16)
+    # same half-to-even rounding as round()
+    return np.rint(lightness).astype(np.int64)
+
+
+def contrast_ratio_batch(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    la, lb = relative_luminance_batch(a), relative_luminance_batch(b)
+    return (np.maximum(la, lb) + 0.05) / (np.minimum(la, lb) + 0.05)
+
+
+def prefers_black_text_batch(rgb: np.ndarray) -> np.ndarray:
+    return perceived_lightness_batch(rgb) > WHITE_LIGHTNESS / 2
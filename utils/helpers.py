@@ -1,21 +1,64 @@
+import logging
 import math
-from typing import Union, Callable, List
+import threading
+import time
+from typing import Union, Callable, List, Dict, Optional, Any
 
 import requests
 
 from config.config import get_config
+from utils.cache import get_response_cache
+from utils.cassette import get_cassette, REPLAY, RECORD
 from utils.save_input import save_input
+from utils.session import get_session
 from utils.string import is_empty
 
 
+class NonInteractiveError(Exception):
+    pass
+
+
+# answers for prompts when running without a user (e.g. batch mode); set per thread
+prompt_answers = threading.local()
+
+
+def set_prompt_answers(answers: Optional[Dict[str, Any]]):
+    """
+    Switch the current thread to non-interactive mode. Prompts with a key are answered from
+    the dict: values are either the answer itself or a function that receives the list of
+    choices and returns the answer. Prompts without an answer raise NonInteractiveError.
+    :param answers: None to go back to reading from stdin.
+    """
+    prompt_answers.answers = answers
+
+
+def is_interactive() -> bool:
+    return getattr(prompt_answers, 'answers', None) is None
+
+
+def answer_prompt(prompt: str, key: Optional[str], choices: List[str] = None) -> Any:
+    answers = prompt_answers.answers
+    if key is None or key not in answers:
+        raise NonInteractiveError("No answer available for prompt: " + prompt.split("\n")[0])
+    answer = answers[key]
+    return answer(choices) if callable(answer) else answer
+
+
 def get_input() -> str:
-    s = input()
+    cassette = get_cassette()
+    s = cassette.next_input() if cassette is not None and cassette.mode == REPLAY else None
+    if s is None:
+        s = input()
+    if cassette is not None and cassette.mode == RECORD:
+        cassette.record_input(s)
     save_input(s)
     return s
 
 
 def prompt_response(prompt: str, auto_strip: bool = True,
-                    validity_checker: Callable[[str], bool] = lambda x: True) -> str:
+                    validity_checker: Callable[[str], bool] = lambda x: True, key: str = None) -> str:
+    if not is_interactive():
+        return str(answer_prompt(prompt, key))
     print(prompt)
     while True:
         s = get_input()
@@ -40,7 +83,9 @@ def get_number_validity_checker(start: int, end: int) -> Callable[[str], bool]:
     return validity_checker
 
 
-def prompt_choices(prompt: str, choices: List[str], allow_zero: bool = False) -> int:
+def prompt_choices(prompt: str, choices: List[str], allow_zero: bool = False, key: str = None) -> int:
+    if not is_interactive():
+        return int(answer_prompt(prompt, key, choices))
     prompt += "\n" + "\n".join([f"{index + 1}: {choice}"
                                 for index, choice in enumerate(choices)])
     min_val = 0 if allow_zero else 1
@@ -70,12 +115,20 @@ def prompt_multiline(prompt: str, terminator: Union[Callable[[str], bool], str]
         res.append(s)
 
 
-def http_get(url: str, use_proxy: bool, **kwargs):
-    if use_proxy and get_config().proxies:
-        proxies = {
-            'https': get_config().proxies,
-            'http': get_config().proxies
-        }
-    else:
-        proxies = None
-    return requests.get(url, proxies=proxies, **kwargs)
+def timed(stage: str, func: Callable, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        logging.debug(f"{stage} took {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+def http_get(url: str, use_proxy: bool, cache: bool = True, **kwargs) -> requests.Response:
+    if kwargs.get('timeout') is None:
+        kwargs['timeout'] = get_config().http.timeout
+    session = get_session(use_proxy)
+    # a cassette has to see every exchange, so the response cache is bypassed while one is active
+    cache = get_response_cache() if cache and get_cassette() is None else None
+    if cache is None:
+        return session.get(url, **kwargs)
+    return cache.get(session, url, **kwargs)
@@ -1,27 +1,69 @@
+import io
 import logging
+import re
+import shutil
 import tkinter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
+from tempfile import SpooledTemporaryFile
 from tkinter import Tk, ttk, messagebox
-from typing import Union, List, Tuple, Optional
+from typing import Union, List, Tuple, Optional, Iterator, IO
 
 import numpy as np
 import requests
-from PIL import Image, ImageOps, ImageTk
+from PIL import Image, ImageOps, ImageTk, ImageFile
 
-from config.config import get_config, get_output_path
+from config.config import get_config
 from i18n.i18n import _
-from models.color import Color, get_text_color, ColorScheme, black, white
+from models.color import Color, get_text_color, ColorScheme
 from models.video import Video, VideoSite
 from utils.helpers import http_get
+from utils.image_cache import get_image_cache
+from utils.palette import suggest_colors
 
 
-def download_file(url: str, target: Union[str, Path]) -> bool:
-    with http_get(url, stream=True, use_proxy=True) as r:
+# downloaded covers are kept in memory unless they are larger than this
+SPOOL_LIMIT = 16 * 1024 * 1024
+
+
+def spool(chunks: Iterator[bytes], head: bytes = b"") -> IO[bytes]:
+    """
+    Collect a download in memory, moving it to a temporary file only if it gets too large.
+    """
+    buffer = SpooledTemporaryFile(max_size=SPOOL_LIMIT)
+    try:
+        buffer.write(head)
+        for chunk in chunks:
+            buffer.write(chunk)
+    except BaseException:
+        buffer.close()
+        raise
+    buffer.seek(0)
+    return buffer
+
+
+def download_file(url: str) -> IO[bytes]:
+    with http_get(url, stream=True, use_proxy=True, cache=False) as r:
         r.raise_for_status()
-        with open(target, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                f.write(chunk)
-    return True
+        return spool(r.iter_content(chunk_size=8192))
+
+
+def save_file(buffer: IO[bytes], target: Union[str, Path]):
+    buffer.seek(0)
+    with open(target, 'wb') as f:
+        shutil.copyfileobj(buffer, f)
+
+
+def open_image(source: Union[str, Path, IO[bytes]]) -> Image.Image:
+    """
+    Open and decode an image once. JPEGs are decoded straight to RGB.
+    """
+    img = Image.open(source)
+    # at full size draft only changes the mode the decoder writes, which saves a conversion later
+    img.draft("RGB", img.size)
+    img.load()
+    return img
 
 
 def write_to_file(output: str, filename: Union[str, Path]):
@@ -30,27 +72,126 @@ def write_to_file(output: str, filename: Union[str, Path]):
     f.close()
 
 
-def remove_black_boarders(image_in: Union[str, Path], image_out: Union[str, Path], crop_threshold: float):
-    img = Image.open(image_in)
-    gray = ImageOps.grayscale(img)
-    img = np.array(img)
-    gray = np.array(gray)
+# JPEG and PNG sizes are normally known after the first few KB; give up on a thumbnail after this much
+PROBE_CHUNK_SIZE = 4096
+PROBE_LIMIT = 256 * 1024
+
+# dHash side; the hash has HASH_SIZE * HASH_SIZE bits
+HASH_SIZE = 8
+# covers whose hashes differ in at most this many bits are taken to be the same picture
+DUPLICATE_DISTANCE = 10
+
+# thresholds auto_threshold chooses from
+AUTO_THRESHOLD_RANGE = (8, 64)
+# rows converted to grayscale at a time, so that no full-size grayscale copy is made
+GRAY_BAND_ROWS = 256
+
+
+def brightness_sums(img: Image.Image) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sums of the 8-bit grayscale values of every row and every column, converting a band of rows
+    at a time.
+    """
+    width, height = img.size
+    rows = np.empty(height, dtype=np.uint32)
+    # sums fit in 32 bits for any realistic size
+    columns = np.zeros(width, dtype=np.uint32)
+    for top in range(0, height, GRAY_BAND_ROWS):
+        bottom = min(height, top + GRAY_BAND_ROWS)
+        band = np.asarray(ImageOps.grayscale(img.crop((0, top, width, bottom))))
+        rows[top:bottom] = band.sum(axis=1, dtype=np.uint32)
+        columns += band.sum(axis=0, dtype=np.uint32)
+    return rows, columns
+
+
+def first_reaching(running_max: np.ndarray, value: float) -> Optional[int]:
+    index = int(np.searchsorted(running_max, value, side='left'))
+    return index if index < len(running_max) else None
+
+
+class CropTable:
+    """
+    Row and column brightness of an image, computed once, from which the black border box for
+    any threshold is found with a binary search.
+    """
+
+    def __init__(self, img: Image.Image):
+        self.width, self.height = img.size
+        self.rows, self.columns = brightness_sums(img)
+        # running maxima from either end are sorted, so the first row reaching a sum can be searched
+        self.rows_forward = np.maximum.accumulate(self.rows)
+        self.rows_backward = np.maximum.accumulate(self.rows[::-1])
+        self.columns_forward = np.maximum.accumulate(self.columns)
+        self.columns_backward = np.maximum.accumulate(self.columns[::-1])
+        self.table = [self.compute_box(threshold) for threshold in range(256)]
+
+    @staticmethod
+    def bounds(forward: np.ndarray, backward: np.ndarray, value: float) -> Tuple[int, int]:
+        # the end is used as an exclusive bound, so the last bright row or column is cut as well
+        start = first_reaching(forward, value)
+        if start is None:
+            return 0, len(forward) - 1
+        return start, len(backward) - 1 - first_reaching(backward, value)
+
+    def compute_box(self, crop_threshold: float) -> Tuple[int, int, int, int]:
+        y1, y2 = self.bounds(self.rows_forward, self.rows_backward, crop_threshold * self.width)
+        x1, x2 = self.bounds(self.columns_forward, self.columns_backward, crop_threshold * self.height)
+        return x1, y1, x2, y2
 
-    # use np to sum rows until row sum exceeds a threshold
-    row_sums = gray.sum(axis=1) / len(gray[0])
-    column_sums = gray.sum(axis=0) / len(gray)
+    def box(self, crop_threshold: float) -> Tuple[int, int, int, int]:
+        """
+        Box (left, upper, right, lower) without the rows and columns whose mean brightness is
+        below the threshold.
+        """
+        if isinstance(crop_threshold, int) and 0 <= crop_threshold <= 255:
+            return self.table[crop_threshold]
+        return self.compute_box(crop_threshold)
 
-    # given an array of numbers, find the index starting from which the number is greater than the threshold
-    # and the index after which the number is smaller than the threshold
-    def get_nums(arr) -> Tuple[int, int]:
-        start = next((index for index, x in enumerate(arr) if x >= crop_threshold), 0)
-        end = len(arr) - next((index for index, x in enumerate(reversed(arr)) if x >= crop_threshold), 0) - 1
-        return start, end
+    def auto_threshold(self) -> int:
+        """
+        The threshold in the middle of the widest range of thresholds that all give the same box.
+        Real borders are much darker than the picture, so the box stays put over a wide range.
+        """
+        low, high = AUTO_THRESHOLD_RANGE
+        best_start, best_length = low, 0
+        start = low
+        for threshold in range(low + 1, high + 2):
+            if threshold > high or self.table[threshold] != self.table[start]:
+                if threshold - start > best_length:
+                    best_start, best_length = start, threshold - start
+                start = threshold
+        return best_start + (best_length - 1) // 2
 
-    y1, y2 = get_nums(row_sums)
-    x1, x2 = get_nums(column_sums)
-    crop = Image.fromarray(img[y1:y2, x1:x2])
-    crop.save(image_out)
+
+def black_border_box(img: Image.Image, crop_threshold: float) -> Tuple[int, int, int, int]:
+    return CropTable(img).box(crop_threshold)
+
+
+def crop_black_borders(img: Image.Image, crop_threshold: Optional[float] = None) -> Image.Image:
+    """
+    Pillow copies the pixels of a crop right away, so while this runs the image and the
+    cropped copy are both in memory; finding the box needs no full-size copy.
+    :param crop_threshold: None to pick one with CropTable.auto_threshold.
+    """
+    table = CropTable(img)
+    if crop_threshold is None:
+        crop_threshold = table.auto_threshold()
+        logging.debug(f"Cropping with threshold {crop_threshold}")
+    return img.crop(table.box(crop_threshold))
+
+
+def remove_black_boarders(image_in: Union[str, Path, IO[bytes], Image.Image], image_out: Union[str, Path],
+                          crop_threshold: Optional[float] = None):
+    """
+    :param crop_threshold: None to pick one with CropTable.auto_threshold.
+    """
+    if isinstance(image_in, Image.Image):
+        crop_black_borders(image_in, crop_threshold).save(image_out)
+        return
+    with open_image(image_in) as img:
+        cropped = crop_black_borders(img, crop_threshold)
+    # the source is freed before encoding, so at most the source and the crop are held at once
+    cropped.save(image_out)
 
 
 def image_size(image: Union[str, Path]) -> int:
@@ -59,16 +200,20 @@ def image_size(image: Union[str, Path]) -> int:
     return height * width
 
 
-def pick_color(image_in: [str, Path], image_out: [str, Path]) -> ColorScheme:
-    remove_black_boarders(image_in, image_out, get_config().image.crop_threshold)
+def pick_color(image_in: Union[str, Path, IO[bytes], Image.Image], image_out: Union[str, Path]) -> ColorScheme:
+    source = image_in if isinstance(image_in, Image.Image) else open_image(image_in)
+    # every threshold is answered from this table; the source is only read once
+    crop_table = CropTable(source)
+    cropped = source.crop(crop_table.box(get_config().image.crop_threshold))
+    suggestion = suggest_colors(cropped)
     root = Tk()
-    bg_color: Color = black()
-    fg_color: Color = white()
+    bg_color: Color = suggestion.background
+    fg_color: Color = suggestion.text
     color_mode = 1
     auto_fg = False
-    img = Image.open(image_out)
+    img = None
     image_label: Union[tkinter.Label, None] = None
-    img_pixels = img.load()
+    img_pixels = None
     crop_threshold = tkinter.Entry(root, width=5)
     crop_threshold.insert(0, str(get_config().image.crop_threshold))
     crop_threshold.place(x=600, y=5)
@@ -101,9 +246,9 @@ def pick_color(image_in: [str, Path], image_out: [str, Path]) -> ColorScheme:
             bg_color = selected
         update_preview()
 
-    def display_image(parent, image: [str, Path]):
+    def display_image(parent, image: Image.Image):
         nonlocal img, img_pixels
-        img = Image.open(image)
+        img = image.convert("RGB")
         img_pixels = img.load()
         width, height = img.size
         img = ImageTk.PhotoImage(img)
@@ -116,11 +261,12 @@ def pick_color(image_in: [str, Path], image_out: [str, Path]) -> ColorScheme:
         image_label.bind('<Button-1>', click_event)
 
     def reprocess_image():
+        nonlocal cropped
         threshold: str = crop_threshold.get()
         threshold = threshold.strip()
         if threshold.isdigit() and 0 <= int(threshold) <= 255:
-            remove_black_boarders(image_in, image_out, int(threshold))
-            display_image(root, image_out)
+            cropped = source.crop(crop_table.box(int(threshold)))
+            display_image(root, cropped)
         else:
             messagebox.showerror("非法数值", "输入的" + threshold + "不是0到255间的数字")
 
@@ -129,7 +275,7 @@ def pick_color(image_in: [str, Path], image_out: [str, Path]) -> ColorScheme:
         auto_fg = not auto_fg
         update_preview()
 
-    def run_color_picker(image: [str, Path]):
+    def run_color_picker(image: Image.Image):
         display_image(root, image)
         exit_button = ttk.Button(root, text="退出", command=root.destroy)
         exit_button.place(x=500, y=5)
@@ -139,62 +285,226 @@ def pick_color(image_in: [str, Path], image_out: [str, Path]) -> ColorScheme:
         auto_fg_button.place(x=120, y=10)
         reprocess_button = ttk.Button(root, text="重新处理黑边", command=reprocess_image)
         reprocess_button.place(x=650, y=5)
+        crop_threshold.bind('<Return>', lambda event: reprocess_image())
         update_preview()
         root.mainloop()
 
-    run_color_picker(image_out)
+    run_color_picker(cropped)
+    # only the crop chosen last is written
+    cropped.save(image_out)
+    if source is not image_in:
+        source.close()
     return ColorScheme(background=bg_color, text=fg_color)
 
 
-def download_image(url: str, site: VideoSite, index: int) -> Union[Path, None]:
+def download_first(videos: List[Video]) -> Optional[Tuple[IO[bytes], Video]]:
+    for v in videos:
+        if v.thumb_url:
+            try:
+                logging.info("Downloading cover from " + v.site.value + " with url " + v.thumb_url)
+                return download_file(v.thumb_url), v
+            except Exception as e:
+                logging.error("An error occurred while downloading from " + v.site.value)
+                logging.debug("Debugging info: ", exc_info=e)
+    return None
+
+
+def small_thumb_url(video: Video) -> str:
+    """
+    A small version of the thumbnail, which is enough to tell covers apart.
+    """
+    url = video.thumb_url
+    if video.site == VideoSite.YOUTUBE:
+        return re.sub(r'/[a-z]*default\.jpg$', '/mqdefault.jpg', url)
+    if video.site == VideoSite.BILIBILI:
+        return url + "@160w.jpg" if "@" not in url else url
+    if video.site == VideoSite.NICO_NICO:
+        # the plain thumbnail is the small one; .M and .L are the larger sizes
+        return re.sub(r'\.[ML]$', '', url)
+    return url
+
+
+def dhash(img: Image.Image) -> int:
+    """
+    Difference hash: one bit per pair of horizontally adjacent pixels of a tiny grayscale copy.
+    Letterboxing is cropped first so that covers with and without black bars match.
+    """
+    img = crop_black_borders(img.convert("L"))
+    pixels = np.asarray(img.resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def thumbnail_hash(video: Video) -> Optional[int]:
+    cache = get_image_cache()
+    if cache is not None:
+        cached = cache.get(video.thumb_url)
+        if cached is not None and cached.dhash is not None:
+            return cached.dhash
     try:
-        temp_dir = get_output_path().joinpath("temp.jpeg")
-        logging.info("Downloading cover from " + site.value + " with url " + url)
-        download_file(url, temp_dir)
-        image_name = get_output_path().joinpath(f"temp{index}.jpeg")
-        image_name.unlink(missing_ok=True)
-        temp_dir.rename(image_name)
-        return image_name
+        response = http_get(small_thumb_url(video), use_proxy=True, cache=False)
+        response.raise_for_status()
+        with Image.open(io.BytesIO(response.content)) as img:
+            img.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+            result = dhash(img)
     except Exception as e:
-        logging.error("An error occurred while downloading from " + site.value)
+        logging.warning("Can't compare the cover from " + video.site.value)
         logging.debug("Debugging info: ", exc_info=e)
         return None
+    if cache is not None:
+        cache.store_hash(video.thumb_url, result)
+    return result
 
 
-def download_all(videos: List[Video], stop_after_success: bool) -> List[Tuple[Path, Video]]:
-    candidates = []
-    for index, v in enumerate(videos):
-        if v.thumb_url:
-            image = download_image(v.thumb_url, v.site, index)
-            if image:
-                result = (image, v)
-                if stop_after_success:
-                    return [result]
-                candidates.append(result)
-    return candidates
-
-
-def download_first(videos: List[Video], target: Path) -> Optional[Tuple[Path, Video]]:
-    result = download_all(videos, stop_after_success=True)
-    if len(result) == 0:
+def group_duplicates(videos: List[Video]) -> List[List[Video]]:
+    """
+    Group the videos whose thumbnails show the same picture. Groups and the videos in them keep
+    the order of the input; a thumbnail that can't be hashed gets a group of its own.
+    """
+    if len(videos) <= 1:
+        return [videos] if videos else []
+    with ThreadPoolExecutor(max_workers=len(videos)) as executor:
+        hashes = list(executor.map(thumbnail_hash, videos))
+    groups: List[Tuple[Optional[int], List[Video]]] = []
+    for video, h in zip(videos, hashes):
+        for group_hash, group in groups:
+            if h is not None and group_hash is not None and hamming(h, group_hash) <= DUPLICATE_DISTANCE:
+                group.append(video)
+                break
+        else:
+            groups.append((h, [video]))
+    return [group for _, group in groups]
+
+
+@dataclass
+class ThumbnailProbe:
+    video: Video
+    size: Tuple[int, int]
+    response: requests.Response
+    # the rest of the body
+    chunks: Iterator[bytes]
+    head: bytes
+
+    def area(self) -> int:
+        return self.size[0] * self.size[1]
+
+    def close(self):
+        self.response.close()
+
+
+def probe_thumbnail(video: Video) -> Optional[ThumbnailProbe]:
+    """
+    Start downloading a thumbnail and stop as soon as its dimensions are known. The response is
+    left open so that the download can be finished if this thumbnail is picked.
+    """
+    response = None
+    try:
+        response = http_get(video.thumb_url, use_proxy=True, cache=False, stream=True)
+        response.raise_for_status()
+        parser = ImageFile.Parser()
+        head = []
+        read = 0
+        chunks = response.iter_content(chunk_size=PROBE_CHUNK_SIZE)
+        for chunk in chunks:
+            head.append(chunk)
+            read += len(chunk)
+            parser.feed(chunk)
+            if parser.image is not None:
+                cache = get_image_cache()
+                if cache is not None:
+                    cache.store_size(video.thumb_url, *parser.image.size)
+                return ThumbnailProbe(video, parser.image.size, response, chunks, b"".join(head))
+            if read >= PROBE_LIMIT:
+                break
+        logging.warning("Can't read the size of the cover from " + video.site.value)
+    except Exception as e:
+        logging.error("An error occurred while downloading from " + video.site.value)
+        logging.debug("Debugging info: ", exc_info=e)
+    if response is not None:
+        response.close()
+    return None
+
+
+def cached_largest(videos: List[Video]) -> Optional[Video]:
+    """
+    The video with the largest thumbnail if the sizes of all of them are cached.
+    """
+    cache = get_image_cache()
+    if cache is None:
+        return None
+    areas = []
+    for v in videos:
+        cached = cache.get(v.thumb_url)
+        if cached is None or cached.area() is None:
+            return None
+        areas.append(cached.area())
+    return videos[areas.index(max(areas))]
+
+
+def download_largest(videos: List[Video]) -> Optional[Tuple[IO[bytes], Video]]:
+    """
+    Probe every thumbnail at the same time and download only the one with the most pixels in
+    full. Ties go to the video that comes first. If that download breaks off, the next largest
+    is finished instead, so the other probes stay open until a download succeeds.
+    """
+    if len(videos) == 1:
+        return download_first(videos)
+    largest = cached_largest(videos)
+    if largest is not None:
+        result = download_first([largest])
+        if result is not None:
+            return result
+    with ThreadPoolExecutor(max_workers=len(videos)) as executor:
+        probes = [p for p in executor.map(probe_thumbnail, videos) if p is not None]
+    if len(probes) == 0:
+        return None
+    # sorted is stable, so ties keep the order of the videos
+    probes.sort(key=lambda p: p.area(), reverse=True)
+    try:
+        for probe in probes:
+            logging.info(f"Using the {probe.size[0]}x{probe.size[1]} cover from {probe.video.site.value}")
+            try:
+                return spool(probe.chunks, probe.head), probe.video
+            except Exception as e:
+                logging.error("An error occurred while downloading from " + probe.video.site.value)
+                logging.debug("Debugging info: ", exc_info=e)
+            finally:
+                probe.close()
         return None
-    target.unlink(missing_ok=True)
-    return result[0][0].rename(target), result[0][1]
+    finally:
+        for probe in probes:
+            probe.close()
 
 
-def download_thumbnail(videos: List[Video], filename: str) -> Optional[Tuple[Path, Video]]:
+def download_best(videos: List[Video]) -> Optional[Tuple[IO[bytes], Video]]:
+    """
+    Download the largest copy of the first video's cover. Covers of the other videos are only
+    looked at if they show the same picture, or if none of its copies can be downloaded.
+    """
+    videos = [v for v in videos if v.thumb_url]
+    for group in group_duplicates(videos):
+        if len(group) < len(videos):
+            logging.info("Same cover on " + ", ".join(v.site.value for v in group))
+        result = download_largest(group)
+        if result is not None:
+            return result
+    return None
+
+
+def download_thumbnail(videos: List[Video]) -> Optional[Tuple[IO[bytes], Video]]:
+    """
+    Download a cover into memory. The caller closes the returned buffer.
+    """
     weight = {
         VideoSite.YOUTUBE: 0,
         VideoSite.BILIBILI: 1,
         VideoSite.NICO_NICO: 2,
     }
     videos = sorted(videos, key=lambda vid: weight[vid.site])
-    target = get_output_path().joinpath(filename)
     if not get_config().image.download_all:
-        return download_first(videos, target)
-    candidates = download_all(videos, stop_after_success=False)
-    target.unlink(missing_ok=True)
-    if len(candidates) == 0:
-        return None
-    return candidates[0][0].rename(target), candidates[0][1]
-    # candidates = sorted([(c, image_size(c[0])) for c in candidates], key=lambda c: c[1])
+        return download_first(videos)
+    return download_best(videos)
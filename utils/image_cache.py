@@ -0,0 +1,115 @@
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Union
+
+from config.config import get_config, get_output_path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS thumbnails (
+    thumb_url TEXT PRIMARY KEY,
+    -- dHash of the small thumbnail as 16 hex digits
+    dhash TEXT,
+    width INTEGER,
+    height INTEGER,
+    -- unix times the hash and the size were stored
+    hash_checked REAL,
+    size_checked REAL
+) WITHOUT ROWID;
+"""
+
+
+@dataclass
+class CachedThumbnail:
+    dhash: Optional[int]
+    width: Optional[int]
+    height: Optional[int]
+
+    def area(self) -> Optional[int]:
+        if self.width is None or self.height is None:
+            return None
+        return self.width * self.height
+
+
+class ImageCache:
+    """
+    Perceptual hashes and full sizes of cover thumbnails, keyed by the full-size thumbnail url.
+    Either may be missing if it has not been needed yet. Some sites keep the url when the
+    thumbnail is replaced, so both expire.
+    """
+
+    def __init__(self, path: Union[str, Path], ttl: float):
+        """
+        :param ttl: seconds a hash or a size is kept.
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(SCHEMA)
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(thumbnails)")]
+            for column in ("hash_checked", "size_checked"):
+                if column not in columns:
+                    # caches created before entries expired; their entries count as expired
+                    self.connection.execute(f"ALTER TABLE thumbnails ADD COLUMN {column} REAL")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def fresh(self, checked: Optional[float]) -> bool:
+        return checked is not None and time.time() - checked <= self.ttl
+
+    def get(self, thumb_url: str) -> Optional[CachedThumbnail]:
+        """
+        :return: None if the thumbnail is unknown; expired fields are None.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT dhash, width, height, hash_checked, size_checked FROM thumbnails "
+                                          "WHERE thumb_url = ?", (thumb_url,)).fetchone()
+        if row is None:
+            return None
+        dhash, width, height, hash_checked, size_checked = row
+        if dhash is None or not self.fresh(hash_checked):
+            dhash = None
+        if not self.fresh(size_checked):
+            width, height = None, None
+        return CachedThumbnail(int(dhash, 16) if dhash is not None else None, width, height)
+
+    def store_hash(self, thumb_url: str, dhash: int):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT INTO thumbnails (thumb_url, dhash, hash_checked) VALUES (?, ?, ?) "
+                                    "ON CONFLICT (thumb_url) DO UPDATE SET dhash = excluded.dhash, "
+                                    "hash_checked = excluded.hash_checked",
+                                    (thumb_url, f"{dhash:016x}", time.time()))
+
+    def store_size(self, thumb_url: str, width: int, height: int):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT INTO thumbnails (thumb_url, width, height, size_checked) "
+                                    "VALUES (?, ?, ?, ?) "
+                                    "ON CONFLICT (thumb_url) DO UPDATE SET width = excluded.width, "
+                                    "height = excluded.height, size_checked = excluded.size_checked",
+                                    (thumb_url, width, height, time.time()))
+
+
+image_cache: Optional[ImageCache] = None
+image_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> Optional[ImageCache]:
+    global image_cache
+    image_config = get_config().image
+    if not image_config.cache:
+        return None
+    with image_cache_lock:
+        if image_cache is None:
+            path = get_output_path().joinpath(Path(image_config.cache_path).expanduser())
+            logging.debug("Opening image cache at " + str(path))
+            image_cache = ImageCache(path, image_config.cache_ttl_days * 86400)
+        return image_cache
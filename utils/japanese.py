@@ -1,60 +1,113 @@
-import functools
 import re
+from typing import Dict, List, Tuple
 
-hiragana_pattern = re.compile("[\u3041-\u3096]")
-katakana_pattern = re.compile("[\u30A0-\u30FF]")
-kanji_pattern = re.compile("[\u3400-\u4DB5\u4E00-\u9FCB\uF900-\uFA6A]")
+import numpy as np
+
+# scripts a character can belong to
+OTHER = 0
+HIRAGANA = 1
+KATAKANA = 2
+KANJI = 3
+ASCII = 4
+SCRIPT_COUNT = 5
+
+# inclusive codepoint ranges of each script; everything else is OTHER
+SCRIPT_RANGES: Dict[int, List[Tuple[int, int]]] = {
+    HIRAGANA: [(0x3041, 0x3096)],
+    KATAKANA: [(0x30A0, 0x30FF)],
+    # 々 repeats the previous kanji and is read like one
+    KANJI: [(0x3005, 0x3005), (0x3400, 0x4DB5), (0x4E00, 0x9FCB), (0xF900, 0xFA6A)],
+    ASCII: [(0x00, 0x7F)],
+}
+
+
+def build_script_table() -> bytearray:
+    # one byte per BMP codepoint; anything outside the BMP is OTHER
+    table = bytearray(0x10000)
+    for script, ranges in SCRIPT_RANGES.items():
+        for low, high in ranges:
+            table[low:high + 1] = bytes([script]) * (high - low + 1)
+    return table
+
+
+SCRIPT_TABLE = build_script_table()
+# the same table for numpy, with one extra entry that every codepoint past the BMP is clipped to
+SCRIPT_ARRAY = np.frombuffer(bytes(SCRIPT_TABLE) + bytes([OTHER]), dtype=np.uint8)
+
+
+def char_class(*scripts: int) -> str:
+    parts = []
+    for script in scripts:
+        for low, high in SCRIPT_RANGES[script]:
+            parts.append(re.escape(chr(low)) if low == high else f"{re.escape(chr(low))}-{re.escape(chr(high))}")
+    return "[" + "".join(parts) + "]"
+
+
+KANJI_CLASS = char_class(KANJI)
+KANA_CLASS = char_class(HIRAGANA, KATAKANA)
+
+kana_pattern = re.compile(KANA_CLASS)
+kanji_run_pattern = re.compile(KANJI_CLASS + "+")
+
+# a whole run of kanji followed by kana in half- or full-width parentheses. None of the characters
+# involved can be a line break, so a match never spans two lines.
+furigana_pattern = re.compile(f"(?<!{KANJI_CLASS})({KANJI_CLASS}+)"
+                              f"(?:\\(({KANA_CLASS}+)\\)|（({KANA_CLASS}+)）)")
+
+
+def script_of(c: str) -> int:
+    code = ord(c)
+    return SCRIPT_TABLE[code] if code < 0x10000 else OTHER
 
 
 def is_hiragana(c: str) -> bool:
-    return not not hiragana_pattern.fullmatch(c)
+    return len(c) == 1 and script_of(c) == HIRAGANA
 
 
 def is_katakana(c: str) -> bool:
-    return not not katakana_pattern.fullmatch(c)
+    return len(c) == 1 and script_of(c) == KATAKANA
 
 
 def is_kana(c: str) -> bool:
-    return is_hiragana(c) or is_katakana(c)
+    return len(c) == 1 and script_of(c) in (HIRAGANA, KATAKANA)
 
 
 def is_kanji(c: str) -> bool:
-    return c == "々" or not not kanji_pattern.fullmatch(c)
+    return len(c) == 1 and script_of(c) == KANJI
 
 
 def is_japanese(c: str) -> bool:
-    return is_kana(c) or is_kanji(c)
+    return len(c) == 1 and script_of(c) in (HIRAGANA, KATAKANA, KANJI)
+
+
+def contains_kana(text: str) -> bool:
+    return kana_pattern.search(text) is not None
+
+
+def all_kanji(text: str) -> bool:
+    """
+    Whether the text is non-empty and has nothing but kanji.
+    """
+    return kanji_run_pattern.fullmatch(text) is not None
+
+
+def script_histogram(text: str) -> np.ndarray:
+    """
+    How many characters of each script every line has, as an array with one row per line (as in
+    text.split("\\n")) and one column per script. Line breaks are not counted.
+    """
+    codepoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    newlines = codepoints == ord("\n")
+    line_of = np.cumsum(newlines)
+    scripts = SCRIPT_ARRAY[np.minimum(codepoints, 0x10000)]
+    keep = ~newlines
+    lines = int(line_of[-1]) + 1 if len(codepoints) > 0 else 1
+    counts = np.bincount(line_of[keep] * SCRIPT_COUNT + scripts[keep], minlength=lines * SCRIPT_COUNT)
+    return counts.reshape(lines, SCRIPT_COUNT)
 
 
 def furigana_local(lyrics: str) -> str:
-    open_parentheses = ['(', '（']
-    closing_parentheses = [')', '）']
-    lines = lyrics.split("\n")
-    result = []
-    for line in lines:
-        prev_end = 0
-        line_result = []
-        for index in range(len(line)):
-            if index < prev_end:
-                continue
-            if line[index] not in open_parentheses or index == 0 or not is_kanji(line[index - 1]):
-                continue
-            symbol = closing_parentheses[open_parentheses.index(line[index])]
-            close_index = line.find(symbol, index + 1)
-            furigana = line[index + 1:close_index]
-            if close_index == -1 or index + 1 == close_index or \
-                    not functools.reduce(lambda a, b: a and b,
-                                         [is_kana(c) for c in furigana]):
-                continue
-            kanji_start = index - 1
-            while kanji_start >= 0 and is_kanji(line[kanji_start]):
-                kanji_start -= 1
-            kanji_start += 1
-            if kanji_start > 0:
-                line_result.append(line[prev_end:kanji_start])
-            line_result.append(f"{{{{photrans|{line[kanji_start:index]}|{furigana}"
-                               f"}}}}")
-            prev_end = close_index + 1
-        line_result.append(line[prev_end:])
-        result.append("".join(line_result))
-    return "\n".join(result)
+    """
+    Turn kanji followed by their reading in parentheses, like 漢字(かんじ), into photrans templates.
+    """
+    return furigana_pattern.sub(lambda m: f"{{{{photrans|{m.group(1)}|{m.group(2) or m.group(3)}}}}}", lyrics)
@@ -0,0 +1,164 @@
+"""
+Works out how pasted bilingual lyrics are laid out and splits them into Japanese, Chinese and
+romaji. Two layouts are recognized:
+- groups: every group has one line of each language in a fixed order, e.g. Japanese, Chinese,
+  romaji. Groups may be separated by blank lines.
+- blocks: every paragraph is its Japanese lines followed by the same number of Chinese lines.
+"""
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional
+
+import numpy as np
+
+from utils.japanese import script_histogram, HIRAGANA, KATAKANA, KANJI, ASCII
+from utils.string import is_empty
+
+JAPANESE = "japanese"
+CHINESE = "chinese"
+ROMAJI = "romaji"
+
+# group sizes that are tried; a group has at most one line per language plus a spare (e.g. a note)
+GROUP_SIZES = (2, 3, 4)
+# below this a layout is not trusted without somebody looking at it
+MIN_CONFIDENCE = 0.75
+
+
+@dataclass
+class Layout:
+    japanese: str = ""
+    chinese: str = ""
+    romaji: str = ""
+    # share of the lines that fit the layout, from 0 to 1
+    confidence: float = 0
+    # for process_translation: lines per group, blank separator included, and the 1-based line of
+    # each language in a group. Empty for the blocks layout.
+    group_length: int = 0
+    lines: Dict[str, int] = field(default_factory=dict)
+
+
+# line kinds as numbers, for counting with numpy
+KIND_CODES = {JAPANESE: 1, CHINESE: 2, ROMAJI: 3}
+KIND_COUNT = 4
+
+
+class Lines:
+    """
+    The non-blank lines of the text with their kinds, and where the paragraphs between blank
+    lines start and end. Everything is computed once, in one pass over the text.
+    """
+
+    def __init__(self, text: str):
+        lines = text.split("\n")
+        stripped = [line.strip() for line in lines]
+        kept = np.flatnonzero(np.fromiter((len(s) > 0 for s in stripped), dtype=bool, count=len(lines)))
+        histogram = script_histogram(text)[kept]
+        kinds = np.zeros(len(kept), dtype=np.intp)
+        # romaji first so that the stronger kinds overwrite it
+        kinds[histogram[:, ASCII] == histogram.sum(axis=1)] = KIND_CODES[ROMAJI]
+        kinds[histogram[:, KANJI] > 0] = KIND_CODES[CHINESE]
+        kinds[histogram[:, HIRAGANA] + histogram[:, KATAKANA] > 0] = KIND_CODES[JAPANESE]
+        self.lines: List[str] = [stripped[i] for i in kept]
+        self.kinds = kinds
+        gaps = np.diff(kept) - 1
+        # first line of every paragraph, plus the end
+        self.starts = np.concatenate(([0], np.flatnonzero(gaps > 0) + 1, [len(kept)])).astype(np.intp)
+        self.lengths = np.diff(self.starts)
+        # blank lines after every paragraph but the last
+        self.blank_after = gaps[self.starts[1:-1] - 1]
+
+    def __len__(self):
+        return len(self.lines)
+
+    def join(self, indices: np.ndarray, breaks: np.ndarray) -> str:
+        """
+        The lines at the given (sorted) indices, with an empty line wherever a paragraph that
+        ends in a stanza break is passed.
+        """
+        result: List[str] = []
+        cuts = np.searchsorted(indices, self.starts[1:-1][breaks])
+        previous = 0
+        for cut in cuts.tolist():
+            result.extend(self.lines[i] for i in indices[previous:cut].tolist())
+            result.append("")
+            previous = cut
+        result.extend(self.lines[i] for i in indices[previous:].tolist())
+        return "\n".join(result).strip("\n")
+
+
+def blocks_layout(lines: Lines) -> Optional[Layout]:
+    if np.any(lines.lengths % 2 != 0) or np.all(lines.lengths == 2):
+        # odd paragraphs can't be split in halves; two-line ones are groups separated by blank lines
+        return None
+    paragraph = np.repeat(np.arange(len(lines.lengths)), lines.lengths)
+    position = np.arange(len(lines)) - lines.starts[paragraph]
+    first_half = position < lines.lengths[paragraph] // 2
+    if np.any(lines.kinds[~first_half] == KIND_CODES[JAPANESE]):
+        return None
+    fitting = np.count_nonzero(lines.kinds[first_half] == KIND_CODES[JAPANESE]) + \
+        np.count_nonzero(lines.kinds[~first_half] == KIND_CODES[CHINESE])
+    every_paragraph = np.ones(len(lines.blank_after), dtype=bool)
+    return Layout(japanese=lines.join(np.flatnonzero(first_half), every_paragraph),
+                  chinese=lines.join(np.flatnonzero(~first_half), every_paragraph),
+                  confidence=float(fitting / len(lines)))
+
+
+def groups_layout(lines: Lines, size: int) -> Optional[Layout]:
+    if np.any(lines.lengths % size != 0):
+        return None
+    # every paragraph holds whole groups, so the position in a group follows from the line number
+    position = np.arange(len(lines)) % size
+    votes = np.bincount(position * KIND_COUNT + lines.kinds, minlength=size * KIND_COUNT).reshape(size, KIND_COUNT)
+    # give each language the position where it is most common, strongest first
+    ranked = sorted(((int(votes[p][KIND_CODES[kind]]), p, kind) for p in range(size)
+                     for kind in (JAPANESE, CHINESE, ROMAJI)), reverse=True)
+    positions: Dict[str, int] = {}
+    for count, p, kind in ranked:
+        if count > 0 and kind not in positions and p not in positions.values():
+            positions[kind] = p
+    if JAPANESE not in positions or CHINESE not in positions:
+        return None
+    fitting = sum(int(votes[p][KIND_CODES[kind]]) for kind, p in positions.items())
+    # one group per paragraph: the usual blank line between groups is not a stanza break
+    separator = 0
+    if len(lines.blank_after) > 0 and np.all(lines.lengths == size):
+        separator = int(lines.blank_after.min())
+    breaks = lines.blank_after > separator
+    streams = {kind: lines.join(np.flatnonzero(position == p), breaks) for kind, p in positions.items()}
+    return Layout(japanese=streams[JAPANESE], chinese=streams[CHINESE], romaji=streams.get(ROMAJI, ""),
+                  confidence=fitting / len(lines), group_length=size + separator,
+                  lines={kind: p + 1 for kind, p in positions.items()})
+
+
+def detect_layout(text: str) -> Layout:
+    """
+    Split pasted lyrics into languages, trying every known layout and keeping the one that fits
+    the most lines. The text is classified once, so this takes time linear in its length.
+    :return: a Layout with confidence 0 and no text if nothing fits.
+    """
+    lines = Lines(text)
+    if len(lines) == 0:
+        return Layout()
+    # blocks come first so that they win ties, as they always have
+    candidates = [blocks_layout(lines)] + [groups_layout(lines, size) for size in GROUP_SIZES]
+    best = Layout()
+    for candidate in candidates:
+        if candidate is not None and candidate.confidence > best.confidence:
+            best = candidate
+    return best
+
+
+def process_translation(translation: str, group_length: int, target_line: int) -> str:
+    index = 0
+    result = []
+    lines: List[str] = translation.split("\n")
+    while index < len(lines):
+        if is_empty(lines[index]):
+            if len(lines) > 0 and not is_empty(result[-1]):
+                result.append("")
+            index += 1
+        else:
+            if index + target_line - 1 >= len(lines):
+                break
+            result.append(lines[index + target_line - 1])
+            index += group_length
+    return "\n".join(result)
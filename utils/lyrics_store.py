@@ -0,0 +1,130 @@
+import dataclasses
+import json
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Union, Callable
+
+from config.config import get_config, get_output_path
+from models.song import Lyrics
+
+# sources lyrics are stored under
+ATWIKI_CHINESE = "atwiki-chs"
+ATWIKI_JAPANESE = "atwiki-ja"
+# keyed by VocaDB song id instead of the song name
+VOCADB = "vocadb"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lyrics (
+    name TEXT NOT NULL,
+    producer TEXT NOT NULL,
+    source TEXT NOT NULL,
+    -- JSON of the Lyrics; NULL if the source has no lyrics for the song
+    lyrics TEXT,
+    checked REAL NOT NULL,
+    PRIMARY KEY (name, producer, source)
+) WITHOUT ROWID;
+"""
+
+
+@dataclass
+class StoredLyrics:
+    # None if the song was looked up and nothing was found
+    lyrics: Optional[Lyrics]
+    # unix time of the lookup
+    checked: float
+
+
+def lyrics_to_json(lyrics: Lyrics) -> str:
+    return json.dumps(dataclasses.asdict(lyrics), ensure_ascii=False)
+
+
+def lyrics_from_json(text: str) -> Lyrics:
+    fields = json.loads(text)
+    fields['staff'] = [tuple(s) for s in fields.get('staff') or []]
+    return Lyrics(**fields)
+
+
+class LyricsStore:
+    """
+    Parsed lyrics keyed by song name, producer and source. Lookups that found nothing are kept
+    as well so that they are not repeated on every run, but expire sooner.
+    """
+
+    def __init__(self, path: Union[str, Path], ttl: float, miss_ttl: float):
+        """
+        :param ttl: seconds found lyrics are kept.
+        :param miss_ttl: seconds a lookup that found nothing is kept.
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def get(self, name: str, producer: str, source: str) -> Optional[StoredLyrics]:
+        """
+        :return: None if the song was never looked up or the result has expired.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT lyrics, checked FROM lyrics WHERE name = ? AND producer = ? AND source = ?",
+                (name, producer, source)).fetchone()
+        if row is None:
+            return None
+        text, checked = row
+        ttl = self.ttl if text is not None else self.miss_ttl
+        if time.time() - checked > ttl:
+            return None
+        return StoredLyrics(lyrics_from_json(text) if text is not None else None, checked)
+
+    def put(self, name: str, producer: str, source: str, lyrics: Optional[Lyrics]):
+        text = lyrics_to_json(lyrics) if lyrics is not None else None
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO lyrics VALUES (?, ?, ?, ?, ?)",
+                                    (name, producer, source, text, time.time()))
+
+
+def cached_lyrics(name: str, producer: str, source: str, fetch: Callable[[], Optional[Lyrics]]) -> Optional[Lyrics]:
+    """
+    Lyrics from the store, or from fetch if they are not there. fetch returns None when the
+    source has no lyrics and raises when it can't tell; only the former is stored.
+    """
+    store = get_lyrics_store()
+    if store is None:
+        return fetch()
+    stored = store.get(name, producer, source)
+    if stored is not None:
+        logging.debug(f"Lyrics of {name} from {source} found in the lyrics store")
+        return stored.lyrics
+    lyrics = fetch()
+    store.put(name, producer, source, lyrics)
+    return lyrics
+
+
+lyrics_store: Optional[LyricsStore] = None
+lyrics_store_lock = threading.Lock()
+
+
+def get_lyrics_store() -> Optional[LyricsStore]:
+    global lyrics_store
+    lyrics_config = get_config().lyrics
+    if not lyrics_config.store:
+        return None
+    with lyrics_store_lock:
+        if lyrics_store is None:
+            path = get_output_path().joinpath(Path(lyrics_config.path).expanduser())
+            logging.debug("Opening lyrics store at " + str(path))
+            lyrics_store = LyricsStore(path, lyrics_config.ttl_days * 86400, lyrics_config.miss_ttl_hours * 3600)
+        return lyrics_store
@@ -3,17 +3,16 @@ import json
 import logging
 import sys
 import urllib
-from asyncio import Future
-from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
 from json import JSONDecodeError
-from typing import Union, List, Tuple, Callable
+from typing import Union, List, Tuple, Callable, Dict
 
-import requests
 from bs4 import BeautifulSoup
-from requests_futures.sessions import FuturesSession
 
+from config.config import get_config
 from i18n.i18n import _
 from models.creators import Person
+from utils.helpers import http_get
 from utils.string import is_empty
 
 BASE_TEMPLATE = "https://mzh.moegirl.org.cn/api.php?action=parse&format=json" \
@@ -47,19 +46,20 @@ def expand_name(producer) -> List[str]:
 
 
 async def producer_checker(producers: List[Person], base_url: str, predicate: Callable[[str], bool]):
+    urls: Dict[str, str] = dict()
+    for p in producers:
+        for name in expand_name(p):
+            urls[name] = base_url.format(urllib.parse.quote(name))
+    if len(urls) == 0:
+        return []
     try:
-        with FuturesSession() as session:
-            futures: List[Future] = []
-            for p in producers:
-                names = expand_name(p)
-                for name in names:
-                    url = base_url.format(urllib.parse.quote(name))
-                    futures.append(session.get(url))
-                    futures[-1].producer_name = name
-            return [response.producer_name for response in as_completed(futures)
-                    if not response.exception() and predicate(response.result().text)]
+        # http_get goes through the pooled session and the response cache, so repeated
+        # checks for the same producer do not hit the network
+        with ThreadPoolExecutor(max_workers=min(len(urls), get_config().http.pool_maxsize)) as executor:
+            futures = {name: executor.submit(http_get, url, False) for name, url in urls.items()}
+            return [name for name, future in futures.items()
+                    if not future.exception() and predicate(future.result().text)]
     except Exception as e:
-        session.close()
         logging.error("Error occurred.", exc_info=e)
         return []
 
@@ -0,0 +1,94 @@
+from pathlib import Path
+from typing import List, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from models.color import Color, ColorScheme, get_text_color
+from utils.color_math import perceived_lightness_batch, WHITE_LIGHTNESS
+
+# covers are shrunk to at most this many pixels per side before clustering
+SAMPLE_SIZE = 96
+CLUSTERS = 8
+ITERATIONS = 12
+# lightness difference (0-100) below which a cover color is not used as the text color
+MIN_TEXT_CONTRAST = 45
+
+
+def sample_pixels(img: Image.Image) -> np.ndarray:
+    width, height = img.size
+    scale = max(width, height) / SAMPLE_SIZE
+    if scale > 1:
+        # reducing_gap shrinks by whole factors first, which is much faster on big covers
+        img = img.resize((max(1, round(width / scale)), max(1, round(height / scale))),
+                         Image.BILINEAR, reducing_gap=2.0)
+    return np.asarray(img.convert("RGB"), dtype=np.float32).reshape(-1, 3)
+
+
+def kmeans(pixels: np.ndarray, k: int = CLUSTERS, iterations: int = ITERATIONS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cluster the pixels; returns the centers and how many pixels belong to each.
+    """
+    rng = np.random.default_rng(0)
+    k = min(k, len(pixels))
+    # k-means++ seeding
+    centers = [pixels[rng.integers(len(pixels))]]
+    distances = ((pixels - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        total = distances.sum()
+        if total == 0:
+            break
+        centers.append(pixels[rng.choice(len(pixels), p=distances / total)])
+        distances = np.minimum(distances, ((pixels - centers[-1]) ** 2).sum(axis=1))
+    centers = np.array(centers)
+    labels = np.zeros(len(pixels), dtype=np.intp)
+    for _ in range(iterations):
+        labels = ((pixels[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        counts = np.bincount(labels, minlength=len(centers))
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, pixels)
+        moved = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centers)
+        if np.allclose(moved, centers, atol=0.5):
+            break
+        centers = moved
+    return centers, np.bincount(labels, minlength=len(centers))
+
+
+def to_color(center: np.ndarray) -> Color:
+    r, g, b = (int(round(c)) for c in center)
+    return Color(r, g, b)
+
+
+def rank_backgrounds(lightness: np.ndarray, coverage: np.ndarray) -> List[int]:
+    """
+    Indices of the colors, best background first: a background should cover much of the cover
+    and leave room for a readable text color.
+    """
+    text_lightness = np.where(lightness > WHITE_LIGHTNESS / 2, 0, WHITE_LIGHTNESS)
+    score = coverage * np.abs(lightness - text_lightness)
+    return sorted(range(len(lightness)), key=lambda i: score[i], reverse=True)
+
+
+def suggest_colors(image: Union[Image.Image, str, Path]) -> ColorScheme:
+    """
+    Pick a background and text color from a (cropped) cover without asking anybody. The text
+    color is taken from the cover if one contrasts enough with the background.
+    """
+    if not isinstance(image, Image.Image):
+        with Image.open(image) as img:
+            # let the JPEG decoder skip most of the pixels
+            img.draft("RGB", (SAMPLE_SIZE * 2, SAMPLE_SIZE * 2))
+            return suggest_colors(img)
+    centers, counts = kmeans(sample_pixels(image))
+    colors = [to_color(c) for c in centers]
+    coverage = counts / counts.sum()
+    lightness = perceived_lightness_batch([(c.red, c.green, c.blue) for c in colors])
+    ranked = rank_backgrounds(lightness, coverage)
+    background = colors[ranked[0]]
+    text_candidates = [i for i in ranked[1:]
+                       if coverage[i] > 0 and abs(lightness[i] - lightness[ranked[0]]) >= MIN_TEXT_CONTRAST]
+    if len(text_candidates) > 0:
+        text = colors[max(text_candidates, key=lambda i: coverage[i])]
+    else:
+        text = get_text_color(background)
+    return ColorScheme(text=text, background=background)
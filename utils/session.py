@@ -0,0 +1,89 @@
+import threading
+from typing import Dict, Optional, Callable
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+
+from config.config import get_config
+
+# one session for proxied traffic and one for direct traffic; each keeps a pool of
+# keep-alive connections per host so that repeated calls to the same site skip the handshake
+sessions: Dict[bool, requests.Session] = dict()
+sessions_lock = threading.Lock()
+# lets other subsystems (e.g. the cassette recorder) sit between the sessions and the network
+adapter_wrapper: Optional[Callable[[HTTPAdapter], HTTPAdapter]] = None
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# seconds; a request that can't connect or send its first bytes in this time is unlikely to succeed
+MIN_ATTEMPT_TIMEOUT = 1
+
+
+def get_proxies(use_proxy: bool) -> Optional[Dict[str, str]]:
+    if use_proxy and get_config().proxies:
+        return {
+            'https': get_config().proxies,
+            'http': get_config().proxies
+        }
+    return None
+
+
+def attempt_timeout(budget: float) -> float:
+    """
+    A timeout for each attempt of a request such that every retry, with the backoff between
+    them, fits in budget seconds.
+    """
+    http_config = get_config().http
+    # urllib3 does not wait before the first retry and doubles the wait after that
+    backoff = sum(http_config.backoff_factor * 2 ** (n - 1) for n in range(2, http_config.retries + 1))
+    return max(MIN_ATTEMPT_TIMEOUT, (budget - backoff) / (http_config.retries + 1))
+
+
+def create_adapter() -> HTTPAdapter:
+    http_config = get_config().http
+    retry = Retry(total=http_config.retries,
+                  backoff_factor=http_config.backoff_factor,
+                  status_forcelist=RETRY_STATUS,
+                  allowed_methods=frozenset(['GET', 'HEAD']),
+                  raise_on_status=False)
+    return HTTPAdapter(pool_connections=http_config.pool_connections,
+                       pool_maxsize=http_config.pool_maxsize,
+                       max_retries=retry,
+                       pool_block=http_config.pool_block)
+
+
+def create_session(use_proxy: bool) -> requests.Session:
+    session = requests.Session()
+    proxies = get_proxies(use_proxy)
+    if proxies:
+        session.proxies.update(proxies)
+    adapter = create_adapter()
+    if adapter_wrapper is not None:
+        adapter = adapter_wrapper(adapter)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(use_proxy: bool) -> requests.Session:
+    session = sessions.get(use_proxy)
+    if session is not None:
+        return session
+    with sessions_lock:
+        if use_proxy not in sessions:
+            sessions[use_proxy] = create_session(use_proxy)
+        return sessions[use_proxy]
+
+
+def close_sessions():
+    with sessions_lock:
+        for session in sessions.values():
+            session.close()
+        sessions.clear()
+
+
+def set_adapter_wrapper(wrapper: Optional[Callable[[HTTPAdapter], HTTPAdapter]]):
+    global adapter_wrapper
+    # existing sessions were built with the old adapters
+    close_sessions()
+    adapter_wrapper = wrapper
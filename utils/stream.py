@@ -0,0 +1,66 @@
+import html
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+import requests
+
+CHUNK_SIZE = 16 * 1024
+# kept from the previous chunk so that a match split between two chunks is still found
+OVERLAP = 2 * 1024
+
+
+@dataclass
+class Extraction:
+    fields: Dict[str, str] = field(default_factory=dict)
+    # bytes received from the network, before any content encoding is undone
+    bytes_read: int = 0
+    # the whole body, only kept when some fields were not found
+    body: Optional[bytes] = None
+
+    def complete(self, matchers: Dict[str, re.Pattern]) -> bool:
+        return len(self.fields) == len(matchers)
+
+    def text(self) -> str:
+        return self.body.decode("utf-8", errors="replace") if self.body else ""
+
+
+def transferred(response: requests.Response, decoded: int) -> int:
+    # urllib3 counts what it has read off the connection; replayed or already read bodies only
+    # have their decoded size
+    try:
+        return int(response.raw.tell())
+    except (AttributeError, OSError, ValueError):
+        return decoded
+
+
+def extract_fields(response: requests.Response, matchers: Dict[str, re.Pattern],
+                   chunk_size: int = CHUNK_SIZE) -> Extraction:
+    """
+    Read a streamed response until every matcher has matched, then close it. Each matcher is a
+    bytes regex whose first group is the value; the first match of each wins.
+    """
+    result = Extraction()
+    chunks = []
+    tail = b""
+    decoded = 0
+    try:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size):
+            decoded += len(chunk)
+            chunks.append(chunk)
+            window = tail + chunk
+            for name, pattern in matchers.items():
+                if name in result.fields:
+                    continue
+                match = pattern.search(window)
+                if match:
+                    result.fields[name] = html.unescape(match.group(1).decode("utf-8", errors="replace"))
+            if result.complete(matchers):
+                return result
+            tail = window[-OVERLAP:]
+    finally:
+        result.bytes_read = transferred(response, decoded)
+        response.close()
+    result.body = b"".join(chunks)
+    return result
@@ -12,6 +12,17 @@ def auto_lj(s: str) -> str:
     return "{{lj|" + s + "}}"
 
 
+# characters that can't be in a file name on Windows, and their full-width look-alikes
+FILE_NAME_TABLE = str.maketrans('/\\:*?"<>|', '／＼：＊？＂＜＞｜')
+
+
+def file_name(s: str) -> str:
+    """
+    A song name that can be used as a file name, e.g. for 1/6 or 何？.
+    """
+    return s.translate(FILE_NAME_TABLE).strip()
+
+
 def is_empty(s: str) -> bool:
     return not s or s.isspace() or len(s) == 0
 
@@ -0,0 +1,86 @@
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Union
+
+from config.config import get_config, get_output_path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    site TEXT NOT NULL,
+    identifier TEXT NOT NULL,
+    url TEXT NOT NULL,
+    uploaded TEXT NOT NULL,
+    thumb_url TEXT,
+    views INTEGER NOT NULL,
+    views_checked REAL NOT NULL,
+    PRIMARY KEY (site, identifier)
+) WITHOUT ROWID;
+"""
+
+
+@dataclass
+class CachedVideo:
+    url: str
+    uploaded: str
+    thumb_url: Optional[str]
+    views: int
+    # unix time of the last successful fetch
+    views_checked: float
+
+
+class VideoCache:
+    """
+    Per-video metadata keyed by site and identifier. Upload dates and thumbnails never change and
+    are kept forever; callers decide from views_checked whether the view count is still usable.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def get(self, site: str, identifier: str) -> Optional[CachedVideo]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT url, uploaded, thumb_url, views, views_checked FROM videos WHERE site = ? AND identifier = ?",
+                (site, identifier)).fetchone()
+        return CachedVideo(*row) if row else None
+
+    def store(self, site: str, identifier: str, video: CachedVideo):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    (site, identifier, video.url, video.uploaded, video.thumb_url,
+                                     video.views, video.views_checked))
+
+    def update_views(self, site: str, identifier: str, views: int, checked: float):
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE videos SET views = ?, views_checked = ? WHERE site = ? AND identifier = ?",
+                                    (views, checked, site, identifier))
+
+
+video_cache: Optional[VideoCache] = None
+video_cache_lock = threading.Lock()
+
+
+def get_video_cache() -> Optional[VideoCache]:
+    global video_cache
+    video_config = get_config().video
+    if not video_config.cache:
+        return None
+    with video_cache_lock:
+        if video_cache is None:
+            path = get_output_path().joinpath(Path(video_config.cache_path).expanduser())
+            logging.debug("Opening video cache at " + str(path))
+            video_cache = VideoCache(path)
+        return video_cache
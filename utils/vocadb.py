@@ -1,9 +1,11 @@
 import json
 import logging
+import time
 import urllib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Union, List, Dict, Optional
+from typing import Union, List, Dict, Optional, Iterator, Tuple, IO
 
 import requests
 
@@ -13,15 +15,41 @@ from i18n.i18n import _
 from models.color import ColorScheme
 from models.creators import Person, Creators, role_transform
 from models.song import Song, Image, get_manual_lyrics, Lyrics
-from models.video import Video, VideoSite, video_from_site, get_video_bilibili, str_to_date
+from models.video import Video, VideoSite, resolve_videos, prompt_video_bilibili, str_to_date
 from utils import string, japanese
 from utils.at_wiki import get_chinese_lyrics, get_japanese_lyrics
-from utils.helpers import prompt_choices, http_get
-from utils.image import download_thumbnail, pick_color
+from utils.helpers import prompt_choices, http_get, is_interactive, timed
+from utils.lyrics_store import get_lyrics_store, cached_lyrics, VOCADB
+from utils.image import download_thumbnail, pick_color, crop_black_borders, open_image, save_file
 from utils.name_converter import name_shorten
+from utils.palette import suggest_colors
 from utils.string import split, is_empty
+from utils.vocadb_index import get_vocadb_index, VocaDBIndex, FULL_SCOPE
 
 VOCADB_SONG_QUERY_URL = "https://vocadb.net/api/songs"
+VOCADB_SONG_URL = "https://vocadb.net/api/songs/{}"
+
+# one request returns everything get_song_by_name needs
+PARAMS_SONG = {
+    'fields': 'AdditionalNames,Artists,PVs,Albums,Lyrics',
+    'lang': 'Default'
+}
+
+# for songs whose lyrics are already in the lyrics store
+PARAMS_SONG_NO_LYRICS = {
+    **PARAMS_SONG,
+    'fields': 'AdditionalNames,Artists,PVs,Albums'
+}
+
+PARAMS_PARENT_LYRICS = {
+    'fields': 'Lyrics',
+    'lang': 'Default'
+}
+
+# the only keys of a search result search_song_id reads
+SEARCH_RESULT_KEYS = ('id', 'defaultName', 'artistString')
+
+FETCH_WORKERS = 8
 
 PARAMS_BROAD = {
     'start': 0,
@@ -33,25 +61,41 @@ PARAMS_BROAD = {
     'childTags': 'false',
     'artistParticipationStatus': 'Everything',
     'onlyWithPvs': 'false',
-    'getTotalCount': 'true'
+    'getTotalCount': 'false'
 }
 
 PARAMS_NARROW = {**PARAMS_BROAD,
                  'songTypes': 'Original'}
 
 
+def lookup_artist(artist: dict) -> Optional[dict]:
+    index = get_vocadb_index()
+    if index is None:
+        return None
+    if 'artist' in artist:
+        return index.get_artist(artist['artist']['id'])
+    return index.find_artist(artist['name'])
+
+
 def parse_creators(artists: list, artist_string: str) -> Creators:
     mapping: Dict[str, List[Person]] = dict()
     for artist in artists:
+        if 'artist' in artist and not is_empty(artist['artist'].get('additionalNames', "")):
+            indexed = None
+        else:
+            # fill in names the payload does not carry from the local index
+            indexed = lookup_artist(artist)
         if 'artist' in artist:
             name = artist['artist']['name']
             if artist['artist']['artistType'] == 'Vocaloid':
                 # shorten names like 初音ミク V4X
                 name = name_shorten(name)
-            names_other = split(artist['artist']['additionalNames'])
+            names_other = split(artist['artist'].get('additionalNames', ""))
         else:
             name = artist['name']
             names_other = []
+        if indexed is not None and len(names_other) == 0:
+            names_other = split(indexed['additionalNames'])
         roles = artist['roles']
         if roles == 'Default':
             roles = artist['categories']
@@ -89,22 +133,30 @@ def parse_creators(artists: list, artist_string: str) -> Creators:
     return Creators(producers, vocalists, staffs)
 
 
-def parse_videos(videos: list, date_fallback: datetime = datetime.fromtimestamp(0)) -> List[Video]:
+def parse_videos(videos: list, date_fallback: datetime = datetime.fromtimestamp(0),
+                 extra: List[Tuple[VideoSite, str, bool]] = ()) -> List[Video]:
+    """
+    Fetch the original PVs listed by vocadb, plus the extra videos, all at the same time.
+    """
     service_to_site: dict = {
         'NicoNicoDouga': VideoSite.NICO_NICO,
         'Youtube': VideoSite.YOUTUBE
     }
-    result = []
+    targets = []
     for v in videos:
         service = v['service']
         if v['pvType'] == 'Original' and service in service_to_site.keys():
-            url = v['url']
             # FIXME: only one video per site allowed for now
-            video = video_from_site(service_to_site.pop(service), url)
-            if video:
-                if video.uploaded and video.uploaded.year < 2000:
-                    video.uploaded = date_fallback
-                result.append(video)
+            targets.append((service_to_site.pop(service), v['url'], True))
+    # a separate pool, so that a site that hangs does not hold up the rest of the song after the timeout
+    fetched = resolve_videos(targets + list(extra))
+    result = []
+    for video in fetched[:len(targets)]:
+        if video:
+            if video.uploaded and video.uploaded.year < 2000:
+                video.uploaded = date_fallback
+            result.append(video)
+    result.extend(v for v in fetched[len(targets):] if v)
     return result
 
 
@@ -112,98 +164,206 @@ def parse_albums(albums: list) -> List[str]:
     return [a['defaultName'] for a in albums]
 
 
-def process_image(image_in: Path, image_out: Path) -> Optional[ColorScheme]:
+def process_image(image_in: Optional[IO[bytes]], image_out: Path) -> Optional[ColorScheme]:
+    """
+    Decode the downloaded cover once, crop it and write it to image_out. Returns None if no
+    cover was written or no colors were picked.
+    """
+    if image_in is None:
+        return None
     try:
-        if image_in is not None and image_in.exists():
-            if get_config().color.color_from_image or get_config().image.crop:
-                return pick_color(image_in, image_out)
-            image_out.unlink(missing_ok=True)
-            image_in.rename(image_out)
+        config = get_config()
+        if not config.image.crop and not config.color.color_from_image:
+            # nothing to look at; keep the bytes as they were downloaded
+            save_file(image_in, image_out)
+            return None
+        with open_image(image_in) as img:
+            if is_interactive():
+                return pick_color(img, image_out)
+            if config.image.crop:
+                threshold = None if config.image.auto_crop_threshold else config.image.crop_threshold
+                img = crop_black_borders(img, threshold)
+                img.save(image_out)
+            else:
+                save_file(image_in, image_out)
+            if config.color.color_from_image:
+                # nobody is around to pick colors in unattended runs
+                return suggest_colors(img)
     except Exception as e:
         logging.error("Can't get color from image", exc_info=e)
+    finally:
+        image_in.close()
     return None
 
 
+def finish_lyrics(lyrics_ja: str, lyrics: Optional[Lyrics]) -> Lyrics:
+    if lyrics is None:
+        lyrics = Lyrics()
+        # unattended runs always ask; the answer says whether a translation was given
+        if not get_config().wikitext.lyrics_chs_fail_fast or not is_interactive():
+            choice = prompt_choices(_("manual_trans"),
+                                    ["Sure.", "No."], key="manual_trans")
+            if choice == 1:
+                lyrics = get_manual_lyrics()
+    if not is_empty(lyrics.lyrics_jap):
+        lyrics_ja = lyrics.lyrics_jap
+    if get_config().wikitext.process_lyrics_jap:
+        lyrics_ja = string.process_lyrics_jap(lyrics_ja)
+    if get_config().wikitext.furigana_local:
+        lyrics_ja = japanese.furigana_local(lyrics_ja)
+    lyrics.lyrics_jap = lyrics_ja
+    return lyrics
+
+
 def get_song_by_name(song_name: str, name_chs: str) -> Union[Song, None]:
-    song_id = search_song_id(song_name)
+    song_id = timed("VocaDB search", search_song_id, song_name)
     if not song_id:
         return None
+    return get_song_by_id(song_id, song_name, name_chs)
+
+
+def get_song_by_id(song_id: int, song_name: str, name_chs: str) -> Song:
     logging.info(f"Fetching song details with id {song_id} from vocadb.")
-    url = f"https://vocadb.net/api/songs/{song_id}/details"
-    response = json.loads(http_get(url, use_proxy=True).text)
+    start = time.perf_counter()
+    store = get_lyrics_store()
+    stored = store.get(str(song_id), "", VOCADB) if store is not None else None
+    response = json.loads(timed("VocaDB details", http_get, VOCADB_SONG_URL.format(song_id), use_proxy=True,
+                                params=PARAMS_SONG if stored is None else PARAMS_SONG_NO_LYRICS).text)
+    index = get_vocadb_index()
+    if index is not None:
+        index.add_songs([response])
     name_ja = song_name
     name_other = [n.strip() for n in utils.string.split(",")]
     creators: Creators = parse_creators(response['artists'], response['artistString'])
-    lyricsList = response['lyricsFromParents']
-    producer_temp = creators.producers[0].name if len(creators.producers) > 0 else ""
-    if get_config().wikitext.no_lyrics:
-        lyrics = Lyrics(translator="", source_name="VOCALOID中文歌词wiki", source_url="",
-                        lyrics_jap="", lyrics_chs="")
+    if stored is None:
+        lyrics_vocadb = pick_lyrics(response.get('lyrics', []))
+        if store is not None:
+            store.put(str(song_id), "", VOCADB, vocadb_lyrics(lyrics_vocadb))
     else:
-        if len(lyricsList) > 0:
-            lyrics_ja = get_lyrics(response['lyricsFromParents'][0]['id'])
-        else:
-            logging.warning("Lyrics not found on vocadb.")
-            lyrics_ja = get_japanese_lyrics(name_ja, producer_temp)
-        lyrics = get_chinese_lyrics(song_name, producer_temp)
-        if lyrics is None:
-            lyrics = Lyrics()
-            if not get_config().wikitext.lyrics_chs_fail_fast:
-                choice = prompt_choices(_("manual_trans"),
-                                        ["Sure.", "No."])
-                if choice == 1:
-                    lyrics = get_manual_lyrics()
-        if not is_empty(lyrics.lyrics_jap):
-            lyrics_ja = lyrics.lyrics_jap
-        if get_config().wikitext.process_lyrics_jap:
-            lyrics_ja = string.process_lyrics_jap(lyrics_ja)
-        if get_config().wikitext.furigana_local:
-            lyrics_ja = japanese.furigana_local(lyrics_ja)
-        lyrics.lyrics_jap = lyrics_ja
+        lyrics_vocadb = stored.lyrics.lyrics_jap if stored.lyrics is not None else None
+    producer_temp = creators.producers[0].name if len(creators.producers) > 0 else ""
     date_fallback = datetime.fromtimestamp(0)
-    if 'song' in response:
-        date_fallback = str_to_date(response['song']['publishDate'])
-    videos = parse_videos(response['pvs'], date_fallback)
-    video_bilibili = get_video_bilibili()
-    if video_bilibili:
-        videos.append(video_bilibili)
-    albums = parse_albums(response['albums'])
-    if get_config().image.download_cover:
-        res = download_thumbnail(videos, "cover.jpg")
-        if res is None:
-            # FIXME: what if no video?
-            image_path, video = None, videos[0]
+    if 'publishDate' in response:
+        date_fallback = str_to_date(response['publishDate'])
+    # ask before starting the fetches so that the user is not kept waiting
+    bilibili = prompt_video_bilibili()
+    # everything below only depends on the details response, so the fetches run side by side
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        lyrics_ja_future, lyrics_future = None, None
+        if not get_config().wikitext.no_lyrics:
+            if lyrics_vocadb is None:
+                lyrics_ja_future = executor.submit(timed, "Japanese lyrics", get_lyrics_fallback,
+                                                   response.get('originalVersionId'), name_ja, producer_temp)
+            lyrics_future = executor.submit(timed, "atwiki Chinese lyrics",
+                                            get_chinese_lyrics, song_name, producer_temp)
+        bilibili_target = [(VideoSite.BILIBILI, *bilibili)] if bilibili else []
+        videos = timed("videos", parse_videos, response['pvs'], date_fallback, bilibili_target)
+        cover_future = executor.submit(timed, "cover download", download_thumbnail, videos) \
+            if get_config().image.download_cover else None
+        albums = parse_albums(response['albums'])
+        if get_config().wikitext.no_lyrics:
+            lyrics = Lyrics(translator="", source_name="VOCALOID中文歌词wiki", source_url="",
+                            lyrics_jap="", lyrics_chs="")
         else:
-            image_path, video = res
+            lyrics_ja = lyrics_ja_future.result() if lyrics_ja_future else lyrics_vocadb
+            lyrics = finish_lyrics(lyrics_ja, lyrics_future.result())
+        res = cover_future.result() if cover_future else None
+    logging.debug(f"Fetching everything for {song_name} took {(time.perf_counter() - start) * 1000:.0f} ms")
+    if res is None:
+        # FIXME: what if no video?
+        cover, video = None, videos[0]
     else:
-        image_path, video = None, videos[0]
+        cover, video = res
     cover_name = f"{name_chs}封面.jpg"
-    cover_path = get_output_path().joinpath(cover_name)
-    colors = process_image(image_path, cover_path)
+    cover_path = get_output_path().joinpath(utils.string.file_name(cover_name))
+    colors = process_image(cover, cover_path)
     illustrators = creators.staffs.get("曲绘", None)
-    image: Image = Image(image_path, cover_name, video.url, illustrators)
+    image: Image = Image(cover_path if cover is not None and cover_path.exists() else None,
+                         cover_name, video.url, illustrators)
     return Song(name_ja, name_chs, name_other, creators, lyrics, image, videos, albums, colors)
 
 
-def get_lyrics(lyrics_id: str) -> str:
-    logging.info("Getting Japanese lyrics from vocadb.")
-    url = f"https://vocadb.net/api/songs/lyrics/{lyrics_id}?v=25"
-    response = json.loads(http_get(url, use_proxy=True).text)
-    return response['value']
+def pick_lyrics(lyrics: list) -> Optional[str]:
+    if len(lyrics) == 0:
+        return None
+    original = [entry for entry in lyrics if entry.get('translationType') == 'Original']
+    return (original[0] if len(original) > 0 else lyrics[0])['value']
+
+
+def vocadb_lyrics(lyrics: Optional[str]) -> Optional[Lyrics]:
+    return Lyrics(source_name="VocaDB", lyrics_jap=lyrics) if lyrics is not None else None
+
+
+def get_lyrics(song_id: int) -> Optional[str]:
+    def fetch() -> Optional[Lyrics]:
+        logging.info("Getting Japanese lyrics from vocadb.")
+        response = json.loads(http_get(VOCADB_SONG_URL.format(song_id), use_proxy=True,
+                                       params=PARAMS_PARENT_LYRICS).text)
+        return vocadb_lyrics(pick_lyrics(response.get('lyrics', [])))
+
+    lyrics = cached_lyrics(str(song_id), "", VOCADB, fetch)
+    return lyrics.lyrics_jap if lyrics is not None else None
+
+
+def get_lyrics_fallback(original_id: Optional[int], name: str, producer: str) -> str:
+    # derived songs usually only have lyrics on the original
+    if original_id is not None:
+        lyrics = get_lyrics(original_id)
+        if lyrics is not None:
+            return lyrics
+    logging.warning("Lyrics not found on vocadb.")
+    return get_japanese_lyrics(name, producer)
+
+
+def iter_vocadb(params: dict, page_size: int = 50, cache: bool = True) -> Iterator[dict]:
+    """
+    Yield every song matching a VocaDB search, fetching one page at a time.
+    """
+    start = 0
+    while True:
+        page = {**params,
+                'start': start,
+                'maxResults': page_size,
+                'getTotalCount': 'false'}
+        items = json.loads(http_get(VOCADB_SONG_QUERY_URL, use_proxy=True, cache=cache, params=page).text)['items']
+        yield from items
+        if len(items) < page_size:
+            return
+        start += len(items)
+
+
+def index_is_fresh(index: VocaDBIndex) -> bool:
+    synced = index.synced_at(FULL_SCOPE)
+    return synced is not None and time.time() - synced <= get_config().index.fresh_hours * 3600
 
 
 def search_vocadb(name: str, params: dict) -> list:
+    index = get_vocadb_index()
+    local = []
+    if index is not None:
+        local = [{key: song[key] for key in SEARCH_RESULT_KEYS}
+                 for song in index.find_songs(name, params.get('songTypes'))]
+        # songs published since the last full sync would be missing from the index
+        if len(local) > 0 and index_is_fresh(index):
+            logging.debug(f"Found {len(local)} songs named {name} in the local index")
+            return local
     params = {**params,
               'query': name}
     try:
         response = json.loads(http_get(VOCADB_SONG_QUERY_URL, use_proxy=True, params=params).text)
         response = response['items']
     except Exception as e:
+        if len(local) > 0:
+            logging.warning(f"Searching on Vocadb failed. Using {len(local)} songs from the local index.")
+            logging.debug("Detailed error: ", exc_info=e)
+            return local
         logging.error("An error occurred while searching on Vocadb")
         logging.debug("Detailed error: ", exc_info=e)
         return []
-    response = [song for song in response if song['defaultName'].strip() == name]
-    return response
+    if index is not None:
+        index.add_songs(response)
+    return [{key: song[key] for key in SEARCH_RESULT_KEYS}
+            for song in response if song['defaultName'].strip() == name]
 
 
 def search_narrow(name: str) -> list:
@@ -214,14 +374,26 @@ def search_broad(name: str) -> list:
     return search_vocadb(name, PARAMS_BROAD)
 
 
+def merge_results(shown: list, more: list) -> list:
+    seen = {song['id'] for song in shown}
+    return [song for song in more if song['id'] not in seen]
+
+
 def search_song_id(name: str) -> Union[str, None]:
     logging.info(f"Searching for song named {name} on Vocadb")
-    response = search_narrow(name)
+    # send the broad search right away so that it is ready if the narrow one is not enough
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        narrow_future = executor.submit(timed, "VocaDB narrow search", search_narrow, name)
+        broad_future = executor.submit(timed, "VocaDB broad search", search_broad, name)
+    finally:
+        executor.shutdown(wait=False)
+    response = narrow_future.result()
     narrow: bool = True
     if len(response) == 0:
         narrow = False
         logging.info(_("narrow_to_broad"))
-        response = search_broad(name)
+        response = broad_future.result()
     if len(response) == 0:
         logging.error(_("no_vocadb"))
         return None
@@ -229,12 +401,16 @@ def search_song_id(name: str) -> Union[str, None]:
         options = [f"{song['defaultName']} by {song['artistString']}"
                    for song in response]
         options.append("None of the above.")
-        result = prompt_choices(_("multiple_vocadb_results"), options)
+        result = prompt_choices(_("multiple_vocadb_results"), options, key="vocadb_song")
         if result == len(options):
             if narrow:
                 narrow = False
                 logging.info(_("broader_search"))
-                response = search_broad(name)
+                # only offer the songs the user has not rejected yet
+                response = merge_results(response, broad_future.result())
+                if len(response) == 0:
+                    logging.error(_("no_vocadb"))
+                    return None
                 continue
             else:
                 logging.error(_("no_vocadb"))
@@ -0,0 +1,291 @@
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional, Union
+
+from config.config import get_config, get_output_path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS songs (
+    id INTEGER PRIMARY KEY,
+    default_name TEXT NOT NULL,
+    additional_names TEXT,
+    artist_string TEXT,
+    song_type TEXT,
+    publish_date TEXT,
+    create_date TEXT,
+    version INTEGER
+);
+CREATE INDEX IF NOT EXISTS songs_default_name ON songs(default_name);
+CREATE TABLE IF NOT EXISTS artists (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    additional_names TEXT,
+    artist_type TEXT
+);
+CREATE INDEX IF NOT EXISTS artists_name ON artists(name);
+CREATE TABLE IF NOT EXISTS song_artists (
+    song_id INTEGER NOT NULL,
+    artist_id INTEGER NOT NULL,
+    PRIMARY KEY (song_id, artist_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS song_artists_artist ON song_artists(artist_id);
+CREATE TABLE IF NOT EXISTS sync_state (
+    scope TEXT PRIMARY KEY,
+    watermark TEXT NOT NULL,
+    synced REAL
+);
+"""
+
+# the sync_vocadb.py scope that covers every song on VocaDB
+FULL_SCOPE = "songs"
+
+# external content FTS tables kept in sync with triggers
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS songs_fts USING fts5(
+    default_name, additional_names, artist_string, content='songs', content_rowid='id', tokenize='{tokenizer}');
+CREATE TRIGGER IF NOT EXISTS songs_ai AFTER INSERT ON songs BEGIN
+    INSERT INTO songs_fts(rowid, default_name, additional_names, artist_string)
+    VALUES (new.id, new.default_name, new.additional_names, new.artist_string);
+END;
+CREATE TRIGGER IF NOT EXISTS songs_ad AFTER DELETE ON songs BEGIN
+    INSERT INTO songs_fts(songs_fts, rowid, default_name, additional_names, artist_string)
+    VALUES ('delete', old.id, old.default_name, old.additional_names, old.artist_string);
+END;
+CREATE TRIGGER IF NOT EXISTS songs_au AFTER UPDATE ON songs BEGIN
+    INSERT INTO songs_fts(songs_fts, rowid, default_name, additional_names, artist_string)
+    VALUES ('delete', old.id, old.default_name, old.additional_names, old.artist_string);
+    INSERT INTO songs_fts(rowid, default_name, additional_names, artist_string)
+    VALUES (new.id, new.default_name, new.additional_names, new.artist_string);
+END;
+CREATE VIRTUAL TABLE IF NOT EXISTS artists_fts USING fts5(
+    name, additional_names, content='artists', content_rowid='id', tokenize='{tokenizer}');
+CREATE TRIGGER IF NOT EXISTS artists_ai AFTER INSERT ON artists BEGIN
+    INSERT INTO artists_fts(rowid, name, additional_names) VALUES (new.id, new.name, new.additional_names);
+END;
+CREATE TRIGGER IF NOT EXISTS artists_ad AFTER DELETE ON artists BEGIN
+    INSERT INTO artists_fts(artists_fts, rowid, name, additional_names)
+    VALUES ('delete', old.id, old.name, old.additional_names);
+END;
+CREATE TRIGGER IF NOT EXISTS artists_au AFTER UPDATE ON artists BEGIN
+    INSERT INTO artists_fts(artists_fts, rowid, name, additional_names)
+    VALUES ('delete', old.id, old.name, old.additional_names);
+    INSERT INTO artists_fts(rowid, name, additional_names) VALUES (new.id, new.name, new.additional_names);
+END;
+"""
+
+# fields missing from a payload (e.g. additionalNames in search results) keep their stored value
+UPSERT_SONG = """
+INSERT INTO songs(id, default_name, additional_names, artist_string, song_type, publish_date, create_date, version)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET
+    default_name = excluded.default_name,
+    additional_names = COALESCE(excluded.additional_names, songs.additional_names),
+    artist_string = COALESCE(excluded.artist_string, songs.artist_string),
+    song_type = COALESCE(excluded.song_type, songs.song_type),
+    publish_date = COALESCE(excluded.publish_date, songs.publish_date),
+    create_date = COALESCE(excluded.create_date, songs.create_date),
+    version = COALESCE(excluded.version, songs.version)
+"""
+
+UPSERT_ARTIST = """
+INSERT INTO artists(id, name, additional_names, artist_type) VALUES (?, ?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET
+    name = excluded.name,
+    additional_names = COALESCE(excluded.additional_names, artists.additional_names),
+    artist_type = COALESCE(excluded.artist_type, artists.artist_type)
+"""
+
+SONG_COLUMNS = "id, default_name, additional_names, artist_string, song_type, publish_date"
+
+# trigram needs at least 3 characters; shorter queries fall back to LIKE
+TRIGRAM_MIN_LENGTH = 3
+
+
+def song_to_dict(row: tuple) -> dict:
+    return {
+        'id': row[0],
+        'defaultName': row[1],
+        'additionalNames': row[2] or "",
+        'artistString': row[3] or "",
+        'songType': row[4] or "",
+        'publishDate': row[5]
+    }
+
+
+def artist_to_dict(row: tuple) -> dict:
+    return {
+        'id': row[0],
+        'name': row[1],
+        'additionalNames': row[2] or "",
+        'artistType': row[3] or ""
+    }
+
+
+def fts_phrase(query: str) -> str:
+    return '"' + query.replace('"', '""') + '"'
+
+
+class VocaDBIndex:
+    """
+    Local SQLite mirror of VocaDB songs and artists. Rows are filled from whatever VocaDB
+    payloads pass through the program and from sync_vocadb.py; exact name lookups use a
+    B-tree index and substring searches over all names use FTS5. Since rows added on the way
+    are not a complete picture, the index is only trusted on its own for a while after a sync
+    of all songs.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(sync_state)")]
+            if "synced" not in columns:
+                # indexes created before sync times were recorded
+                self.connection.execute("ALTER TABLE sync_state ADD COLUMN synced REAL")
+            try:
+                self.connection.executescript(FTS_SCHEMA.format(tokenizer="trigram"))
+                self.trigram = True
+            except sqlite3.OperationalError:
+                # SQLite older than 3.34 has no trigram tokenizer
+                self.connection.executescript(FTS_SCHEMA.format(tokenizer="unicode61"))
+                self.trigram = False
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def add_artists(self, artists: Iterable[dict]):
+        rows = [(a['id'], a['name'], a.get('additionalNames'), a.get('artistType'))
+                for a in artists if 'id' in a and 'name' in a]
+        with self.lock, self.connection:
+            self.connection.executemany(UPSERT_ARTIST, rows)
+
+    def add_songs(self, songs: Iterable[dict]):
+        song_rows = []
+        artists = []
+        links = []
+        for s in songs:
+            if 'id' not in s or 'defaultName' not in s:
+                continue
+            song_rows.append((s['id'], s['defaultName'], s.get('additionalNames'), s.get('artistString'),
+                              s.get('songType'), s.get('publishDate'), s.get('createDate'), s.get('version')))
+            for entry in s.get('artists', []):
+                if 'artist' in entry:
+                    artists.append(entry['artist'])
+                    links.append((s['id'], entry['artist']['id']))
+        with self.lock, self.connection:
+            self.connection.executemany(UPSERT_SONG, song_rows)
+            self.connection.executemany(UPSERT_ARTIST, [(a['id'], a['name'], a.get('additionalNames'),
+                                                         a.get('artistType')) for a in artists])
+            self.connection.executemany("INSERT OR IGNORE INTO song_artists(song_id, artist_id) VALUES (?, ?)",
+                                        links)
+
+    def find_songs(self, name: str, song_types: Optional[str] = None) -> List[dict]:
+        sql = f"SELECT {SONG_COLUMNS} FROM songs WHERE default_name = ?"
+        args = [name]
+        if song_types:
+            types = song_types.split(",")
+            sql += f" AND song_type IN ({','.join('?' * len(types))})"
+            args.extend(types)
+        # the order of VocaDB's PublishDate sort, newest first, so that the first choice is the same
+        # song whether the index or the network answers
+        sql += " ORDER BY publish_date DESC, id DESC"
+        with self.lock:
+            return [song_to_dict(row) for row in self.connection.execute(sql, args)]
+
+    def search(self, query: str, limit: int = 20) -> List[dict]:
+        with self.lock:
+            if self.trigram and len(query) >= TRIGRAM_MIN_LENGTH:
+                rows = self.connection.execute(
+                    f"SELECT {SONG_COLUMNS} FROM songs WHERE id IN "
+                    f"(SELECT rowid FROM songs_fts WHERE songs_fts MATCH ? ORDER BY rank LIMIT ?)",
+                    (fts_phrase(query), limit))
+            else:
+                pattern = "%" + query + "%"
+                rows = self.connection.execute(
+                    f"SELECT {SONG_COLUMNS} FROM songs WHERE default_name LIKE ? OR additional_names LIKE ? "
+                    f"OR artist_string LIKE ? LIMIT ?", (pattern, pattern, pattern, limit))
+            return [song_to_dict(row) for row in rows]
+
+    def search_artists(self, query: str, limit: int = 20) -> List[dict]:
+        with self.lock:
+            if self.trigram and len(query) >= TRIGRAM_MIN_LENGTH:
+                rows = self.connection.execute(
+                    "SELECT id, name, additional_names, artist_type FROM artists WHERE id IN "
+                    "(SELECT rowid FROM artists_fts WHERE artists_fts MATCH ? ORDER BY rank LIMIT ?)",
+                    (fts_phrase(query), limit))
+            else:
+                pattern = "%" + query + "%"
+                rows = self.connection.execute(
+                    "SELECT id, name, additional_names, artist_type FROM artists "
+                    "WHERE name LIKE ? OR additional_names LIKE ? LIMIT ?", (pattern, pattern, limit))
+            return [artist_to_dict(row) for row in rows]
+
+    def get_artist(self, artist_id: int) -> Optional[dict]:
+        with self.lock:
+            row = self.connection.execute("SELECT id, name, additional_names, artist_type FROM artists WHERE id = ?",
+                                          (artist_id,)).fetchone()
+        return artist_to_dict(row) if row else None
+
+    def find_artist(self, name: str) -> Optional[dict]:
+        with self.lock:
+            row = self.connection.execute("SELECT id, name, additional_names, artist_type FROM artists WHERE name = ?",
+                                          (name,)).fetchone()
+        return artist_to_dict(row) if row else None
+
+    def songs_by_artist(self, artist_id: int) -> List[dict]:
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT {SONG_COLUMNS} FROM songs WHERE id IN "
+                f"(SELECT song_id FROM song_artists WHERE artist_id = ?) ORDER BY publish_date", (artist_id,))
+            return [song_to_dict(row) for row in rows]
+
+    def get_watermark(self, scope: str) -> Optional[str]:
+        with self.lock:
+            row = self.connection.execute("SELECT watermark FROM sync_state WHERE scope = ?", (scope,)).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, scope: str, watermark: str):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO sync_state(scope, watermark, synced) VALUES (?, ?, ?)",
+                                    (scope, watermark, time.time()))
+
+    def synced_at(self, scope: str) -> Optional[float]:
+        """
+        When a sync of the scope last finished, as a unix timestamp.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT synced FROM sync_state WHERE scope = ?", (scope,)).fetchone()
+        return row[0] if row else None
+
+    def count(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM songs").fetchone()[0]
+
+
+vocadb_index: Optional[VocaDBIndex] = None
+vocadb_index_lock = threading.Lock()
+
+
+def open_vocadb_index() -> VocaDBIndex:
+    global vocadb_index
+    with vocadb_index_lock:
+        if vocadb_index is None:
+            path = get_output_path().joinpath(Path(get_config().index.path).expanduser())
+            logging.debug("Opening local VocaDB index at " + str(path))
+            vocadb_index = VocaDBIndex(path)
+        return vocadb_index
+
+
+def get_vocadb_index() -> Optional[VocaDBIndex]:
+    if not get_config().index.enabled:
+        return None
+    return open_vocadb_index()